@@ -1,19 +1,38 @@
-from flask import Flask, render_template, jsonify, request, Response, stream_with_context, session, redirect, url_for
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context, session, redirect, url_for, copy_current_request_context
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
 from pyzotero import zotero
-from recommender import rerank_paper
+from recommender import rerank_paper, corpus_profile, corpus_fingerprint, loaded_encoders, get_encoder, encode_texts, EMBEDDING_MODEL
 from paper import ArxivPaper
 import arxiv
 import feedparser
-from datetime import datetime
+from datetime import datetime, timedelta
 from loguru import logger
 import json
+import re
 import time
+import calendar
 import hashlib
+import threading
+import uuid
 from pathlib import Path
 from functools import wraps
+from collections import OrderedDict
+import llm
+import replay
+from memory_cache import MemoryLRU
+from cache_store import CacheStore
+from cache_janitor import CacheJanitor
+from embedding_cache import GLOBAL_EMBEDDING_CACHE
+from metrics import Registry, Counter, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from singleflight import SingleFlight, StreamFlight
+from prewarm import Prewarmer
+from pipeline import Pipeline, RunContext, FeedSource, SeenFilter, LibraryFilter, FetchDetails, ArchiveStage, ArchiveSource, ScoreStage, EnrichStage, FormatStage
+from candidate_archive import CandidateArchive, archive_directory
+from seen_set import SeenSet
+from library_index import LibraryIndex
+from profiling import RunProfiler, ProfilerBusy, profiled
 
 load_dotenv()
 
@@ -27,8 +46,119 @@ MAX_PAPER_NUM = int(os.getenv('MAX_PAPER_NUM', '50'))
 BATCH_SIZE = int(os.getenv('BATCH_SIZE', '50'))  # ArXiv API 批次大小
 CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
 FETCH_CODE_URL = os.getenv('FETCH_CODE_URL', 'false').lower() == 'true'  # 是否获取代码链接（会慢很多）
+ENCODER_BACKEND = os.getenv('ENCODER_BACKEND', 'torch')  # 嵌入模型后端：torch / onnx / onnx-int8
+EMBEDDING_DTYPE = os.getenv('EMBEDDING_DTYPE', 'float16')  # 论文嵌入的存储精度：float16 / int8
+INTEREST_CENTROIDS = int(os.getenv('INTEREST_CENTROIDS', '0'))  # 按兴趣簇（取最匹配的簇）打分的簇数，0 表示按整体兴趣向量打分
 CACHE_DIR = Path(__file__).parent / 'cache'
 CACHE_DIR.mkdir(exist_ok=True)
+# 录制 / 回放外部 HTTP 请求（arXiv、Zotero、paperswithcode、OpenAI）：record / replay / auto，留空则直连
+REPLAY_MODE = os.getenv('REPLAY_MODE', '')
+if REPLAY_MODE:
+    replay.install(REPLAY_MODE, os.getenv('REPLAY_DIR', str(CACHE_DIR / 'replay')), os.getenv('REPLAY_LATENCY'))
+# 按需生成 TLDR 使用的 LLM：配置了 OPENAI_API_KEY 时调用 API，否则使用本地模型（首次使用时下载）
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY') or None
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+LLM_MODEL_NAME = os.getenv('MODEL_NAME', 'gpt-4o')
+TLDR_LANGUAGE = os.getenv('LANGUAGE', 'English')
+# 本地候选论文存档：每天抓取的候选论文连同嵌入追加保存，date_range 请求直接在存档上打分
+CANDIDATE_ARCHIVE_ENABLED = os.getenv('CANDIDATE_ARCHIVE', 'true').lower() == 'true'
+CANDIDATE_ARCHIVE = CandidateArchive(
+    archive_directory(os.getenv('CANDIDATE_ARCHIVE_DIR', str(CACHE_DIR / 'archive')), f"{EMBEDDING_MODEL}:{ENCODER_BACKEND}"),
+    f"{EMBEDDING_MODEL}:{ENCODER_BACKEND}",
+) if CANDIDATE_ARCHIVE_ENABLED else None
+DATE_RANGE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2},\d{4}-\d{2}-\d{2}$')
+
+# 已推荐过滤：之前某天已推荐给该用户的论文（交叉列出、更新版本、节假日回退）不再获取和打分
+SEEN_FILTER_ENABLED = os.getenv('SEEN_FILTER', 'true').lower() == 'true'
+SHOW_UPDATED_PAPERS = os.getenv('SHOW_UPDATED_PAPERS', 'false').lower() == 'true'  # 已推荐论文有新版本时仍然推荐
+# 最近使用的用户各保留一个 SeenSet，超出上限时关闭最久未用的（数据已落盘，下次重新读取）
+SEEN_SETS_MAX = int(os.getenv('SEEN_SETS_MAX', '256'))
+SEEN_SETS = OrderedDict()
+SEEN_SETS_LOCK = threading.Lock()
+
+# 已在 Zotero 库中的论文（相同 arXiv ID、DOI 或标题）不再获取和打分
+LIBRARY_FILTER_ENABLED = os.getenv('LIBRARY_FILTER', 'true').lower() == 'true'
+
+# 性能剖析：PROFILE_PIPELINE=true 时剖析每次推荐运行；PROFILE_REQUESTS=true 时还剖析带 profile=true 参数的 SSE 请求
+PROFILE_PIPELINE = os.getenv('PROFILE_PIPELINE', 'false').lower() == 'true'
+# 请求参数 profile=true 会让整次运行跑在 cProfile 下并写文件，默认不接受，仅供排查时临时打开
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', 'false').lower() == 'true'
+PROFILE_DIR = Path(os.getenv('PROFILE_DIR', str(CACHE_DIR / 'profiles')))
+# Zotero 论文库、候选论文和推荐结果统一存放在 SQLite（WAL 模式）中，按行更新
+CACHE_STORE = CacheStore(os.getenv('CACHE_DB', str(CACHE_DIR / 'cache.sqlite3')))
+# 进程内已解析的 Zotero 语料库缓存，按论文 JSON 的大小计算容量
+CORPUS_MEMORY_CACHE = MemoryLRU(int(float(os.getenv('CORPUS_MEMORY_CACHE_MB', '512')) * 1024 * 1024))
+# 论文库成员索引，按论文库版本失效；不持有论文库本身
+LIBRARY_INDEX_CACHE = MemoryLRU(int(float(os.getenv('LIBRARY_INDEX_CACHE_MB', '32')) * 1024 * 1024))
+# 合并并发的重复请求：同一用户同时发起的相同操作只执行一次，其余请求共享结果
+ZOTERO_FLIGHTS = SingleFlight()
+RECOMMENDATION_FLIGHTS = SingleFlight()
+RECOMMENDATION_STREAMS = StreamFlight()
+TLDR_STREAMS = StreamFlight()
+# 缓存清理：过期推荐结果和候选论文按 TTL 删除，超出全局 / 单用户容量时按最近访问时间淘汰
+RECOMMENDATION_CACHE_TTL = timedelta(hours=24)
+CACHE_JANITOR = CacheJanitor(
+    CACHE_STORE, CACHE_DIR,
+    max_bytes=int(float(os.getenv('CACHE_MAX_MB', '2048')) * 1024 * 1024),
+    user_max_bytes=int(float(os.getenv('CACHE_USER_MAX_MB', '256')) * 1024 * 1024),
+    recommendation_ttl=RECOMMENDATION_CACHE_TTL,
+    candidate_ttl=timedelta(days=float(os.getenv('CACHE_CANDIDATE_TTL_DAYS', '7'))),
+    interval=float(os.getenv('CACHE_JANITOR_INTERVAL', '3600')),
+    on_evict_library=lambda cache_key: (CORPUS_MEMORY_CACHE.pop(cache_key), LIBRARY_INDEX_CACHE.pop(cache_key)),
+    enrichment_ttl=timedelta(days=float(os.getenv('CACHE_ENRICHMENT_TTL_DAYS', '30'))),
+)
+
+# Prometheus 指标：各阶段耗时、各类缓存命中情况、进行中的 SSE 流与已加载的模型
+METRICS = Registry()
+STAGE_SECONDS = METRICS.histogram('paper_web_stage_seconds', 'Duration of recommendation pipeline stages', ('stage',))
+CACHE_LOOKUPS = Counter('paper_web_cache_lookups', 'Cache lookups by cache and result', ('cache', 'result'))
+SSE_CLIENTS = METRICS.gauge('paper_web_sse_clients', 'Connected SSE recommendation clients')
+SSE_CLIENTS.inc(0)
+# 流水线阶段名到指标阶段名；打分阶段的耗时由 rerank_paper 拆分为 encode 与 score 记录
+PIPELINE_STAGE_METRICS = {'source': 'feed_parse', 'fetch': 'arxiv_fetch', 'archive': 'archive', 'code_url': 'enrich', 'format': 'format'}
+
+def record_cache_lookup(cache, hits=0, misses=0):
+    """记录缓存命中与未命中次数"""
+    if hits:
+        CACHE_LOOKUPS.inc(int(hits), cache=cache, result='hit')
+    if misses:
+        CACHE_LOOKUPS.inc(int(misses), cache=cache, result='miss')
+
+def collect_cache_lookups(result):
+    samples = {(cache,): v for (cache, r), v in CACHE_LOOKUPS.samples().items() if r == result}
+    for cache, stats in (('embedding', GLOBAL_EMBEDDING_CACHE.stats()), ('corpus_memory', CORPUS_MEMORY_CACHE.stats())):
+        samples[(cache,)] = stats['hits' if result == 'hit' else 'misses']
+    return samples
+
+METRICS.callback('paper_web_cache_hits_total', 'Cache hits by cache', 'counter', lambda: collect_cache_lookups('hit'), ('cache',))
+METRICS.callback('paper_web_cache_misses_total', 'Cache misses by cache', 'counter', lambda: collect_cache_lookups('miss'), ('cache',))
+METRICS.callback('paper_web_cache_bytes', 'Bytes held by in-process caches', 'gauge', lambda: {
+    ('embedding',): GLOBAL_EMBEDDING_CACHE.stats()['bytes'],
+    ('corpus_memory',): CORPUS_MEMORY_CACHE.stats()['bytes'],
+    ('library_index',): LIBRARY_INDEX_CACHE.stats()['bytes'],
+}, ('cache',))
+METRICS.callback('paper_web_sse_streams_in_flight', 'Recommendation pipelines running for SSE clients', 'gauge', lambda: {(): RECOMMENDATION_STREAMS.in_flight()})
+METRICS.callback('paper_web_singleflight_in_flight', 'Coalesced calls in flight', 'gauge', lambda: {
+    ('zotero',): ZOTERO_FLIGHTS.in_flight(),
+    ('recommendations',): RECOMMENDATION_FLIGHTS.in_flight(),
+    ('tldr',): TLDR_STREAMS.in_flight(),
+}, ('flight',))
+METRICS.callback('paper_web_loaded_models', 'Embedding models loaded in this process', 'gauge', lambda: {
+    (model, backend): 1 for model, backend in loaded_encoders()
+}, ('model', 'backend'))
+
+def observe_stage(stage):
+    """装饰器：记录函数耗时到阶段直方图"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
 
 # 获取当前用户的 Zotero 配置
 def get_user_zotero_config():
@@ -47,6 +177,34 @@ def get_user_cache_dir():
     user_cache_dir.mkdir(parents=True, exist_ok=True)
     return user_cache_dir
 
+def get_seen_set():
+    """当前用户已推荐论文的集合（每个用户一个实例，保存在用户缓存目录中）"""
+    user_cache_dir = get_user_cache_dir()
+    if user_cache_dir is None:
+        return None
+    with SEEN_SETS_LOCK:
+        seen_set = SEEN_SETS.get(user_cache_dir)
+        if seen_set is None:
+            seen_set = SEEN_SETS[user_cache_dir] = SeenSet(user_cache_dir / 'seen_papers.txt')
+            while len(SEEN_SETS) > SEEN_SETS_MAX:
+                SEEN_SETS.popitem(last=False)
+        else:
+            SEEN_SETS.move_to_end(user_cache_dir)
+        return seen_set
+
+def get_library_index(corpus):
+    """当前用户论文库的成员索引；论文库版本不变时复用已建好的索引"""
+    cache_key = get_cache_key()
+    stamp = CACHE_STORE.library_stamp(cache_key) if CACHE_ENABLED and cache_key else None
+    if stamp is not None:
+        index = LIBRARY_INDEX_CACHE.get(cache_key, stamp)
+        if index is not None:
+            return index
+    index = LibraryIndex.from_corpus(corpus)
+    if stamp is not None:
+        LIBRARY_INDEX_CACHE.put(cache_key, index, index.nbytes(), stamp)
+    return index
+
 def get_cache_key():
     """生成缓存键（基于用户 ID 和 Zotero ID）"""
     user_id = session.get('user_id')
@@ -56,15 +214,95 @@ def get_cache_key():
     key_str = f"{user_id}_{zotero_id}"
     return hashlib.md5(key_str.encode()).hexdigest()
 
-def get_cache_path():
-    """获取缓存文件路径"""
+def get_embedding_store_path():
+    """获取 Zotero 论文嵌入矩阵的存储路径（不含扩展名）"""
+    if not CACHE_ENABLED:
+        return None
     user_cache_dir = get_user_cache_dir()
     if not user_cache_dir:
         return None
     cache_key = get_cache_key()
     if not cache_key:
         return None
-    return user_cache_dir / f"zotero_cache_{cache_key}.json"
+    return user_cache_dir / f"corpus_embeddings_{cache_key}"
+
+def get_selection_key(selected_paper_keys=None):
+    """生成参考文章集合的键（与顺序无关）"""
+    keys_str = ','.join(sorted(selected_paper_keys)) if selected_paper_keys else 'all'
+    return hashlib.md5(keys_str.encode()).hexdigest()
+
+def get_interest_index_key(selected_paper_keys=None):
+    """生成兴趣簇索引的键（同一用户的同一组参考文章共用一个索引）"""
+    cache_key = get_cache_key()
+    if not cache_key:
+        return None
+    return f"{cache_key}_{get_selection_key(selected_paper_keys)}"
+
+def get_selected_paper_keys():
+    """从请求参数解析参考文章集合：优先使用已保存的参考集 reference_set，其次是逗号分隔的 selected_paper_keys"""
+    reference_set = request.args.get('reference_set')
+    if reference_set:
+        paper_keys = CACHE_STORE.load_reference_set(get_cache_key(), reference_set)
+        if paper_keys is None:
+            raise LookupError(f"参考集不存在: {reference_set}")
+        return paper_keys or None
+    selected_paper_keys_str = request.args.get('selected_paper_keys', None)
+    if not selected_paper_keys_str:
+        return None
+    return {k.strip() for k in selected_paper_keys_str.split(',') if k.strip()} or None
+
+@observe_stage('profile')
+def get_corpus_profile(corpus, selected_paper_keys=None):
+    """获取参考文章的兴趣向量；论文库与选择不变时直接复用 SQLite 中缓存的向量"""
+    if 0 < INTEREST_CENTROIDS < len(corpus):
+        return None
+    cache_key = get_cache_key()
+    selection = get_selection_key(selected_paper_keys)
+    model_id = f"{EMBEDDING_MODEL}:{ENCODER_BACKEND}"
+    stamp = corpus_fingerprint(corpus)
+    if CACHE_ENABLED and cache_key:
+        profile = CACHE_STORE.load_profile(cache_key, selection, model_id, stamp)
+        record_cache_lookup('profile', hits=profile is not None, misses=profile is None)
+        if profile is not None:
+            return profile
+    profile = corpus_profile(corpus, backend=ENCODER_BACKEND, corpus_store=get_embedding_store_path(), store_dtype=EMBEDDING_DTYPE)
+    if profile is not None and CACHE_ENABLED and cache_key:
+        CACHE_STORE.save_profile(cache_key, selection, model_id, stamp, profile)
+    return profile
+
+def rank_candidates(papers, corpus, selected_paper_keys=None, profile=None):
+    """计算推荐分数并返回前 MAX_PAPER_NUM 篇
+    
+    兴趣向量不变时，之前打过分的候选论文直接复用分数，只对新出现的论文编码打分；
+    兴趣向量变化（论文库或参考文章变化）时全部重新打分。
+    """
+    if profile is None:
+        profile = get_corpus_profile(corpus, selected_paper_keys)
+    cache_key = get_cache_key()
+    known_scores = None
+    use_centroids = 0 < INTEREST_CENTROIDS < len(corpus)
+    if (profile is not None or use_centroids) and CACHE_ENABLED and cache_key:
+        selection = get_selection_key(selected_paper_keys)
+        # 兴趣簇打分与兴趣向量打分的分数不可混用
+        scoring = f"centroids{INTEREST_CENTROIDS}" if use_centroids else "profile"
+        profile_version = hashlib.md5(f"{EMBEDDING_MODEL}:{ENCODER_BACKEND}:{scoring}:{corpus_fingerprint(corpus)}".encode()).hexdigest()
+        known_scores = CACHE_STORE.load_scores(cache_key, selection, profile_version)
+    reused = set(known_scores) if known_scores else set()
+    timings = {}
+    ranked = rerank_paper(
+        papers, corpus, backend=ENCODER_BACKEND, corpus_store=get_embedding_store_path(), store_dtype=EMBEDDING_DTYPE,
+        n_centroids=INTEREST_CENTROIDS, index_key=get_interest_index_key(selected_paper_keys), top_k=MAX_PAPER_NUM,
+        profile=profile, known_scores=known_scores, timings=timings,
+    )
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    if known_scores is not None:
+        new_scores = {arxiv_id: score for arxiv_id, score in known_scores.items() if arxiv_id not in reused}
+        record_cache_lookup('score', hits=len(papers) - len(new_scores), misses=len(new_scores))
+        if new_scores:
+            CACHE_STORE.save_scores(cache_key, selection, profile_version, new_scores)
+        logger.info(f"复用 {len(papers) - len(new_scores)} 篇候选论文的已有分数，新打分 {len(new_scores)} 篇")
+    return ranked
 
 def get_recommendations_cache_key(arxiv_query, date_range=None, selected_paper_keys=None):
     """生成推荐结果缓存键"""
@@ -76,16 +314,6 @@ def get_recommendations_cache_key(arxiv_query, date_range=None, selected_paper_k
     key_str = f"{user_id}_{zotero_id}_{arxiv_query}_{date_range or 'all'}_{keys_str}"
     return hashlib.md5(key_str.encode()).hexdigest()
 
-def get_recommendations_cache_path(arxiv_query, date_range=None, selected_paper_keys=None):
-    """获取推荐结果缓存文件路径"""
-    user_cache_dir = get_user_cache_dir()
-    if not user_cache_dir:
-        return None
-    cache_key = get_recommendations_cache_key(arxiv_query, date_range, selected_paper_keys)
-    if not cache_key:
-        return None
-    return user_cache_dir / f"recommendations_cache_{cache_key}.json"
-
 # 实现缓存验证和更新逻辑
 def check_cache_validity(cache_data):
     """检查缓存有效性，如果文章有更新则返回 False"""
@@ -120,19 +348,20 @@ def load_recommendations_cache(arxiv_query, date_range=None, selected_paper_keys
     if not CACHE_ENABLED:
         return None
     
-    cache_path = get_recommendations_cache_path(arxiv_query, date_range, selected_paper_keys)
-    if not cache_path or not cache_path.exists():
+    cache_key = get_recommendations_cache_key(arxiv_query, date_range, selected_paper_keys)
+    if not cache_key:
         return None
     
     try:
-        with open(cache_path, 'r', encoding='utf-8') as f:
-            cache_data = json.load(f)
-            # 检查缓存是否过期（24小时）
-            cached_at = datetime.fromisoformat(cache_data.get('cached_at', ''))
-            if (datetime.now() - cached_at).total_seconds() > 24 * 3600:
-                return None
-            logger.info(f"从缓存加载推荐结果（{len(cache_data.get('papers', []))} 篇）")
-            return cache_data
+        cache_data = CACHE_STORE.load_recommendations(cache_key)
+        if not cache_data:
+            return None
+        # 检查缓存是否过期（24小时）
+        cached_at = datetime.fromisoformat(cache_data.get('cached_at', ''))
+        if datetime.now() - cached_at > RECOMMENDATION_CACHE_TTL:
+            return None
+        logger.info(f"从缓存加载推荐结果（{len(cache_data.get('papers', []))} 篇）")
+        return cache_data
     except Exception as e:
         logger.warning(f"加载推荐缓存失败: {e}")
         return None
@@ -142,22 +371,17 @@ def save_recommendations_cache(arxiv_query, date_range, papers, selected_paper_k
     if not CACHE_ENABLED:
         return
     
-    cache_path = get_recommendations_cache_path(arxiv_query, date_range, selected_paper_keys)
-    if not cache_path:
+    cache_key = get_recommendations_cache_key(arxiv_query, date_range, selected_paper_keys)
+    if not cache_key:
         return
     
     try:
-        zotero_id = session.get('zotero_id')
-        cache_data = {
-            'papers': papers,
-            'arxiv_query': arxiv_query,
-            'date_range': date_range,
-            'selected_paper_keys': selected_paper_keys,
-            'cached_at': datetime.now().isoformat(),
-            'zotero_id': zotero_id
-        }
-        with open(cache_path, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        CACHE_STORE.save_candidates(papers)
+        CACHE_STORE.save_recommendations(
+            cache_key, session.get('user_id'), session.get('zotero_id'),
+            arxiv_query, date_range, selected_paper_keys, papers,
+            touch=not session.get('prewarm', False)
+        )
         logger.info(f"✓ 推荐结果已缓存（{len(papers)} 篇）")
     except Exception as e:
         logger.warning(f"保存推荐缓存失败: {e}")
@@ -167,15 +391,26 @@ def load_cache():
     if not CACHE_ENABLED:
         return None
     
-    cache_path = get_cache_path()
-    if not cache_path or not cache_path.exists():
+    cache_key = get_cache_key()
+    if not cache_key:
         return None
     
     try:
-        with open(cache_path, 'r', encoding='utf-8') as f:
-            cache_data = json.load(f)
-            logger.info(f"从缓存加载 {len(cache_data.get('corpus', []))} 篇论文")
+        # 论文库版本（revision 与缓存时间）未变化时直接复用内存中已解析的数据
+        stamp = CACHE_STORE.library_stamp(cache_key)
+        if stamp is None:
+            return None
+        cache_data = CORPUS_MEMORY_CACHE.get(cache_key, stamp)
+        # 记录访问时间，供缓存清理按 LRU 淘汰
+        CACHE_STORE.touch_library(cache_key)
+        if cache_data is not None:
             return cache_data
+        cache_data = CACHE_STORE.load_library(cache_key)
+        if cache_data is None:
+            return None
+        CORPUS_MEMORY_CACHE.put(cache_key, cache_data, cache_data['bytes'], (cache_data['revision'], cache_data['cached_at']))
+        logger.info(f"从缓存加载 {len(cache_data.get('corpus', []))} 篇论文")
+        return cache_data
     except Exception as e:
         logger.warning(f"加载缓存失败: {e}")
         return None
@@ -185,23 +420,25 @@ def save_cache(corpus, collections):
     if not CACHE_ENABLED:
         return
     
-    cache_path = get_cache_path()
-    if not cache_path:
+    cache_key = get_cache_key()
+    if not cache_key:
         return
     
     try:
-        # 将 collections 字典转换为列表以便 JSON 序列化
-        collections_list = list(collections.values()) if isinstance(collections, dict) else collections
-        
+        if not isinstance(collections, dict):
+            collections = {c['key']: c for c in collections}
         zotero_id = session.get('zotero_id')
+        # 只写入内容哈希发生变化的论文行
+        revision, cached_at, size = CACHE_STORE.save_library(cache_key, session.get('user_id'), zotero_id, corpus, collections, get_item_hash)
+        # 刚写入的数据直接放入内存缓存，下次请求无需重新读取
         cache_data = {
             'corpus': corpus,
-            'collections': collections_list,
-            'cached_at': datetime.now().isoformat(),
-            'zotero_id': zotero_id
+            'collections': collections,
+            'cached_at': cached_at,
+            'zotero_id': zotero_id,
+            'revision': revision,
         }
-        with open(cache_path, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        CORPUS_MEMORY_CACHE.put(cache_key, cache_data, size, (revision, cached_at))
         logger.info(f"✓ 缓存已保存（{len(corpus)} 篇论文）")
     except Exception as e:
         logger.warning(f"保存缓存失败: {e}")
@@ -216,15 +453,24 @@ def get_item_hash(item):
     hash_str = f"{key}_{version}_{title}_{'|'.join(sorted(paths))}"
     return hashlib.md5(hash_str.encode()).hexdigest()
 
+@observe_stage('zotero_load')
+@profiled('get_zotero_corpus')
 def get_zotero_corpus(force_refresh=False):
     """获取 Zotero 语料库（带缓存）"""
     config = get_user_zotero_config()
     zotero_id = config.get('zotero_id')
     zotero_key = config.get('zotero_key')
     
-    if not zotero_id or not zotero_key:
+    if not zotero_id:
         return [], {}
     
+    # 后台预热没有用户的 API Key，只能使用已缓存的论文库
+    if not zotero_key:
+        cache_data = load_cache() if session.get('prewarm') else None
+        if not cache_data:
+            return [], {}
+        return cache_data.get('corpus', []), cache_data.get('collections', {})
+    
     # 尝试从缓存加载
     if not force_refresh:
         cache_data = load_cache()
@@ -243,13 +489,21 @@ def get_zotero_corpus(force_refresh=False):
                         collections = {}
                     
                     logger.info(f"✓ 使用缓存数据（{len(corpus)} 篇论文，跳过 API 调用）")
+                    record_cache_lookup('library', hits=1)
                     return corpus, collections
                 else:
                     logger.info("缓存已过期，将重新获取")
             else:
                 logger.info("缓存用户 ID 不匹配，将重新获取")
     
-    # 从 API 获取完整数据
+    if not force_refresh:
+        record_cache_lookup('library', misses=1)
+    
+    # 从 API 获取完整数据（同一用户并发的获取只执行一次）
+    return ZOTERO_FLIGHTS.do((session.get('user_id'), 'corpus'), lambda: fetch_zotero_corpus(zotero_id, zotero_key))
+
+def fetch_zotero_corpus(zotero_id, zotero_key):
+    """从 Zotero API 获取语料库并写入缓存"""
     logger.info("从 Zotero API 获取数据...")
     zot = zotero.Zotero(zotero_id, 'user', zotero_key)
     collections = zot.everything(zot.collections())
@@ -442,9 +696,10 @@ def refresh_zotero_cache():
 def clear_zotero_cache():
     """清除 Zotero 缓存"""
     try:
-        cache_path = get_cache_path()
-        if cache_path and cache_path.exists():
-            cache_path.unlink()
+        cache_key = get_cache_key()
+        if cache_key and CACHE_STORE.delete_library(cache_key):
+            CORPUS_MEMORY_CACHE.pop(cache_key)
+            LIBRARY_INDEX_CACHE.pop(cache_key)
             return jsonify({
                 'success': True,
                 'message': '缓存已清除'
@@ -458,6 +713,164 @@ def clear_zotero_cache():
         logger.error(f"Error clearing cache: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/reference-sets', methods=['GET'])
+@login_required
+def list_reference_sets():
+    """列出当前用户保存的参考集"""
+    try:
+        return jsonify({'success': True, 'reference_sets': CACHE_STORE.list_reference_sets(get_cache_key())})
+    except Exception as e:
+        logger.error(f"Error listing reference sets: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/reference-sets', methods=['POST'])
+@login_required
+def save_reference_set():
+    """保存参考集（未指定名称时按文章集合自动命名，相同选择得到相同名称）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        paper_keys = data.get('paper_keys')
+        if not isinstance(paper_keys, list) or not paper_keys:
+            return jsonify({'success': False, 'error': '请提供 paper_keys 列表'}), 400
+        paper_keys = {str(k).strip() for k in paper_keys if str(k).strip()}
+        name = (data.get('name') or '').strip() or f"selection-{get_selection_key(paper_keys)[:12]}"
+        if len(name) > 100:
+            return jsonify({'success': False, 'error': '参考集名称过长'}), 400
+        updated_at = CACHE_STORE.save_reference_set(get_cache_key(), name, paper_keys)
+        return jsonify({'success': True, 'name': name, 'size': len(paper_keys), 'updated_at': updated_at})
+    except Exception as e:
+        logger.error(f"Error saving reference set: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/reference-sets/<name>', methods=['GET'])
+@login_required
+def get_reference_set(name):
+    """获取参考集中的文章 key"""
+    paper_keys = CACHE_STORE.load_reference_set(get_cache_key(), name)
+    if paper_keys is None:
+        return jsonify({'success': False, 'error': f'参考集不存在: {name}'}), 404
+    return jsonify({'success': True, 'name': name, 'paper_keys': sorted(paper_keys), 'size': len(paper_keys)})
+
+@app.route('/api/reference-sets/<name>', methods=['DELETE'])
+@login_required
+def delete_reference_set(name):
+    """删除参考集"""
+    if not CACHE_STORE.delete_reference_set(get_cache_key(), name):
+        return jsonify({'success': False, 'error': f'参考集不存在: {name}'}), 404
+    return jsonify({'success': True})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 指标"""
+    return Response(METRICS.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/cache/stats', methods=['GET'])
+@login_required
+def cache_stats():
+    """缓存占用统计（全局与当前用户）"""
+    try:
+        return jsonify({
+            'success': True,
+            'enabled': CACHE_ENABLED,
+            'global': CACHE_JANITOR.usage(),
+            'user': CACHE_JANITOR.usage(session.get('user_id')),
+            'embedding_cache': GLOBAL_EMBEDDING_CACHE.stats(),
+            'corpus_memory_cache': CORPUS_MEMORY_CACHE.stats(),
+            'library_index_cache': LIBRARY_INDEX_CACHE.stats(),
+            'prewarm': PREWARMER.stats() if PREWARM_ENABLED else None,
+            'candidate_archive': CANDIDATE_ARCHIVE.stats() if CANDIDATE_ARCHIVE is not None else None,
+        })
+    except Exception as e:
+        logger.error(f"Error getting cache stats: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def format_paper(paper, code_url=None):
+    """将 ArxivPaper 转换为返回给前端的字典"""
+    return {
+        'title': paper.title,
+        'authors': [f"{a.name}" for a in paper.authors],
+        'abstract': paper.summary,
+        'arxiv_id': paper.arxiv_id,
+        'pdf_url': paper.pdf_url,
+        'code_url': code_url,
+        'score': round(paper.score, 2) if paper.score else 0,
+        # 存档中的论文带有它出现在 RSS 上的日期
+        'date': getattr(paper, 'day', None) or datetime.now().strftime('%Y-%m-%d')
+    }
+
+class RecommendationCache:
+    """推荐流水线的结果缓存钩子（force_refresh 时跳过读取，但仍写入）"""
+    def load(self, ctx):
+        if ctx.force_refresh:
+            return None
+        cache_data = load_recommendations_cache(ctx.query, ctx.date_range, ctx.selected_paper_keys)
+        record_cache_lookup('recommendation', hits=cache_data is not None, misses=cache_data is None)
+        return cache_data['papers'] if cache_data else None
+
+    def save(self, ctx, papers):
+        save_recommendations_cache(ctx.query, ctx.date_range, papers, ctx.selected_paper_keys)
+
+def rank_stage_candidates(ctx, papers):
+    """流水线打分阶段：兴趣向量在一次运行中只计算一次"""
+    state = ctx.state('profile')
+    if 'profile' not in state:
+        state['profile'] = get_corpus_profile(ctx.corpus, ctx.selected_paper_keys)
+    return rank_candidates(papers, ctx.corpus, ctx.selected_paper_keys, state['profile'])
+
+def archive_profile(ctx):
+    """存档打分用的兴趣向量；兴趣簇模式下 get_corpus_profile 不返回向量，这里仍按逐篇加权计算"""
+    profile = get_corpus_profile(ctx.corpus, ctx.selected_paper_keys)
+    if profile is None:
+        profile = corpus_profile(ctx.corpus, backend=ENCODER_BACKEND, corpus_store=get_embedding_store_path(), store_dtype=EMBEDDING_DTYPE)
+    if profile is None:
+        raise ValueError(f"嵌入模型 {EMBEDDING_MODEL} 不是余弦相似度，无法在候选论文存档上打分")
+    return profile
+
+def encode_candidates(texts):
+    """编码候选论文摘要；结果进入嵌入缓存，随后的打分阶段直接复用"""
+    return encode_texts(get_encoder(EMBEDDING_MODEL, ENCODER_BACKEND), texts, f"{EMBEDDING_MODEL}:{ENCODER_BACKEND}")
+
+def observe_pipeline_stage(stage, seconds):
+    logger.debug(f"推荐流水线阶段 {stage} 用时 {seconds:.2f} 秒")
+    if stage in PIPELINE_STAGE_METRICS:
+        STAGE_SECONDS.observe(seconds, stage=PIPELINE_STAGE_METRICS[stage])
+
+def build_recommendation_pipeline(progressive=False, cached=False, date_range=None, seen_filter=None, library=None):
+    """组装推荐流水线：RSS 源 →（过滤已推荐、已在库中）→ 分批获取详情 →（过滤已在库中）→ 打分 →（获取代码链接）→ 格式化
+
+    启用候选论文存档时：RSS 源 → 分批获取详情 → 存档 →（过滤已推荐、已在库中）→ 打分 → ...
+    存档由所有用户共享，必须在按用户过滤之前写入，否则某个用户已有的论文不会进入存档
+
+    指定 date_range 时改为：候选论文存档 → 格式化，不访问网络
+    """
+    if date_range:
+        stages = [ArchiveSource(CANDIDATE_ARCHIVE, archive_profile, top_k=MAX_PAPER_NUM)]
+    else:
+        stages = [FeedSource(fallback_recent=True)]
+        # 未启用存档时，先按 RSS 中的 arXiv ID 过滤，省去获取详情；获取详情后再按 DOI 和标题过滤
+        if CANDIDATE_ARCHIVE is None:
+            if seen_filter is not None:
+                stages.append(seen_filter)
+            if library is not None:
+                stages.append(LibraryFilter(library))
+        stages.append(FetchDetails(batch_size=BATCH_SIZE))
+        if CANDIDATE_ARCHIVE is not None:
+            stages.append(ArchiveStage(CANDIDATE_ARCHIVE, encode_candidates))
+            if seen_filter is not None:
+                stages.append(seen_filter)
+        if library is not None:
+            stages.append(LibraryFilter(library))
+        stages.append(ScoreStage(rank_stage_candidates, top_k=MAX_PAPER_NUM, progressive=progressive))
+        # 只在启用时才获取 code_url（会很慢）
+        if FETCH_CODE_URL:
+            stages.append(EnrichStage('code_url', lambda paper: paper.code_url))
+    stages.append(FormatStage(lambda ctx, paper: format_paper(paper, ctx.state('code_url').get(paper.arxiv_id))))
+    return Pipeline(
+        stages,
+        result_cache=RecommendationCache() if cached else None,
+        on_timing=observe_pipeline_stage,
+    )
+
 def send_progress(message, progress=None):
     """发送进度更新"""
     data = {'message': message}
@@ -472,32 +885,25 @@ def get_recommendations_stream():
     # 获取请求参数
     arxiv_query = request.args.get('arxiv_query', ARXIV_QUERY)
     date_range = request.args.get('date_range', None)  # 格式: "2025-01-01,2025-01-06"
+    if date_range:
+        if CANDIDATE_ARCHIVE is None:
+            return jsonify({'success': False, 'error': '未启用候选论文存档，无法按日期范围推荐'}), 400
+        if not DATE_RANGE_PATTERN.match(date_range) or date_range.split(',')[0] > date_range.split(',')[1]:
+            return jsonify({'success': False, 'error': f'日期范围格式错误: {date_range}（应为 YYYY-MM-DD,YYYY-MM-DD）'}), 400
     force_refresh = request.args.get('force_refresh', 'false').lower() == 'true'
-    selected_paper_keys_str = request.args.get('selected_paper_keys', None)
+    # 渐进模式：每批论文到达后立即打分，并推送当前前 N 篇的增量
+    progressive = request.args.get('progressive', 'false').lower() == 'true'
+    # 性能剖析：按阶段采集 cProfile，结果写入 PROFILE_DIR/<运行 ID>/
+    profile = PROFILE_PIPELINE or (PROFILE_REQUESTS and request.args.get('profile', 'false').lower() == 'true')
     
-    # 解析选中的文章 key 列表
-    selected_paper_keys = None
-    if selected_paper_keys_str:
-        selected_paper_keys = [k.strip() for k in selected_paper_keys_str.split(',') if k.strip()]
-        if len(selected_paper_keys) == 0:
-            selected_paper_keys = None
+    # 解析选中的文章 key 集合
+    try:
+        selected_paper_keys = get_selected_paper_keys()
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
     
     def generate():
         try:
-            # 检查缓存
-            if not force_refresh:
-                cache_data = load_recommendations_cache(arxiv_query, date_range, selected_paper_keys)
-                if cache_data:
-                    # 获取参考文章数量（从缓存中读取或重新计算）
-                    corpus, _ = get_zotero_corpus()
-                    if selected_paper_keys:
-                        corpus = [item for item in corpus if item.get('key') in selected_paper_keys]
-                    reference_count = len(corpus)
-                    
-                    yield send_progress("✓ 使用缓存的推荐结果", 100)
-                    yield f"data: {json.dumps({'success': True, 'papers': cache_data['papers'], 'total': len(cache_data['papers']), 'cached': True, 'reference_count': reference_count})}\n\n"
-                    return
-            
             # 步骤 1: 获取 Zotero 语料库
             yield send_progress("正在加载你的 Zotero 论文库...", 10)
             corpus, _ = get_zotero_corpus()
@@ -507,6 +913,9 @@ def get_recommendations_stream():
                 yield f"data: {json.dumps({'success': False, 'error': 'Zotero 库为空'})}\n\n"
                 return
             
+            # 库成员索引基于整个论文库，不受选中文章影响
+            library = get_library_index(corpus) if LIBRARY_FILTER_ENABLED and not date_range else None
+            
             # 如果指定了选中的文章，进行过滤
             if selected_paper_keys:
                 original_count = len(corpus)
@@ -520,245 +929,276 @@ def get_recommendations_stream():
                 yield f"data: {json.dumps({'success': False, 'error': '没有选中的文章'})}\n\n"
                 return
             
-            time.sleep(0.1)  # 让前端有时间显示
-            
-            # 步骤 2: 获取 ArXiv RSS Feed
-            yield send_progress(f"正在从 ArXiv RSS Feed 获取论文列表（类别: {arxiv_query}）...", 30)
-            client = arxiv.Client(num_retries=10, delay_seconds=10)
-            feed = feedparser.parse(f"https://rss.arxiv.org/atom/{arxiv_query}")
-            
-            if feed.feed.get('title') and 'Feed error for query' in feed.feed.title:
-                raise Exception(f"Invalid ARXIV_QUERY: {arxiv_query}")
-            
-            papers = []
-            all_paper_ids = []
-            new_paper_count = 0
-            
-            # 首先尝试获取新论文
-            for entry in feed.entries:
-                if hasattr(entry, 'arxiv_announce_type') and entry.arxiv_announce_type == 'new':
-                    paper_id = entry.id
-                    if paper_id.startswith("oai:arXiv.org:"):
-                        paper_id = paper_id.removeprefix("oai:arXiv.org:")
-                    all_paper_ids.append(paper_id)
-                    new_paper_count += 1
-            
-            if len(all_paper_ids) == 0:
-                yield send_progress("今天没有新论文，使用最近的论文...", 35)
-                for entry in feed.entries:
-                    paper_id = entry.id
-                    if paper_id.startswith("oai:arXiv.org:"):
-                        paper_id = paper_id.removeprefix("oai:arXiv.org:")
-                    if 'v' in paper_id:
-                        paper_id = paper_id.rsplit('v', 1)[0]
-                    all_paper_ids.append(paper_id)
-                yield send_progress(f"从 RSS Feed 找到 {len(feed.entries)} 篇论文，将处理全部 {len(all_paper_ids)} 篇", 38)
+            # 步骤 2-5: 获取 RSS Feed → 分批获取详情 → 打分 → 格式化（命中推荐缓存时直接返回）
+            if date_range:
+                yield send_progress(f"正在从本地候选论文存档读取 {date_range.replace(',', ' 至 ')} 的论文（类别: {arxiv_query}）...", 30)
             else:
-                yield send_progress(f"✓ 从 ArXiv RSS Feed 找到 {new_paper_count} 篇新论文（共 {len(feed.entries)} 篇），将处理全部", 38)
-            
-            # 处理所有论文，不再限制为 100 篇
-            yield send_progress(f"将处理 {len(all_paper_ids)} 篇候选论文", 40)
-            time.sleep(0.1)
-            
-            # 步骤 3: 分批获取论文详情
-            total_batches = (len(all_paper_ids) + BATCH_SIZE - 1) // BATCH_SIZE
-            yield send_progress(f"开始获取论文详情，共 {total_batches} 批，每批 {BATCH_SIZE} 篇...", 42)
-            time.sleep(0.1)
-            
-            for i in range(0, len(all_paper_ids), BATCH_SIZE):
-                batch_num = i // BATCH_SIZE + 1
-                progress = 40 + int((batch_num / total_batches) * 30)
-                yield send_progress(f"正在获取第 {batch_num}/{total_batches} 批论文详情...", progress)
-                
-                try:
-                    batch_ids = all_paper_ids[i:i+BATCH_SIZE]
-                    search = arxiv.Search(id_list=batch_ids)
-                    batch = [ArxivPaper(p) for p in client.results(search)]
-                    papers.extend(batch)
-                    yield send_progress(f"✓ 已获取 {len(papers)}/{len(all_paper_ids)} 篇论文详情（批次 {batch_num}/{total_batches}）", progress)
-                except Exception as e:
-                    logger.warning(f"获取批次 {batch_num} 失败: {e}")
-                    yield send_progress(f"⚠️ 批次 {batch_num} 获取失败，继续处理...", progress)
-                    continue
-                time.sleep(0.1)
-            
-            if not papers:
-                yield send_progress("❌ 无法获取 ArXiv 论文详情", 100)
-                yield f"data: {json.dumps({'success': False, 'error': '无法获取 ArXiv 论文'})}\n\n"
-                return
-            
-            yield send_progress(f"✓ 成功获取 {len(papers)} 篇论文详情", 70)
-            time.sleep(0.1)
-            
-            # 步骤 4: 计算推荐分数
-            yield send_progress(f"正在计算推荐分数（{len(papers)} 篇候选论文 vs {len(corpus)} 篇 Zotero 论文）...", 75)
-            papers = rerank_paper(papers, corpus)
-            max_score = papers[0].score if papers else 0
-            yield send_progress(f"✓ 推荐分数计算完成（最高分: {max_score:.2f}）", 85)
-            time.sleep(0.1)
-            
-            # 步骤 5: 格式化结果
-            papers = papers[:MAX_PAPER_NUM]
-            yield send_progress(f"正在整理推荐结果（将返回前 {len(papers)} 篇）...", 90)
-            time.sleep(0.1)
-            
-            formatted_papers = []
-            for i, paper in enumerate(papers, 1):
-                authors = [f"{a.name}" for a in paper.authors]
-                
-                # 只在启用时才获取 code_url（会很慢）
-                code_url = None
-                if FETCH_CODE_URL:
-                    try:
-                        code_url = paper.code_url
-                    except Exception as e:
-                        logger.debug(f"Failed to get code_url for {paper.arxiv_id}: {e}")
-                        code_url = None
-                
-                formatted_papers.append({
-                    'title': paper.title,
-                    'authors': authors,
-                    'abstract': paper.summary,
-                    'arxiv_id': paper.arxiv_id,
-                    'pdf_url': paper.pdf_url,
-                    'code_url': code_url,
-                    'score': round(paper.score, 2) if paper.score else 0,
-                    'date': datetime.now().strftime('%Y-%m-%d')
-                })
-                
-                # 更新进度（如果获取 code_url）
-                if FETCH_CODE_URL and i % 10 == 0:
-                    progress = 90 + int((i / len(papers)) * 5)
-                    yield send_progress(f"正在获取代码链接 ({i}/{len(papers)})...", progress)
-            
-            yield send_progress(f"✓ 完成！共推荐 {len(formatted_papers)} 篇论文", 100)
-            time.sleep(0.1)
-            
-            # 保存缓存
-            save_recommendations_cache(arxiv_query, date_range, formatted_papers, selected_paper_keys)
-
-            # 发送最终结果（包含参考文章数量）
-            yield f"data: {json.dumps({'success': True, 'papers': formatted_papers, 'total': len(formatted_papers), 'cached': False, 'reference_count': len(corpus)})}\n\n"
+                yield send_progress(f"正在从 ArXiv RSS Feed 获取论文列表（类别: {arxiv_query}）...", 30)
+            ctx = RunContext(query=arxiv_query, corpus=corpus, date_range=date_range, selected_paper_keys=selected_paper_keys, force_refresh=force_refresh)
+            sent_ids = set()
+            progress = 40
+            # 按日期范围浏览存档时不过滤也不记录已推荐论文
+            seen_set = get_seen_set() if SEEN_FILTER_ENABLED and not date_range else None
+            seen_filter = SeenFilter(seen_set, SHOW_UPDATED_PAPERS) if seen_set is not None else None
+            # 候选论文全部被过滤（已推荐或已在库中）时没有需要获取的论文，这不是错误
+            nothing_to_fetch = False
+            for event in build_recommendation_pipeline(progressive, cached=True, date_range=date_range, seen_filter=seen_filter, library=library).run(ctx):
+                if event.kind == 'archive':
+                    yield send_progress(f"✓ 存档中 {event.start} 至 {event.end} 共有 {event.count} 篇候选论文", 60)
+                elif event.kind == 'feed':
+                    if event.fallback:
+                        yield send_progress("今天没有新论文，使用最近的论文...", 35)
+                        yield send_progress(f"从 RSS Feed 找到 {event.total_entries} 篇论文，将处理全部 {event.count} 篇", 38)
+                    else:
+                        yield send_progress(f"✓ 从 ArXiv RSS Feed 找到 {event.new_count} 篇新论文（共 {event.total_entries} 篇），将处理全部", 38)
+                    yield send_progress(f"将处理 {event.count} 篇候选论文", 40)
+                elif event.kind == 'seen':
+                    if event.skipped:
+                        yield send_progress(f"已跳过 {event.skipped} 篇之前推荐过的论文", progress)
+                elif event.kind == 'library':
+                    yield send_progress(f"已跳过 {event.skipped} 篇已在你的 Zotero 库中的论文", progress)
+                elif event.kind == 'fetch_start':
+                    nothing_to_fetch = event.count == 0
+                    yield send_progress(f"开始获取论文详情，共 {event.batches} 批，每批 {event.batch_size} 篇...", 42)
+                elif event.kind == 'batch_start':
+                    progress = 40 + int((event.batch / event.batches) * 30)
+                    yield send_progress(f"正在获取第 {event.batch}/{event.batches} 批论文详情...", progress)
+                elif event.kind == 'batch':
+                    yield send_progress(f"✓ 已获取 {event.fetched}/{event.count} 篇论文详情（批次 {event.batch}/{event.batches}）", progress)
+                elif event.kind == 'batch_failed':
+                    yield send_progress(f"⚠️ 批次 {event.batch} 获取失败，继续处理...", progress)
+                elif event.kind == 'fetched':
+                    if event.count == 0 and nothing_to_fetch:
+                        yield send_progress("今天的候选论文都已推荐过或已在你的 Zotero 库中", 70)
+                    elif event.count == 0:
+                        yield send_progress("❌ 无法获取 ArXiv 论文详情", 100)
+                        yield f"data: {json.dumps({'success': False, 'error': '无法获取 ArXiv 论文'})}\n\n"
+                        return
+                    else:
+                        yield send_progress(f"✓ 成功获取 {event.count} 篇论文详情", 70)
+                elif event.kind == 'partial':
+                    # 只发送新进入前 N 的论文，其余论文前端已有，按 ranking 重新排序即可
+                    added = [format_paper(paper) for paper in event.ranked if paper.arxiv_id not in sent_ids]
+                    sent_ids.update(paper['arxiv_id'] for paper in added)
+                    yield f"data: {json.dumps({'partial': True, 'added': added, 'ranking': [paper.arxiv_id for paper in event.ranked], 'progress': progress})}\n\n"
+                elif event.kind == 'score_start':
+                    yield send_progress(f"正在计算推荐分数（{event.candidates} 篇候选论文 vs {event.corpus} 篇 Zotero 论文）...", 75)
+                elif event.kind == 'scored':
+                    yield send_progress(f"✓ 推荐分数计算完成（最高分: {event.max_score:.2f}）", 85)
+                    yield send_progress(f"正在整理推荐结果（将返回前 {event.count} 篇）...", 90)
+                elif event.kind == 'enrich':
+                    yield send_progress(f"正在获取代码链接 ({event.done}/{event.total})...", 90 + int((event.done / event.total) * 5))
+                elif event.kind == 'done':
+                    # 预热算出的结果还没有送到用户面前，不计入已推荐
+                    if seen_filter is not None and not session.get('prewarm'):
+                        seen_filter.mark(ctx, [paper['arxiv_id'] for paper in event.result])
+                    if event.cached:
+                        yield send_progress("✓ 使用缓存的推荐结果", 100)
+                    else:
+                        yield send_progress(f"✓ 完成！共推荐 {len(event.result)} 篇论文", 100)
+                    # 发送最终结果（包含参考文章数量，剖析时附带各阶段耗时）
+                    result = {'success': True, 'papers': event.result, 'total': len(event.result), 'cached': event.cached, 'reference_count': len(corpus)}
+                    if profiler is not None and profiler.running:
+                        profiler.write()
+                        result['profile'] = {'run_id': profiler.run_id, 'stages': profiler.summary()}
+                    yield f"data: {json.dumps(result)}\n\n"
             
         except Exception as e:
             logger.error(f"Error fetching recommendations: {e}")
             yield send_progress(f"发生错误: {str(e)}", 100)
             yield f"data: {json.dumps({'success': False, 'error': str(e)})}\n\n"
     
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # 相同参数的并发请求（如同时打开两个标签页）共享同一个后台任务，并订阅它的进度流。
+    # 强制刷新只加入同样强制刷新的任务（普通任务可能直接返回缓存）；预热任务不标记已推荐，用户请求不加入
+    flight_key = (
+        session.get('user_id'), 'recommendations', arxiv_query, date_range,
+        tuple(sorted(selected_paper_keys)) if selected_paper_keys else None, force_refresh, progressive, profile,
+        bool(session.get('prewarm')),
+    )
+    # 同一秒内的多次运行各自写入不同的目录
+    profiler = RunProfiler(PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{session.get('user_id')}-{uuid.uuid4().hex[:8]}") if profile else None
+    
+    @copy_current_request_context
+    def produce(publish):
+        # 剖析器只在执行流水线的后台线程中生效；同一进程同时只剖析一次运行，其余运行照常执行但不剖析
+        if profiler is not None:
+            try:
+                profiler.start(blocking=False)
+            except ProfilerBusy:
+                publish(send_progress("另一次运行正在进行性能剖析，本次不剖析"))
+        try:
+            for event in generate():
+                publish(event)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+    
+    def track_client(events):
+        SSE_CLIENTS.inc()
+        try:
+            yield from events
+        finally:
+            SSE_CLIENTS.dec()
+    
+    # 普通请求可以加入进行中的强制刷新，它算出的同样是最新结果
+    events = None
+    if not force_refresh:
+        events = RECOMMENDATION_STREAMS.join(flight_key[:5] + (True,) + flight_key[6:])
+    if events is None:
+        events = RECOMMENDATION_STREAMS.stream(flight_key, produce)
+    return Response(stream_with_context(track_client(events)), mimetype='text/event-stream')
+
+ARXIV_ID_PATTERN = re.compile(r'^(\d{4}\.\d{4,5}|[a-z\-]+(\.[A-Z]{2})?/\d{7})(v\d+)?$')
+LLM_LOCK = threading.Lock()
+
+def get_tldr_llm():
+    """首次请求 TLDR 时才创建 LLM（本地模型加载较慢），之后所有用户共用"""
+    with LLM_LOCK:
+        if llm.GLOBAL_LLM is None:
+            if OPENAI_API_KEY:
+                llm.set_global_llm(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE, model=LLM_MODEL_NAME, lang=TLDR_LANGUAGE)
+            else:
+                llm.set_global_llm(lang=TLDR_LANGUAGE)
+        return llm.get_llm()
+
+@app.route('/api/papers/<path:arxiv_id>/tldr')
+@login_required
+def get_paper_tldr(arxiv_id):
+    """按需生成论文 TLDR，通过 SSE 逐 token 推送；结果在所有用户间共享缓存"""
+    if not ARXIV_ID_PATTERN.match(arxiv_id):
+        return jsonify({'success': False, 'error': '无效的 arXiv ID'}), 400
+    variant = f"{TLDR_LANGUAGE}:{LLM_MODEL_NAME if OPENAI_API_KEY else 'local'}"
+
+    cached = CACHE_STORE.load_enrichment(arxiv_id, 'tldr', variant) if CACHE_ENABLED else None
+    record_cache_lookup('tldr', hits=cached is not None, misses=cached is None)
+    if cached is not None:
+        return Response(f"data: {json.dumps({'done': True, 'tldr': cached, 'cached': True})}\n\n", mimetype='text/event-stream')
+
+    def produce(publish):
+        start = time.perf_counter()
+        try:
+            publish(send_progress("正在获取论文信息..."))
+            results = list(arxiv.Client(num_retries=3, delay_seconds=3).results(arxiv.Search(id_list=[arxiv_id])))
+            if not results:
+                publish(f"data: {json.dumps({'success': False, 'error': '未找到该论文'})}\n\n")
+                return
+            paper = ArxivPaper(results[0])
+            get_tldr_llm()
+            publish(send_progress("正在下载论文源码..."))
+            # 先取源码（阻塞且较慢，结果缓存在 paper 上），之后 LLM 的输出按 token 推送
+            _ = paper.tex
+            publish(send_progress("正在生成 TLDR..."))
+            for piece in paper.stream_tldr():
+                publish(f"data: {json.dumps({'token': piece})}\n\n")
+            tldr = paper.tldr.strip()
+            if CACHE_ENABLED and tldr:
+                CACHE_STORE.save_enrichment(arxiv_id, 'tldr', tldr, variant)
+            publish(f"data: {json.dumps({'done': True, 'tldr': tldr, 'cached': False})}\n\n")
+        except Exception as e:
+            logger.error(f"Error generating TLDR for {arxiv_id}: {e}")
+            publish(f"data: {json.dumps({'success': False, 'error': str(e)})}\n\n")
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage='tldr')
+
+    # 同一篇论文的并发请求（不同用户也一样）只调用一次 LLM，其余请求订阅同一个 token 流
+    return Response(stream_with_context(TLDR_STREAMS.stream((arxiv_id, variant), produce)), mimetype='text/event-stream')
 
 @app.route('/api/recommendations')
 def get_recommendations():
     """获取推荐文章（兼容旧接口）"""
-    try:
+    def compute():
         # 获取 Zotero 语料库
         corpus, _ = get_zotero_corpus()
         
         if not corpus:
-            return jsonify({
+            return {
                 'success': True,
                 'papers': [],
                 'message': 'Zotero 库为空，无法生成推荐'
-            })
+            }
         
-        # 获取 ArXiv 论文
         logger.info("正在获取 ArXiv 论文...")
-        client = arxiv.Client(num_retries=10, delay_seconds=10)
-        feed = feedparser.parse(f"https://rss.arxiv.org/atom/{ARXIV_QUERY}")
-        
-        if feed.feed.get('title') and 'Feed error for query' in feed.feed.title:
-            raise Exception(f"Invalid ARXIV_QUERY: {ARXIV_QUERY}")
-        
-        papers = []
-        all_paper_ids = []
-        
-        # 首先尝试获取新论文
-        for entry in feed.entries:
-            if hasattr(entry, 'arxiv_announce_type') and entry.arxiv_announce_type == 'new':
-                paper_id = entry.id
-                if paper_id.startswith("oai:arXiv.org:"):
-                    paper_id = paper_id.removeprefix("oai:arXiv.org:")
-                all_paper_ids.append(paper_id)
-        
-        logger.info(f"找到 {len(all_paper_ids)} 篇新论文")
-        
-        # 如果没有新论文（可能是周末或节假日），使用最近的论文
-        if len(all_paper_ids) == 0:
-            logger.info("今天没有新论文，使用最近的论文...")
-            for entry in feed.entries:  # 处理所有论文
-                paper_id = entry.id
-                if paper_id.startswith("oai:arXiv.org:"):
-                    paper_id = paper_id.removeprefix("oai:arXiv.org:")
-                # 移除版本号（如 v1, v2）
-                if 'v' in paper_id:
-                    paper_id = paper_id.rsplit('v', 1)[0]
-                all_paper_ids.append(paper_id)
-            logger.info(f"使用最近的 {len(all_paper_ids)} 篇论文")
-        
-        # 处理所有论文，不再限制数量
-        
-        for i in range(0, len(all_paper_ids), BATCH_SIZE):
-            try:
-                batch_ids = all_paper_ids[i:i+BATCH_SIZE]
-                batch_num = i // BATCH_SIZE + 1
-                logger.debug(f"正在获取批次 {batch_num}，包含 {len(batch_ids)} 篇论文")
-                search = arxiv.Search(id_list=batch_ids)
-                batch = [ArxivPaper(p) for p in client.results(search)]
-                papers.extend(batch)
-                logger.info(f"成功获取 {len(batch)} 篇论文（批次 {batch_num}，总计 {len(papers)} 篇）")
-            except Exception as e:
-                logger.warning(f"获取批次 {batch_num} 失败: {e}")
-                logger.debug(f"失败的论文 ID: {all_paper_ids[i:i+BATCH_SIZE]}")
-                continue
-        
-        if not papers:
-            return jsonify({
-                'success': True,
-                'papers': [],
-                'message': '无法获取 ArXiv 论文，请稍后重试'
-            })
-        
-        # 重新排序
-        logger.info(f"正在计算推荐分数（{len(papers)} 篇候选论文，{len(corpus)} 篇 Zotero 论文）...")
-        papers = rerank_paper(papers, corpus)
-        logger.info(f"推荐分数计算完成，最高分: {papers[0].score if papers else 0:.2f}")
-        
-        # 限制数量
-        papers = papers[:MAX_PAPER_NUM]
+        ctx = RunContext(query=ARXIV_QUERY, corpus=corpus, date_range=None, selected_paper_keys=None, force_refresh=True)
+        library = get_library_index(corpus) if LIBRARY_FILTER_ENABLED else None
+        for event in build_recommendation_pipeline(library=library).run(ctx):
+            if event.kind == 'feed':
+                logger.info(f"找到 {event.new_count} 篇新论文，将处理 {event.count} 篇")
+            elif event.kind == 'batch':
+                logger.info(f"成功获取 {event.size} 篇论文（批次 {event.batch}，总计 {event.fetched} 篇）")
+            elif event.kind == 'fetched' and event.count == 0:
+                return {
+                    'success': True,
+                    'papers': [],
+                    'message': '无法获取 ArXiv 论文，请稍后重试'
+                }
+            elif event.kind == 'scored':
+                logger.info(f"推荐分数计算完成，最高分: {event.max_score:.2f}")
         
-        # 格式化输出
-        formatted_papers = []
-        for paper in papers:
-            authors = [f"{a.name}" for a in paper.authors]
-            
-            # 只在启用时才获取 code_url（会很慢）
-            code_url = None
-            if FETCH_CODE_URL:
-                try:
-                    code_url = paper.code_url
-                except Exception as e:
-                    logger.debug(f"Failed to get code_url for {paper.arxiv_id}: {e}")
-                    code_url = None
-            
-            formatted_papers.append({
-                'title': paper.title,
-                'authors': authors,
-                'abstract': paper.summary,
-                'arxiv_id': paper.arxiv_id,
-                'pdf_url': paper.pdf_url,
-                'code_url': code_url,
-                'score': round(paper.score, 2) if paper.score else 0,
-                'date': datetime.now().strftime('%Y-%m-%d')
-            })
-        
-        return jsonify({
+        return {
             'success': True,
-            'papers': formatted_papers,
-            'total': len(formatted_papers)
-        })
+            'papers': ctx.result,
+            'total': len(ctx.result)
+        }
+    
+    try:
+        # 同一用户并发的旧接口请求只计算一次
+        return jsonify(RECOMMENDATION_FLIGHTS.do((session.get('user_id'), 'recommendations'), compute))
     except Exception as e:
         logger.error(f"Error fetching recommendations: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# 后台预热：arXiv 每日更新后，为最近活跃用户提前计算推荐结果并写入缓存
+PREWARM_ENABLED = CACHE_ENABLED and os.getenv('PREWARM_ENABLED', 'true').lower() == 'true'
+
+def get_feed_time(arxiv_query):
+    """获取 arXiv RSS Feed 最近一次更新的时间戳"""
+    feed = feedparser.parse(f"https://rss.arxiv.org/atom/{arxiv_query}")
+    updated = feed.feed.get('updated_parsed') or feed.feed.get('published_parsed')
+    if not feed.entries or not updated:
+        return None
+    return calendar.timegm(updated)
+
+def get_prewarm_targets():
+    """最近活跃用户打开过的推荐结果（不含指定日期范围的查询）"""
+    since = datetime.now() - timedelta(days=float(os.getenv('PREWARM_ACTIVE_DAYS', '3')))
+    return [t for t in CACHE_STORE.recent_recommendations(since.isoformat()) if not t['date_range']]
+
+def warm_recommendations(target):
+    """在模拟的请求上下文中运行完整的推荐流程，结果写入推荐缓存"""
+    query_string = {'arxiv_query': target['arxiv_query'], 'force_refresh': 'true'}
+    if target['selected_paper_keys']:
+        query_string['selected_paper_keys'] = ','.join(target['selected_paper_keys'])
+    with app.test_request_context('/api/recommendations/stream', query_string=query_string):
+        session['user_id'] = target['user_id']
+        session['zotero_id'] = target['zotero_id']
+        session['prewarm'] = True
+        if CACHE_STORE.library_stamp(get_cache_key()) is None:
+            return False
+        response = get_recommendations_stream()
+        result = None
+        for event in response.response:
+            event = event.decode() if isinstance(event, bytes) else event
+            if event.startswith('data: '):
+                result = json.loads(event[len('data: '):])
+        return bool(result and result.get('success'))
+
+PREWARMER = Prewarmer(
+    get_feed_time, get_prewarm_targets, warm_recommendations,
+    interval=float(os.getenv('PREWARM_INTERVAL', '900')),
+    pause=float(os.getenv('PREWARM_PAUSE', '5')),
+    max_targets=int(os.getenv('PREWARM_MAX_USERS', '20')),
+    busy=lambda: RECOMMENDATION_STREAMS.in_flight() > 0,
+)
+
+def start_background_workers():
+    """启动缓存清理和预热线程；导入模块时不启动，由服务入口调用（如 gunicorn 的 post_worker_init 钩子）"""
+    if CACHE_ENABLED:
+        CACHE_JANITOR.start()
+    if PREWARM_ENABLED:
+        PREWARMER.start()
+
 if __name__ == '__main__':
+    # debug 模式下 reloader 的监控进程不处理请求，只在实际提供服务的子进程中启动
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,147 @@
+"""Parity check and throughput/memory benchmark of the encoder backends.
+
+Every backend is loaded in a fresh process so that load time and resident memory
+are measured in isolation. The torch embeddings are the reference: each other
+backend reports its row-wise cosine agreement with them and the overlap of the
+top-N ranking that `rerank_paper` would produce from them.
+
+    uv run python benchmarks/encoder_backends.py --backends torch onnx onnx-int8
+    uv run python benchmarks/encoder_backends.py --corpus cache/cache.sqlite3
+"""
+import argparse
+import json
+import multiprocessing as mp
+import queue as queue_module
+import resource
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from benchmarks.synthetic import make_abstracts
+
+MODEL = 'avsolatorio/GIST-small-Embedding-v0'
+
+def load_texts(corpus_path:str|None, n:int) -> list[str]:
+    if corpus_path is None:
+        return make_abstracts(n)
+    if corpus_path.endswith('.sqlite3'):
+        # every cached Zotero library of the web app
+        with sqlite3.connect(corpus_path) as conn:
+            corpus = [json.loads(d) for (d,) in conn.execute('SELECT data FROM items')]
+    else:
+        with open(corpus_path, 'r', encoding='utf-8') as f:
+            corpus = json.load(f)
+    texts = [c['data']['abstractNote'] for c in corpus if c['data'].get('abstractNote')]
+    return (texts * (n // max(len(texts), 1) + 1))[:n]
+
+def _run_backend(backend:str, model:str, texts:list[str], batch_size:int, out_path:str, queue):
+    from recommender import get_encoder
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    encoder = get_encoder(model, backend)
+    load_seconds = time.perf_counter() - start
+    encoder.encode(texts[:batch_size], batch_size=batch_size)  # warm up
+    start = time.perf_counter()
+    feature = encoder.encode(texts, batch_size=batch_size)
+    encode_seconds = time.perf_counter() - start
+    np.save(out_path, feature)
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        'backend': backend,
+        'load_seconds': load_seconds,
+        'encode_seconds': encode_seconds,
+        'texts_per_second': len(texts) / encode_seconds,
+        'model_rss_mb': (rss_peak - rss_start) / 1024,
+        'peak_rss_mb': rss_peak / 1024,
+    })
+
+def measure(backend:str, model:str, texts:list[str], batch_size:int, out_path:str) -> dict|None:
+    """Results of one backend, None if its process died (missing onnxruntime, out of memory, ...)."""
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_backend, args=(backend, model, texts, batch_size, out_path, queue))
+    proc.start()
+    while True:
+        try:
+            result = queue.get(timeout=5)
+            break
+        except queue_module.Empty:
+            if not proc.is_alive():
+                # the child may have put its result just before exiting
+                try:
+                    result = queue.get(timeout=1)
+                    break
+                except queue_module.Empty:
+                    print(f"{backend}: benchmark process exited with code {proc.exitcode}", file=sys.stderr)
+                    return None
+    proc.join()
+    return result
+
+def _normalize(x:np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def _scores(feature:np.ndarray, n_corpus:int) -> np.ndarray:
+    # same weighting as rerank_paper, with the corpus already in newest-first order
+    corpus, candidate = _normalize(feature[:n_corpus]), _normalize(feature[n_corpus:])
+    weight = 1 / (1 + np.log10(np.arange(n_corpus) + 1))
+    weight = weight / weight.sum()
+    return (candidate @ corpus.T) @ weight * 10
+
+def parity(reference:np.ndarray, feature:np.ndarray, n_corpus:int, top_n:int) -> dict:
+    cosine = (_normalize(reference) * _normalize(feature)).sum(axis=1)
+    ref_scores, scores = _scores(reference, n_corpus), _scores(feature, n_corpus)
+    ref_top = set(np.argsort(-ref_scores)[:top_n].tolist())
+    top = set(np.argsort(-scores)[:top_n].tolist())
+    return {
+        'cosine_mean': float(cosine.mean()),
+        'cosine_min': float(cosine.min()),
+        'score_max_abs_diff': float(np.abs(ref_scores - scores).max()),
+        f'top{top_n}_overlap': len(ref_top & top) / len(ref_top),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark encoder backends against the torch reference')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'onnx-int8'])
+    parser.add_argument('--model', type=str, default=MODEL)
+    parser.add_argument('--corpus', type=str, default=None, help='Web app cache database or JSON list of Zotero items to take abstracts from (synthetic if omitted)')
+    parser.add_argument('--n_corpus', type=int, default=500)
+    parser.add_argument('--n_candidate', type=int, default=300)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--top_n', type=int, default=50)
+    parser.add_argument('--output', type=str, default=None, help='Write the results as JSON to this path')
+    args = parser.parse_args()
+
+    texts = load_texts(args.corpus, args.n_corpus + args.n_candidate)
+    backends = ['torch'] + [b for b in args.backends if b != 'torch']
+    results = []
+    failed = []
+    with TemporaryDirectory() as tmpdir:
+        features = {}
+        for backend in backends:
+            out_path = str(Path(tmpdir) / f'{backend}.npy')
+            result = measure(backend, args.model, texts, args.batch_size, out_path)
+            if result is None:
+                if backend == 'torch':
+                    sys.exit("The torch reference failed, nothing to compare against.")
+                failed.append(backend)
+                continue
+            results.append(result)
+            features[backend] = np.load(out_path)
+        for r in results:
+            r.update(parity(features['torch'], features[r['backend']], args.n_corpus, args.top_n))
+
+    header = f"{'backend':<10} {'load s':>8} {'texts/s':>9} {'model MB':>9} {'peak MB':>8} {'cos mean':>9} {'cos min':>8} {'top' + str(args.top_n):>7}"
+    print(header)
+    for r in results:
+        print(f"{r['backend']:<10} {r['load_seconds']:>8.2f} {r['texts_per_second']:>9.1f} {r['model_rss_mb']:>9.0f} {r['peak_rss_mb']:>8.0f} "
+              f"{r['cosine_mean']:>9.4f} {r['cosine_min']:>8.4f} {r[f'top{args.top_n}_overlap']:>7.2f}")
+    for backend in failed:
+        print(f"{backend:<10} failed")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'model': args.model, 'n_texts': len(texts), 'results': results, 'failed': failed}, f, indent=2)
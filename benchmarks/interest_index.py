@@ -0,0 +1,88 @@
+"""Compare centroid scoring with profile (weighted mean) scoring on synthetic embeddings.
+
+No encoder is loaded: corpus and candidates are clustered unit vectors. Centroid
+scoring is a soft maximum over research threads rather than an approximation of
+the profile score, so the top-N overlap shows how much the two rankings differ,
+and the timings show the cost of fitting, updating and scoring the index.
+
+    uv run python benchmarks/interest_index.py --n_corpus 1000 10000 50000 --centroids 16 64 256
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from benchmarks.synthetic import make_embeddings
+from interest_index import InterestIndex
+
+def exact_scores(candidate:np.ndarray, corpus:np.ndarray, weight:np.ndarray) -> np.ndarray:
+    # the profile score: weighted mean cosine with every corpus paper
+    return (candidate @ corpus.T) @ weight * 10
+
+def run(n_corpus:int, n_candidate:int, n_centroids:int, top_n:int, n_added:int) -> dict:
+    corpus = make_embeddings(n_corpus + n_added, seed=1)
+    candidate = make_embeddings(n_candidate, seed=2)
+    weight = 1 / (1 + np.log10(np.arange(n_corpus) + 1))
+    weight = (weight / weight.sum()).astype(np.float32)
+    keys = [f'item{i}' for i in range(n_corpus + n_added)]
+
+    start = time.perf_counter()
+    exact = exact_scores(candidate, corpus[:n_corpus], weight)
+    exact_seconds = time.perf_counter() - start
+
+    index = InterestIndex(n_centroids)
+    start = time.perf_counter()
+    index.fit(keys[:n_corpus], corpus[:n_corpus], weight)
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    approx = index.score(candidate)
+    score_seconds = time.perf_counter() - start
+
+    # newest papers enter at the front of the time-ordered corpus
+    updated_keys = keys[n_corpus:] + keys[:n_corpus]
+    updated_corpus = np.concatenate([corpus[n_corpus:], corpus[:n_corpus]])
+    updated_weight = 1 / (1 + np.log10(np.arange(len(updated_keys)) + 1))
+    updated_weight = (updated_weight / updated_weight.sum()).astype(np.float32)
+    start = time.perf_counter()
+    index.update(updated_keys, updated_corpus, updated_weight)
+    update_seconds = time.perf_counter() - start
+    updated_overlap = len(set(np.argsort(-exact_scores(candidate, updated_corpus, updated_weight))[:top_n].tolist())
+                          & set(np.argsort(-index.score(candidate))[:top_n].tolist())) / top_n
+
+    return {
+        'n_corpus': n_corpus,
+        'n_candidate': n_candidate,
+        'n_centroids': n_centroids,
+        'exact_seconds': exact_seconds,
+        'fit_seconds': fit_seconds,
+        'score_seconds': score_seconds,
+        f'top{top_n}_overlap': len(set(np.argsort(-exact)[:top_n].tolist()) & set(np.argsort(-approx)[:top_n].tolist())) / top_n,
+        'update_seconds': update_seconds,
+        f'top{top_n}_overlap_after_update': updated_overlap,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the multi-centroid interest index')
+    parser.add_argument('--n_corpus', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--n_candidate', type=int, default=2000)
+    parser.add_argument('--centroids', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--n_added', type=int, default=50, help='Papers added before the incremental update')
+    parser.add_argument('--top_n', type=int, default=50)
+    parser.add_argument('--output', type=str, default=None, help='Write the results as JSON to this path')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'corpus':>7} {'k':>5} {'exact s':>9} {'score s':>9} {'fit s':>7} {'update s':>9} {'overlap':>8} {'after upd':>9}")
+    for n_corpus in args.n_corpus:
+        for k in args.centroids:
+            r = run(n_corpus, args.n_candidate, k, args.top_n, args.n_added)
+            results.append(r)
+            print(f"{n_corpus:>7} {k:>5} {r['exact_seconds']:>9.4f} {r['score_seconds']:>9.4f} {r['fit_seconds']:>7.2f} "
+                  f"{r['update_seconds']:>9.3f} {r[f'top{args.top_n}_overlap']:>8.2f} {r[f'top{args.top_n}_overlap_after_update']:>9.2f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,170 @@
+"""End-to-end and per-stage timing of `rerank_paper` on synthetic Zotero libraries.
+
+For every size a corpus of Zotero-shaped items (`key`, `version`, `dateAdded`,
+`abstractNote`) and a pool of candidates are generated, and a fresh process
+times one cold `rerank_paper` call plus its stages run one by one: sorting the
+corpus, encoding it, encoding the candidates, scoring (exact similarity against
+every corpus paper and the profile vector) and the top-k selection. The peak
+resident memory of each process is recorded as well.
+
+`--encoder hash` swaps the model for a bag-of-words stand-in, which isolates
+everything but the model and runs in seconds even at 50k papers. Results can be
+written as JSON and compared against an earlier run; a slowdown beyond
+`--tolerance` exits with status 1.
+
+    uv run python benchmarks/rerank.py --encoder hash --sizes 100 1000 10000 50000 --output rerank.json
+    uv run python benchmarks/rerank.py --encoder hash --compare rerank.json
+    uv run python benchmarks/rerank.py --encoder model --sizes 100 1000 --n_candidate 200
+"""
+import argparse
+import json
+import multiprocessing as mp
+import platform
+import resource
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+from benchmarks.synthetic import HashEncoder, make_candidates, make_corpus
+
+MODEL = 'avsolatorio/GIST-small-Embedding-v0'
+HASH_MODEL = 'synthetic-hash'
+# stages compared against a baseline; tiny timings are dominated by noise
+COMPARED = ('rerank', 'sort', 'encode_corpus', 'encode_candidates', 'similarity', 'profile', 'top_k')
+MIN_SECONDS = 0.05
+
+def _timed(timings:dict, name:str, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    timings[name] = time.perf_counter() - start
+    return result
+
+def _run_size(n_corpus:int, n_candidate:int, encoder_name:str, model:str, backend:str, chunk_size:int, top_k:int, queue):
+    import recommender
+    from embedding_cache import GLOBAL_EMBEDDING_CACHE
+    from recommender import TopK, encode_corpus, encode_texts, profile_vector, rerank_paper, sort_corpus, time_decay_weights
+
+    if encoder_name == 'hash':
+        model, backend = HASH_MODEL, 'torch'
+        recommender._ENCODERS[(model, backend)] = HashEncoder()
+    corpus = make_corpus(n_corpus, seed=0)
+    candidates = make_candidates(n_candidate, seed=1)
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = {}
+    encoder = _timed(timings, 'load', recommender.get_encoder, model, backend)
+    model_id = f'{model}:{backend}'
+    # warm up outside the measurements, then start every measurement from an empty embedding cache
+    encoder.encode([candidates[0].summary])
+    GLOBAL_EMBEDDING_CACHE.clear()
+
+    breakdown = {}
+    ranked = _timed(timings, 'rerank', lambda: rerank_paper(candidates, corpus, model, backend, top_k=top_k, chunk_size=chunk_size, timings=breakdown))
+    timings['rerank_encode'] = breakdown.get('encode', 0.0)
+    timings['rerank_score'] = breakdown.get('score', 0.0)
+    GLOBAL_EMBEDDING_CACHE.clear()
+
+    ordered = _timed(timings, 'sort', sort_corpus, corpus)
+    weights = time_decay_weights(len(ordered))
+    corpus_feature = _timed(timings, 'encode_corpus', encode_corpus, encoder, ordered, model_id)
+    texts = [paper.summary for paper in candidates]
+    candidate_feature = _timed(timings, 'encode_candidates', encode_texts, encoder, texts, model_id)
+
+    def similarity():
+        # the exact path: every candidate against every corpus paper, chunk by chunk
+        scores = []
+        for i in range(0, len(candidate_feature), chunk_size):
+            sim = encoder.similarity(candidate_feature[i:i + chunk_size], corpus_feature)
+            scores.append(np.asarray((sim * weights).sum(axis=1) * 10))
+        return np.concatenate(scores)
+    exact = _timed(timings, 'similarity', similarity)
+
+    def profile():
+        vector = profile_vector(corpus_feature, weights)
+        feature = np.asarray(candidate_feature, dtype=np.float32)
+        return feature / np.linalg.norm(feature, axis=1, keepdims=True) @ vector * 10
+    scores = _timed(timings, 'profile', profile)
+
+    def top_k_select():
+        top = TopK(len(scores) if top_k is None or top_k < 0 else min(top_k, len(scores)))
+        for i in range(0, len(scores), chunk_size):
+            top.push(np.arange(i, min(i + chunk_size, len(scores))), scores[i:i + chunk_size])
+        return top.result()
+    _timed(timings, 'top_k', top_k_select)
+
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        'n_corpus': n_corpus,
+        'n_candidate': n_candidate,
+        'seconds': timings,
+        'ranked': len(ranked),
+        'profile_max_abs_diff': float(np.abs(exact - scores).max()),
+        'peak_rss_mb': rss_peak / 1024,
+        'rss_growth_mb': (rss_peak - rss_start) / 1024,
+    })
+
+def measure(n_corpus:int, n_candidate:int, encoder:str, model:str, backend:str, chunk_size:int, top_k:int) -> dict:
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_size, args=(n_corpus, n_candidate, encoder, model, backend, chunk_size, top_k, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def regressions(results:list[dict], baseline:dict, tolerance:float) -> list[str]:
+    """Stages that got slower than `1 + tolerance` times the baseline run of the same sizes."""
+    previous = {(r['n_corpus'], r['n_candidate']): r for r in baseline['results']}
+    found = []
+    for r in results:
+        old = previous.get((r['n_corpus'], r['n_candidate']))
+        if old is None:
+            continue
+        for stage in COMPARED:
+            before, after = old['seconds'].get(stage), r['seconds'].get(stage)
+            if before is None or after is None or max(before, after) < MIN_SECONDS:
+                continue
+            if after > before * (1 + tolerance):
+                found.append(f"{r['n_corpus']}/{r['n_candidate']} {stage}: {before:.3f}s -> {after:.3f}s")
+    return found
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark rerank_paper on synthetic Zotero libraries')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000], help='Corpus sizes; the candidate pool has the same size unless --n_candidate is given')
+    parser.add_argument('--n_candidate', type=int, default=None)
+    parser.add_argument('--encoder', choices=['hash', 'model'], default='hash', help='hash: bag-of-words stand-in without a model; model: the real embedding model')
+    parser.add_argument('--model', type=str, default=MODEL)
+    parser.add_argument('--backend', type=str, default='torch')
+    parser.add_argument('--chunk_size', type=int, default=256)
+    parser.add_argument('--top_k', type=int, default=100)
+    parser.add_argument('--output', type=str, default=None, help='Write the results as JSON to this path')
+    parser.add_argument('--compare', type=str, default=None, help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown against --compare, as a fraction')
+    args = parser.parse_args()
+
+    results = [measure(n, args.n_candidate or n, args.encoder, args.model, args.backend, args.chunk_size, args.top_k) for n in args.sizes]
+
+    print(f"{'corpus':>7} {'cands':>7} " + ' '.join(f'{s:>17}' for s in COMPARED) + f" {'peak MB':>8}")
+    for r in results:
+        print(f"{r['n_corpus']:>7} {r['n_candidate']:>7} " + ' '.join(f"{r['seconds'][s]:>17.3f}" for s in COMPARED) + f" {r['peak_rss_mb']:>8.0f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'encoder': args.encoder,
+                'model': HASH_MODEL if args.encoder == 'hash' else args.model,
+                'backend': args.backend,
+                'chunk_size': args.chunk_size,
+                'top_k': args.top_k,
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'results': results,
+            }, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f'regression: {line}')
+        sys.exit(1 if found else 0)
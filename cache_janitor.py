@@ -0,0 +1,215 @@
+"""Disk budget enforcement for the web app's cache directory.
+
+Each run of the janitor
+1. purges expired recommendation results, arXiv candidates and paper enrichments
+   (TLDRs) from the cache database, and deletes the per-user JSON files left
+   behind by the old file cache;
+2. evicts the least recently accessed entries of every user over the per-user budget;
+3. evicts the least recently accessed entries overall until the global budget holds;
+4. compacts the database once enough of it is free pages.
+
+Evictable entries are cached Zotero libraries, recommendation results (both rows
+of the cache database) and per-user embedding stores (files under
+``cache/user/<id>/``). An embedding store counts as accessed whenever its library is.
+
+Data shared by all users is not evictable and stays out of the budgets: arXiv
+candidates and enrichments in the database are bounded by their TTLs, and the
+candidate archive (``cache/archive``) is never trimmed, it grows by about 2 KB
+per archived paper.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable
+from loguru import logger
+from cache_store import CacheStore
+
+# files of the JSON cache that the SQLite store replaced, and interrupted atomic writes
+STALE_PATTERNS = ('zotero_cache_*.json', 'recommendations_cache_*.json', '*.tmp*')
+EMBEDDING_PREFIX = 'corpus_embeddings_'
+
+def _timestamp(iso:str|None) -> float:
+    return datetime.fromisoformat(iso).timestamp() if iso else 0
+
+class CacheJanitor:
+    def __init__(self, store:CacheStore, cache_dir:Path, max_bytes:int, user_max_bytes:int,
+                 recommendation_ttl:timedelta, candidate_ttl:timedelta, interval:float=3600,
+                 compact_ratio:float=0.25, on_evict_library:Callable[[str], None]|None=None,
+                 enrichment_ttl:timedelta|None=None):
+        self.store = store
+        self.user_dir = Path(cache_dir) / 'user'
+        self.max_bytes = max_bytes
+        self.user_max_bytes = user_max_bytes
+        self.recommendation_ttl = recommendation_ttl
+        self.candidate_ttl = candidate_ttl
+        # TLDRs and other per-paper results; kept forever when None
+        self.enrichment_ttl = enrichment_ttl
+        self.interval = interval
+        # compact once this share of the database file is free pages
+        self.compact_ratio = compact_ratio
+        self.on_evict_library = on_evict_library
+        self.last_run = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _files(self) -> list[dict]:
+        """Embedding stores grouped by their base path, as entries like the database ones."""
+        groups = {}
+        if not self.user_dir.exists():
+            return []
+        for path in self.user_dir.glob(f'*/{EMBEDDING_PREFIX}*'):
+            base = path.name.split('.', 1)[0]
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # removed meanwhile by a save switching generations, or by an eviction
+                continue
+            group = groups.setdefault((path.parent.name, base), {
+                'kind': 'embeddings', 'cache_key': base[len(EMBEDDING_PREFIX):], 'user_id': path.parent.name,
+                'accessed': 0, 'bytes': 0, 'paths': [],
+            })
+            group['accessed'] = max(group['accessed'], stat.st_atime, stat.st_mtime)
+            group['bytes'] += stat.st_size
+            group['paths'].append(path)
+        return list(groups.values())
+
+    def entries(self) -> list[dict]:
+        entries = self.store.entries()
+        library_access = {}
+        for e in entries:
+            e['accessed'] = _timestamp(e.pop('accessed_at'))
+            e['user_id'] = str(e['user_id']) if e['user_id'] is not None else None
+            if e['kind'] == 'library':
+                library_access[e['cache_key']] = e['accessed']
+        files = self._files()
+        for f in files:
+            f['accessed'] = max(f['accessed'], library_access.get(f['cache_key'], 0))
+        return entries + files
+
+    def usage(self, user_id:str|None=None) -> dict:
+        entries = self.entries()
+        if user_id is not None:
+            entries = [e for e in entries if e['user_id'] == str(user_id)]
+            return {
+                'bytes': sum(e['bytes'] for e in entries),
+                'max_bytes': self.user_max_bytes,
+                'libraries': sum(e['kind'] == 'library' for e in entries),
+                'recommendations': sum(e['kind'] == 'recommendation' for e in entries),
+                'embedding_stores': sum(e['kind'] == 'embeddings' for e in entries),
+            }
+        return {
+            'bytes': sum(e['bytes'] for e in entries),
+            'max_bytes': self.max_bytes,
+            # candidates and enrichments: shared, bounded by their TTLs rather than the budget
+            'shared_bytes': self.store.candidate_bytes(),
+            'database_file_bytes': self.store.file_size(),
+            'database_free_bytes': self.store.free_bytes(),
+            'users': len({e['user_id'] for e in entries}),
+            'entries': len(entries),
+            'last_run': self.last_run,
+        }
+
+    def _evict(self, entries:list[dict]):
+        recommendations = [e['cache_key'] for e in entries if e['kind'] == 'recommendation']
+        if recommendations:
+            self.store.delete_recommendations(recommendations)
+        for e in entries:
+            if e['kind'] == 'library':
+                self.store.delete_library(e['cache_key'])
+                if self.on_evict_library is not None:
+                    self.on_evict_library(e['cache_key'])
+            elif e['kind'] == 'embeddings':
+                for path in e['paths']:
+                    path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _over_budget(entries:list[dict], budget:int, used:int) -> list[dict]:
+        """Least recently accessed entries to drop so that `used` fits `budget`."""
+        victims = []
+        for e in sorted(entries, key=lambda e: e['accessed']):
+            if used <= budget:
+                break
+            victims.append(e)
+            used -= e['bytes']
+        return victims
+
+    def _purge_stale_files(self) -> int:
+        if not self.user_dir.exists():
+            return 0
+        removed = 0
+        cutoff = time.time() - 3600  # leave in-progress atomic writes alone
+        for pattern in STALE_PATTERNS:
+            for path in self.user_dir.glob(f'*/{pattern}'):
+                try:
+                    if pattern.startswith('*.tmp') and path.stat().st_mtime > cutoff:
+                        continue
+                except FileNotFoundError:
+                    # the write finished (or was cleaned up) meanwhile
+                    continue
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def run(self, compact:bool=False) -> dict:
+        with self._lock:
+            start = time.perf_counter()
+            now = datetime.now()
+            purged = self.store.purge_expired(
+                (now - self.recommendation_ttl).isoformat(), (now - self.candidate_ttl).isoformat(),
+                (now - self.enrichment_ttl).isoformat() if self.enrichment_ttl is not None else None,
+            )
+            purged['files'] = self._purge_stale_files()
+
+            entries = self.entries()
+            by_user = {}
+            for e in entries:
+                by_user.setdefault(e['user_id'], []).append(e)
+            victims = []
+            for user_entries in by_user.values():
+                victims += self._over_budget(user_entries, self.user_max_bytes, sum(e['bytes'] for e in user_entries))
+            evicted = set(id(e) for e in victims)
+            remaining = [e for e in entries if id(e) not in evicted]
+            # only evictable entries count: shared data could never be evicted to make room
+            used = sum(e['bytes'] for e in remaining)
+            victims += self._over_budget(remaining, self.max_bytes, used)
+            self._evict(victims)
+
+            file_size = self.store.file_size()
+            if compact or (file_size and self.store.free_bytes() > self.compact_ratio * file_size):
+                self.store.compact()
+                compact = True
+            self.last_run = {
+                'at': now.isoformat(),
+                'seconds': round(time.perf_counter() - start, 3),
+                'purged': purged,
+                'evicted': len(victims),
+                'evicted_bytes': sum(e['bytes'] for e in victims),
+                'compacted': compact,
+            }
+            if victims or any(purged.values()):
+                logger.info(f"缓存清理：过期 {purged}，淘汰 {len(victims)} 项（{self.last_run['evicted_bytes'] / 1024 / 1024:.1f} MB）")
+            return self.last_run
+
+    def start(self):
+        """Run once now and then every `interval` seconds in a daemon thread.
+
+        The database is only compacted once its free pages pass `compact_ratio`,
+        never unconditionally, so restarting workers does not VACUUM the shared file.
+        """
+        if self._thread is not None:
+            return
+        def loop():
+            while True:
+                try:
+                    self.run()
+                except Exception as e:
+                    logger.warning(f"缓存清理失败: {e}")
+                if self._stop.wait(self.interval):
+                    return
+        self._thread = threading.Thread(target=loop, daemon=True, name='cache-janitor')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
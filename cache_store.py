@@ -0,0 +1,413 @@
+"""SQLite-backed cache of Zotero libraries, arXiv candidates and recommendation results.
+
+One database in WAL mode serves every user. Each thread gets its own connection,
+and writes run in short ``BEGIN IMMEDIATE`` transactions, so concurrent Flask
+threads never corrupt it and readers are never blocked by a writer. Libraries are
+stored item by item: saving a refreshed library only touches the rows whose
+content hash changed.
+"""
+import json
+import numpy as np
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS libraries (
+    cache_key TEXT PRIMARY KEY,
+    user_id TEXT,
+    zotero_id TEXT,
+    cached_at TEXT NOT NULL,
+    accessed_at TEXT,
+    revision INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS items (
+    cache_key TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    position INTEGER,
+    PRIMARY KEY (cache_key, item_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS collections (
+    cache_key TEXT NOT NULL,
+    collection_key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (cache_key, collection_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS candidates (
+    arxiv_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    fetched_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recommendations (
+    cache_key TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    zotero_id TEXT,
+    arxiv_query TEXT,
+    date_range TEXT,
+    selected_paper_keys TEXT,
+    papers TEXT NOT NULL,
+    cached_at TEXT NOT NULL,
+    accessed_at TEXT
+);
+CREATE TABLE IF NOT EXISTS reference_sets (
+    cache_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    paper_keys TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (cache_key, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS profiles (
+    cache_key TEXT NOT NULL,
+    selection TEXT NOT NULL,
+    model TEXT NOT NULL,
+    stamp TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (cache_key, selection, model)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS scores (
+    cache_key TEXT NOT NULL,
+    selection TEXT NOT NULL,
+    profile TEXT NOT NULL,
+    arxiv_id TEXT NOT NULL,
+    score REAL NOT NULL,
+    scored_at TEXT NOT NULL,
+    PRIMARY KEY (cache_key, selection, arxiv_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS enrichments (
+    arxiv_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (arxiv_id, kind, variant)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS recommendations_user ON recommendations (user_id);
+CREATE INDEX IF NOT EXISTS candidates_fetched ON candidates (fetched_at);
+"""
+
+# columns added after the first release of the schema: (table, column, type)
+MIGRATIONS = [
+    ('libraries', 'user_id', 'TEXT'),
+    ('libraries', 'accessed_at', 'TEXT'),
+    ('recommendations', 'accessed_at', 'TEXT'),
+    ('items', 'position', 'INTEGER'),
+]
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+class CacheStore:
+    def __init__(self, path:str|Path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._touched = {}
+        self._touched_lock = threading.Lock()
+        conn = self._conn()
+        for table, column, type_ in MIGRATIONS:
+            if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is None:
+                continue
+            if column not in [r['name'] for r in conn.execute(f'PRAGMA table_info({table})')]:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {type_}')
+        conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    # ---- Zotero libraries ----
+
+    def library_stamp(self, cache_key:str) -> tuple[int, str]|None:
+        """(revision, cached_at) of a stored library; the revision changes whenever its rows do."""
+        row = self._conn().execute('SELECT revision, cached_at FROM libraries WHERE cache_key = ?', (cache_key,)).fetchone()
+        return (row['revision'], row['cached_at']) if row else None
+
+    def load_library(self, cache_key:str) -> dict|None:
+        conn = self._conn()
+        lib = conn.execute('SELECT * FROM libraries WHERE cache_key = ?', (cache_key,)).fetchone()
+        if lib is None:
+            return None
+        # in the order Zotero returned the items
+        corpus = [json.loads(r['data']) for r in conn.execute('SELECT data FROM items WHERE cache_key = ? ORDER BY position, item_key', (cache_key,))]
+        collections = {r['collection_key']: json.loads(r['data']) for r in conn.execute('SELECT collection_key, data FROM collections WHERE cache_key = ?', (cache_key,))}
+        return {
+            'corpus': corpus,
+            'collections': collections,
+            'cached_at': lib['cached_at'],
+            'zotero_id': lib['zotero_id'],
+            'revision': lib['revision'],
+            'bytes': lib['bytes'],
+        }
+
+    def _touch_due(self, key:tuple, min_interval:float) -> bool:
+        now = time.time()
+        with self._touched_lock:
+            if now - self._touched.get(key, 0) < min_interval:
+                return False
+            if len(self._touched) > 10000:
+                self._touched = {k: t for k, t in self._touched.items() if now - t < min_interval}
+            self._touched[key] = now
+            return True
+
+    def touch_library(self, cache_key:str, min_interval:float=300):
+        """Record an access for LRU eviction, writing at most once per `min_interval` seconds per library."""
+        if not self._touch_due(('library', cache_key), min_interval):
+            return
+        with self.transaction() as conn:
+            conn.execute('UPDATE libraries SET accessed_at = ? WHERE cache_key = ?', (datetime.now().isoformat(), cache_key))
+
+    def save_library(self, cache_key:str, user_id:str, zotero_id:str, corpus:list[dict], collections:dict, item_hash:Callable[[dict], str]) -> tuple[int, str, int]:
+        """Upsert changed items and collections, delete vanished ones; returns (revision, cached_at, bytes).
+
+        Items keep their position in `corpus`, so `load_library` returns them in the same order.
+        """
+        cached_at = datetime.now().isoformat()
+        hashes = {item['key']: item_hash(item) for item in corpus}
+        positions = {item['key']: i for i, item in enumerate(corpus)}
+        with self.transaction() as conn:
+            stored = {r['item_key']: (r['hash'], r['position']) for r in conn.execute('SELECT item_key, hash, position FROM items WHERE cache_key = ?', (cache_key,))}
+            changed = [item for item in corpus if stored.get(item['key'], (None,))[0] != hashes[item['key']]]
+            moved = [(positions[k], cache_key, k) for k, (h, position) in stored.items() if h == hashes.get(k) and position != positions[k]]
+            removed = [(cache_key, k) for k in stored if k not in hashes]
+            conn.executemany(
+                'INSERT INTO items (cache_key, item_key, hash, data, position) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (cache_key, item_key) DO UPDATE SET hash = excluded.hash, data = excluded.data, position = excluded.position',
+                [(cache_key, item['key'], hashes[item['key']], _dumps(item), positions[item['key']]) for item in changed],
+            )
+            conn.executemany('UPDATE items SET position = ? WHERE cache_key = ? AND item_key = ?', moved)
+            conn.executemany('DELETE FROM items WHERE cache_key = ? AND item_key = ?', removed)
+            stored_collections = dict(conn.execute('SELECT collection_key, data FROM collections WHERE cache_key = ?', (cache_key,)).fetchall())
+            new_collections = {k: _dumps(c) for k, c in collections.items()}
+            conn.executemany(
+                'INSERT INTO collections (cache_key, collection_key, data) VALUES (?, ?, ?) '
+                'ON CONFLICT (cache_key, collection_key) DO UPDATE SET data = excluded.data',
+                [(cache_key, k, d) for k, d in new_collections.items() if stored_collections.get(k) != d],
+            )
+            conn.executemany('DELETE FROM collections WHERE cache_key = ? AND collection_key = ?', [(cache_key, k) for k in stored_collections if k not in new_collections])
+            size = conn.execute('SELECT COALESCE(SUM(LENGTH(data)), 0) FROM items WHERE cache_key = ?', (cache_key,)).fetchone()[0]
+            row = conn.execute('SELECT revision FROM libraries WHERE cache_key = ?', (cache_key,)).fetchone()
+            revision = row['revision'] if row else 0
+            if changed or moved or removed or row is None:
+                revision += 1
+            conn.execute(
+                'INSERT INTO libraries (cache_key, user_id, zotero_id, cached_at, accessed_at, revision, bytes) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (cache_key) DO UPDATE SET user_id = excluded.user_id, zotero_id = excluded.zotero_id, cached_at = excluded.cached_at, '
+                'accessed_at = excluded.accessed_at, revision = excluded.revision, bytes = excluded.bytes',
+                (cache_key, user_id, zotero_id, cached_at, cached_at, revision, size),
+            )
+        return revision, cached_at, size
+
+    def delete_library(self, cache_key:str) -> bool:
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM items WHERE cache_key = ?', (cache_key,))
+            conn.execute('DELETE FROM collections WHERE cache_key = ?', (cache_key,))
+            conn.execute('DELETE FROM profiles WHERE cache_key = ?', (cache_key,))
+            conn.execute('DELETE FROM scores WHERE cache_key = ?', (cache_key,))
+            return conn.execute('DELETE FROM libraries WHERE cache_key = ?', (cache_key,)).rowcount > 0
+
+    # ---- reference sets and their profile vectors ----
+
+    def list_reference_sets(self, cache_key:str) -> list[dict]:
+        rows = self._conn().execute('SELECT name, size, updated_at FROM reference_sets WHERE cache_key = ? ORDER BY name', (cache_key,))
+        return [dict(r) for r in rows]
+
+    def load_reference_set(self, cache_key:str, name:str) -> set[str]|None:
+        row = self._conn().execute('SELECT paper_keys FROM reference_sets WHERE cache_key = ? AND name = ?', (cache_key, name)).fetchone()
+        return set(json.loads(row['paper_keys'])) if row is not None else None
+
+    def save_reference_set(self, cache_key:str, name:str, paper_keys:set[str]) -> str:
+        updated_at = datetime.now().isoformat()
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT INTO reference_sets (cache_key, name, paper_keys, size, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (cache_key, name) DO UPDATE SET paper_keys = excluded.paper_keys, size = excluded.size, updated_at = excluded.updated_at',
+                (cache_key, name, _dumps(sorted(paper_keys)), len(paper_keys), updated_at),
+            )
+        return updated_at
+
+    def delete_reference_set(self, cache_key:str, name:str) -> bool:
+        with self.transaction() as conn:
+            return conn.execute('DELETE FROM reference_sets WHERE cache_key = ? AND name = ?', (cache_key, name)).rowcount > 0
+
+    def load_profile(self, cache_key:str, selection:str, model:str, stamp:str) -> np.ndarray|None:
+        """The profile vector of a selection, if it was built from the corpus identified by `stamp`."""
+        row = self._conn().execute(
+            'SELECT stamp, vector FROM profiles WHERE cache_key = ? AND selection = ? AND model = ?', (cache_key, selection, model)
+        ).fetchone()
+        if row is None or row['stamp'] != stamp:
+            return None
+        return np.frombuffer(row['vector'], dtype=np.float32)
+
+    def save_profile(self, cache_key:str, selection:str, model:str, stamp:str, vector:np.ndarray):
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT INTO profiles (cache_key, selection, model, stamp, vector) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (cache_key, selection, model) DO UPDATE SET stamp = excluded.stamp, vector = excluded.vector',
+                (cache_key, selection, model, stamp, np.asarray(vector, dtype=np.float32).tobytes()),
+            )
+
+    def load_scores(self, cache_key:str, selection:str, profile:str) -> dict[str, float]:
+        """Candidate scores computed against this profile version of the selection."""
+        rows = self._conn().execute(
+            'SELECT arxiv_id, score FROM scores WHERE cache_key = ? AND selection = ? AND profile = ?', (cache_key, selection, profile)
+        )
+        return {r['arxiv_id']: r['score'] for r in rows}
+
+    def save_scores(self, cache_key:str, selection:str, profile:str, scores:dict[str, float]):
+        """Store new scores; scores of an older profile version of the selection are dropped."""
+        scored_at = datetime.now().isoformat()
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM scores WHERE cache_key = ? AND selection = ? AND profile != ?', (cache_key, selection, profile))
+            conn.executemany(
+                'INSERT INTO scores (cache_key, selection, profile, arxiv_id, score, scored_at) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (cache_key, selection, arxiv_id) DO UPDATE SET profile = excluded.profile, score = excluded.score, scored_at = excluded.scored_at',
+                [(cache_key, selection, profile, arxiv_id, score, scored_at) for arxiv_id, score in scores.items()],
+            )
+
+    # ---- arXiv candidates ----
+
+    def save_candidates(self, papers:list[dict]):
+        """Store formatted candidate metadata; scores are per user and are not kept here."""
+        fetched_at = datetime.now().isoformat()
+        with self.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO candidates (arxiv_id, data, fetched_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (arxiv_id) DO UPDATE SET data = excluded.data, fetched_at = excluded.fetched_at',
+                [(p['arxiv_id'], _dumps({k: v for k, v in p.items() if k != 'score'}), fetched_at) for p in papers],
+            )
+
+    def load_candidates(self, arxiv_ids:list[str]) -> dict[str, dict]:
+        conn = self._conn()
+        found = {}
+        # stay well below SQLite's bound-parameter limit
+        for i in range(0, len(arxiv_ids), 500):
+            batch = arxiv_ids[i:i + 500]
+            rows = conn.execute(f"SELECT arxiv_id, data FROM candidates WHERE arxiv_id IN ({','.join('?' * len(batch))})", batch)
+            found.update((r['arxiv_id'], json.loads(r['data'])) for r in rows)
+        return found
+
+    # ---- per-paper enrichments (TLDRs), shared by all users ----
+
+    def load_enrichment(self, arxiv_id:str, kind:str, variant:str='') -> str|None:
+        row = self._conn().execute(
+            'SELECT value FROM enrichments WHERE arxiv_id = ? AND kind = ? AND variant = ?', (arxiv_id, kind, variant)
+        ).fetchone()
+        return row['value'] if row else None
+
+    def save_enrichment(self, arxiv_id:str, kind:str, value:str, variant:str=''):
+        """`variant` separates results that depend on settings, such as the language and model of a TLDR."""
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT INTO enrichments (arxiv_id, kind, variant, value, created_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (arxiv_id, kind, variant) DO UPDATE SET value = excluded.value, created_at = excluded.created_at',
+                (arxiv_id, kind, variant, value, datetime.now().isoformat()),
+            )
+
+    # ---- recommendation results ----
+
+    def load_recommendations(self, cache_key:str, min_interval:float=300) -> dict|None:
+        """The cached result; like `touch_library`, the access time is written at most once per `min_interval` seconds."""
+        conn = self._conn()
+        row = conn.execute('SELECT * FROM recommendations WHERE cache_key = ?', (cache_key,)).fetchone()
+        if row is None:
+            return None
+        if self._touch_due(('recommendations', cache_key), min_interval):
+            with self.transaction() as conn:
+                conn.execute('UPDATE recommendations SET accessed_at = ? WHERE cache_key = ?', (datetime.now().isoformat(), cache_key))
+        return {
+            'papers': json.loads(row['papers']),
+            'arxiv_query': row['arxiv_query'],
+            'date_range': row['date_range'],
+            'selected_paper_keys': json.loads(row['selected_paper_keys']),
+            'cached_at': row['cached_at'],
+            'zotero_id': row['zotero_id'],
+        }
+
+    def save_recommendations(self, cache_key:str, user_id:str, zotero_id:str, arxiv_query:str, date_range:str, selected_paper_keys:set[str]|None, papers:list[dict], touch:bool=True):
+        """Upsert a result; `touch=False` (background pre-warming) keeps the last user access time."""
+        now = datetime.now().isoformat()
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT INTO recommendations (cache_key, user_id, zotero_id, arxiv_query, date_range, selected_paper_keys, papers, cached_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (cache_key) DO UPDATE SET papers = excluded.papers, '
+                'cached_at = excluded.cached_at, accessed_at = COALESCE(excluded.accessed_at, recommendations.accessed_at)',
+                (cache_key, user_id, zotero_id, arxiv_query, date_range, _dumps(sorted(selected_paper_keys) if selected_paper_keys else None), _dumps(papers), now, now if touch else None),
+            )
+
+    def recent_recommendations(self, accessed_since:str) -> list[dict]:
+        """Result rows (without papers) that a user opened since the given time, most recent first."""
+        rows = self._conn().execute(
+            'SELECT cache_key, user_id, zotero_id, arxiv_query, date_range, selected_paper_keys, cached_at, accessed_at FROM recommendations '
+            'WHERE accessed_at >= ? ORDER BY accessed_at DESC', (accessed_since,)
+        )
+        return [{**dict(r), 'selected_paper_keys': json.loads(r['selected_paper_keys'])} for r in rows]
+
+    def delete_recommendations(self, cache_keys:list[str]):
+        with self.transaction() as conn:
+            conn.executemany('DELETE FROM recommendations WHERE cache_key = ?', [(k,) for k in cache_keys])
+
+    # ---- maintenance ----
+
+    def entries(self) -> list[dict]:
+        """Every evictable library and recommendation row with its owner, last access and size."""
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT 'library' AS kind, cache_key, user_id, COALESCE(accessed_at, cached_at) AS accessed_at, bytes FROM libraries "
+            "UNION ALL SELECT 'recommendation', cache_key, user_id, COALESCE(accessed_at, cached_at), LENGTH(papers) FROM recommendations"
+        )
+        return [dict(r) for r in rows]
+
+    def purge_expired(self, recommendations_before:str, candidates_before:str, enrichments_before:str|None=None) -> dict:
+        with self.transaction() as conn:
+            purged = {
+                'recommendations': conn.execute('DELETE FROM recommendations WHERE cached_at < ?', (recommendations_before,)).rowcount,
+                'candidates': conn.execute('DELETE FROM candidates WHERE fetched_at < ?', (candidates_before,)).rowcount,
+                'scores': conn.execute('DELETE FROM scores WHERE scored_at < ?', (candidates_before,)).rowcount,
+            }
+            if enrichments_before is not None:
+                purged['enrichments'] = conn.execute('DELETE FROM enrichments WHERE created_at < ?', (enrichments_before,)).rowcount
+            return purged
+
+    def file_size(self) -> int:
+        return sum(Path(self.path + suffix).stat().st_size for suffix in ('', '-wal', '-shm') if Path(self.path + suffix).exists())
+
+    def free_bytes(self) -> int:
+        """Bytes of unused pages that only a `compact` returns to the file system."""
+        conn = self._conn()
+        return conn.execute('PRAGMA freelist_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+    def candidate_bytes(self) -> int:
+        """Bytes of the data shared by all users: candidates and enrichments."""
+        conn = self._conn()
+        return (conn.execute('SELECT COALESCE(SUM(LENGTH(data)), 0) FROM candidates').fetchone()[0]
+                + conn.execute('SELECT COALESCE(SUM(LENGTH(value)), 0) FROM enrichments').fetchone()[0])
+
+    def compact(self):
+        """Give the pages freed by deletions back to the file system."""
+        conn = self._conn()
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
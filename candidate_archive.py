@@ -0,0 +1,248 @@
+"""Append-only local archive of the arXiv candidates seen each day.
+
+An archive directory holds one embedding model's view of past candidates:
+
+- ``candidates.emb``: row-aligned float16 matrix [count, dim] of unit-normalized
+  abstract embeddings, opened with ``np.memmap``
+- ``candidates.jsonl``: one metadata record per row (ID, title, authors, abstract,
+  PDF link, categories, day)
+- ``index.json``: model, dim, row count and the date index ``{day: [[start, end), ...]]``
+
+Rows are only ever appended: matrix first, metadata second, index last. The
+index's row count is authoritative, so rows written by an interrupted append are
+ignored and overwritten by the next one. A paper is archived once, on the first
+day it is seen.
+
+The web app, ``main.py`` and ``oai_harvester.py`` may share one directory.
+Appends hold an exclusive ``flock`` on ``archive.lock`` and first pick up the
+rows other processes added; reads pick them up whenever ``index.json`` changed.
+
+Because the rows are normalized, a time-weighted interest profile from
+`recommender.corpus_profile` scores any window of days with one matrix product
+(``rows @ profile * 10``), without network access or re-encoding.
+"""
+import json
+import os
+import re
+import threading
+import numpy as np
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+try:
+    import fcntl
+except ImportError:
+    # no inter-process locking on Windows; one writer at a time there
+    fcntl = None
+
+Author = namedtuple('Author', 'name')
+
+class ArchivedPaper:
+    """An archived candidate with the attributes of `ArxivPaper` that ranking and formatting use."""
+    def __init__(self, record:dict, score:float|None=None):
+        self.arxiv_id = record['arxiv_id']
+        self.title = record['title']
+        self.summary = record['summary']
+        self.authors = [Author(name) for name in record['authors']]
+        self.pdf_url = record['pdf_url']
+        self.categories = record['categories']
+        self.day = record['day']
+        self.score = score
+
+def archive_record(paper) -> dict:
+    """Metadata of an `ArxivPaper` as stored in the archive."""
+    return {
+        'arxiv_id': paper.arxiv_id,
+        'title': paper.title,
+        'summary': paper.summary,
+        'authors': [a.name for a in paper.authors],
+        'pdf_url': paper.pdf_url,
+        'categories': list(paper.categories),
+    }
+
+def parse_categories(query:str|None) -> set[str]|None:
+    """Categories of an RSS query like ``cs.AI+cs.CV``; None matches every category."""
+    return {c for c in query.split('+') if c} if query else None
+
+def matches_categories(categories:list[str], wanted:set[str]) -> bool:
+    """Whether any of `categories` is wanted; a whole archive such as `cs` or `math` matches all of its subcategories."""
+    return any(c in wanted or c.split('.', 1)[0] in wanted for c in categories)
+
+def archive_directory(root:str|Path, model_id:str) -> Path:
+    """Directory under `root` of the archive of embedding model `model_id` (``model:backend``)."""
+    return Path(root) / re.sub(r'[^\w.-]', '_', model_id)
+
+class CandidateArchive:
+    def __init__(self, directory:str|Path, model:str):
+        self.directory = Path(directory)
+        self.model = model
+        self._lock = threading.Lock()
+        self.dim = None
+        self.count = 0
+        self.days = {}
+        self.records = []
+        self.ids = {}
+        # bytes of candidates.jsonl that belong to indexed rows
+        self._meta_size = 0
+        # (mtime, size) of the index.json last read
+        self._index_stamp = None
+        with self._lock:
+            self._sync()
+
+    @property
+    def _emb(self) -> Path:
+        return self.directory / 'candidates.emb'
+
+    @property
+    def _meta(self) -> Path:
+        return self.directory / 'candidates.jsonl'
+
+    @property
+    def _index(self) -> Path:
+        return self.directory / 'index.json'
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.directory / 'archive.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Pick up the rows other processes appended since the index was last read; call with `_lock` held."""
+        try:
+            # before reading: if the index is replaced meanwhile, the next call reads it again
+            st = self._index.stat()
+        except FileNotFoundError:
+            return
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self._index_stamp:
+            return
+        with open(self._index, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index['model'] != self.model:
+            raise ValueError(f"Archive {self.directory} holds embeddings of {index['model']}, not {self.model}.")
+        if index['count'] < self.count:
+            # the archive was replaced by a smaller one: read it from the start
+            self.records, self.ids, self._meta_size = [], {}, 0
+        if index['count'] > len(self.records):
+            with open(self._meta, 'rb') as f:
+                f.seek(self._meta_size)
+                for line in f:
+                    if len(self.records) == index['count']:
+                        break
+                    record = json.loads(line)
+                    self.ids[record['arxiv_id']] = len(self.records)
+                    self.records.append(record)
+                    self._meta_size += len(line)
+        self.dim = index['dim']
+        self.count = index['count']
+        self.days = {day: [tuple(r) for r in ranges] for day, ranges in index['days'].items()}
+        self._index_stamp = stamp
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, arxiv_id:str) -> bool:
+        return arxiv_id in self.ids
+
+    def _truncate(self, path:Path, size:int):
+        # drop what an interrupted append left beyond the indexed rows
+        if path.exists() and path.stat().st_size > size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+    def append(self, day:str, records:list[dict], vectors:np.ndarray) -> int:
+        """Archive the papers not archived yet under `day` (YYYY-MM-DD); returns how many were added."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock, self._file_lock():
+            # other processes may have appended since this archive last looked
+            self._sync()
+            new = [i for i, r in enumerate(records) if r['arxiv_id'] not in self.ids]
+            # the same paper twice in one call
+            new = list({records[i]['arxiv_id']: i for i in new}.values())
+            if not new:
+                return 0
+            vectors = np.asarray(vectors, dtype=np.float32)[new]
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = (vectors / np.where(norms == 0, 1, norms)).astype(np.float16)
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {vectors.shape[1]} does not match the archive's {self.dim}.")
+            self._truncate(self._emb, self.count * self.dim * 2)
+            with open(self._emb, 'ab') as f:
+                vectors.tofile(f)
+            added = [{**records[i], 'day': day} for i in new]
+            lines = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in added).encode('utf-8')
+            self._truncate(self._meta, self._meta_size)
+            with open(self._meta, 'ab') as f:
+                f.write(lines)
+            start, end = self.count, self.count + len(added)
+            ranges = self.days.setdefault(day, [])
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+            index = {'model': self.model, 'dim': self.dim, 'count': end, 'days': {d: [list(r) for r in rs] for d, rs in sorted(self.days.items())}}
+            tmp = self._index.with_name(f'index.json.tmp{os.getpid()}')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            os.replace(tmp, self._index)
+            st = self._index.stat()
+            self._index_stamp = (st.st_mtime_ns, st.st_size)
+            for r in added:
+                self.ids[r['arxiv_id']] = len(self.records)
+                self.records.append(r)
+            self.count = end
+            self._meta_size += len(lines)
+            return len(added)
+
+    def select(self, start:str, end:str, categories:set[str]|None=None) -> np.ndarray:
+        """Rows archived on days `start` to `end` (inclusive, YYYY-MM-DD), optionally in the given categories."""
+        with self._lock:
+            self._sync()
+            rows = [np.arange(a, b) for day, ranges in self.days.items() if start <= day <= end for a, b in ranges]
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        if categories:
+            rows = rows[[matches_categories(self.records[i]['categories'], categories) for i in rows]] if len(rows) else rows
+        return rows
+
+    def vectors(self) -> np.ndarray:
+        """Memory map of all archived (normalized) embeddings."""
+        with self._lock:
+            self._sync()
+            count, dim = self.count, self.dim
+        if count == 0:
+            return np.zeros((0, dim or 0), dtype=np.float16)
+        return np.memmap(self._emb, dtype=np.float16, mode='r', shape=(count, dim))
+
+    def top_k(self, rows:np.ndarray, profile:np.ndarray, k:int|None, chunk_size:int=16384) -> list[ArchivedPaper]:
+        """The best `k` (all if None or -1) of `rows` against an interest profile, highest score first."""
+        if len(rows) == 0:
+            return []
+        data = self.vectors()
+        profile = np.asarray(profile, dtype=np.float32)
+        # rows of one window are mostly contiguous, so chunks of the memmap are read sequentially
+        scores = np.concatenate([
+            np.asarray(data[rows[i:i + chunk_size]], dtype=np.float32) @ profile * 10
+            for i in range(0, len(rows), chunk_size)
+        ])
+        k = len(rows) if k is None or k < 0 else min(k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        best = best[np.lexsort((rows[best], -scores[best]))]
+        return [ArchivedPaper(self.records[rows[i]], float(scores[i])) for i in best]
+
+    def stats(self) -> dict:
+        return {
+            'papers': self.count,
+            'days': len(self.days),
+            'first_day': min(self.days) if self.days else None,
+            'last_day': max(self.days) if self.days else None,
+            'bytes': sum(p.stat().st_size for p in (self._emb, self._meta, self._index) if p.exists()),
+        }
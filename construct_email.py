@@ -8,6 +8,8 @@ import smtplib
 import datetime
 import time
 from loguru import logger
+from profiling import profiled
+from llm import get_llm
 
 framework = """
 <!DOCTYPE HTML>
@@ -101,10 +103,58 @@ def get_block_html(title:str, authors:str, rate:str,arxiv_id:str, abstract:str,
 """
     return block_template.format(title=title, authors=authors,rate=rate,arxiv_id=arxiv_id, abstract=abstract, pdf_url=pdf_url, code=code, affiliations=affiliations)
 
+def get_compact_block_html(title:str, authors:str, arxiv_id:str, abstract:str, pdf_url:str):
+    block_template = """
+    <table border="0" cellpadding="0" cellspacing="0" width="100%" style="font-family: Arial, sans-serif; border: 1px solid #eee; border-radius: 8px; padding: 12px; background-color: #fcfcfc;">
+    <tr>
+        <td style="font-size: 16px; font-weight: bold; color: #333;">
+            <a href="https://arxiv.org/abs/{arxiv_id}" target="_blank" style="color: #333; text-decoration: none;">{title}</a>
+        </td>
+    </tr>
+    <tr>
+        <td style="font-size: 13px; color: #666; padding: 4px 0;">
+            {authors} · <a href="{pdf_url}" style="color: #d9534f;">PDF</a>
+        </td>
+    </tr>
+    <tr>
+        <td style="font-size: 13px; color: #555; padding: 4px 0;">
+            {abstract}
+        </td>
+    </tr>
+</table>
+"""
+    return block_template.format(title=title, authors=authors, arxiv_id=arxiv_id, abstract=abstract, pdf_url=pdf_url)
+
+# scores at or below this get no star, and by default no TLDR either
+STAR_MIN_SCORE = 6
+
+class EnrichmentPolicy:
+    """Decides which papers get the full block: source download, TLDR, affiliations and code link.
+
+    A paper is enriched while its score is above `min_score`, it is among the first
+    `top_k` papers (all if None or -1), and `deadline` seconds (none if 0) have not
+    passed since rendering started. The others get a compact abstract-only block.
+    """
+    def __init__(self, min_score:float=STAR_MIN_SCORE, top_k:int=None, deadline:float=0):
+        self.min_score = min_score
+        self.top_k = top_k
+        self.deadline = deadline
+        self.started = time.monotonic()
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def allows(self, rank:int, paper:ArxivPaper) -> bool:
+        if self.top_k is not None and self.top_k >= 0 and rank >= self.top_k:
+            return False
+        if self.min_score is not None and (paper.score or 0) <= self.min_score:
+            return False
+        return not self.deadline or time.monotonic() - self.started < self.deadline
+
 def get_stars(score:float):
     full_star = '<span class="full-star">⭐</span>'
     half_star = '<span class="half-star">⭐</span>'
-    low = 6
+    low = STAR_MIN_SCORE
     high = 8
     if score <= low:
         return ''
@@ -118,13 +168,18 @@ def get_stars(score:float):
         return '<div class="star-wrapper">'+full_star * full_star_num + half_star * half_star_num + '</div>'
 
 
-def render_email(papers:list[ArxivPaper]):
+@profiled('render_email')
+def render_email(papers:list[ArxivPaper], policy:EnrichmentPolicy=None):
     parts = []
     if len(papers) == 0 :
         return framework.replace('__CONTENT__', get_empty_html())
     
-    for p in tqdm(papers,desc='Rendering Email'):
-        rate = get_stars(p.score)
+    policy = policy or EnrichmentPolicy()
+    policy.start()
+    llm = None
+    budget_left = True
+    enriched = 0
+    for i, p in enumerate(tqdm(papers,desc='Rendering Email')):
         author_list = [a.name for a in p.authors]
         num_authors = len(author_list)
         
@@ -132,6 +187,20 @@ def render_email(papers:list[ArxivPaper]):
             authors = ', '.join(author_list)
         else:
             authors = ', '.join(author_list[:3] + ['...'] + author_list[-2:])
+
+        enrich = policy.allows(i, p)
+        if enrich and budget_left:
+            # the LLM is only loaded once a paper actually needs it
+            llm = llm or get_llm()
+            # once the LLM budget is used up, the remaining (lower-ranked) papers get their abstract instead
+            if llm.budget_exhausted():
+                budget_left = False
+                logger.warning(f"LLM budget used up after {i} papers, showing the abstract for the remaining {len(papers) - i}.")
+        if not (enrich and budget_left):
+            parts.append(get_compact_block_html(p.title, authors, p.arxiv_id, p.summary, p.pdf_url))
+            continue
+
+        rate = get_stars(p.score)
         if p.affiliations is not None:
             affiliations = p.affiliations[:5]
             affiliations = ', '.join(affiliations)
@@ -140,8 +209,10 @@ def render_email(papers:list[ArxivPaper]):
         else:
             affiliations = 'Unknown Affiliation'
         parts.append(get_block_html(p.title, authors,rate,p.arxiv_id ,p.tldr, p.pdf_url, p.code_url, affiliations))
+        enriched += 1
         time.sleep(10)
 
+    logger.info(f"Enriched {enriched} of {len(papers)} papers, the others are shown with their abstract.")
     content = '<br>' + '</br><br>'.join(parts) + '</br>'
     return framework.replace('__CONTENT__', content)
 
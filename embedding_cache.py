@@ -0,0 +1,74 @@
+"""Process-wide embedding cache shared by every user.
+
+Entries are keyed by a hash of the model and the whitespace-normalized text, so the
+same abstract is encoded once no matter how many libraries or candidate pools it
+appears in. The cache is an LRU bounded by the total size of the stored vectors.
+"""
+import os
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+def normalize_text(text:str) -> str:
+    return ' '.join(text.split())
+
+class EmbeddingCache:
+    def __init__(self, max_bytes:int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(model:str, text:str) -> str:
+        return hashlib.sha1(f"{model}\0{normalize_text(text)}".encode()).hexdigest()
+
+    def get(self, key:str) -> np.ndarray|None:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key:str, vector:np.ndarray):
+        if self.max_bytes <= 0:
+            return
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = vector
+            self._bytes += vector.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+GLOBAL_EMBEDDING_CACHE = EmbeddingCache(int(float(os.getenv('EMBEDDING_CACHE_MB', '256')) * 1024 * 1024))
@@ -0,0 +1,154 @@
+"""Compact on-disk embedding matrices.
+
+A store named ``path`` consists of three files:
+
+- ``path.<generation>.emb``: row-aligned float16 or int8 matrix of shape [count, dim]
+- ``path.<generation>.scale``: float32 per-row scale, only for int8
+- ``path.json``: sidecar index with the model, dtype, shape, generation, item keys and versions
+
+Every save writes the matrix files of a new generation and then switches to them
+by replacing the sidecar, the one atomic step. A crash or a concurrent writer can
+therefore never pair one save's keys with another save's rows: a sidecar only
+names matrix files written together with it. Generation names start with the
+save's ``time_ns``; after the switch, a save removes the generations older than
+the one the sidecar named before it, so the files of a concurrent save still in
+progress are never touched.
+
+The matrix files are opened with ``np.memmap``, so loading a store costs one small
+JSON read and rows are paged in from the OS cache only when they are used.
+"""
+import os
+import json
+import threading
+import time
+import numpy as np
+from pathlib import Path
+
+STORE_DTYPES = ('float16', 'int8')
+
+def quantize(embeddings:np.ndarray, dtype:str) -> tuple[np.ndarray, np.ndarray|None]:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype == 'float16':
+        return embeddings.astype(np.float16), None
+    if dtype == 'int8':
+        scale = np.abs(embeddings).max(axis=1) / 127
+        scale[scale == 0] = 1
+        data = np.round(embeddings / scale[:, None]).astype(np.int8)
+        return data, scale.astype(np.float32)
+    raise ValueError(f"Unknown store dtype: {dtype}. Choose from {STORE_DTYPES}.")
+
+def _file(path:Path, suffix:str) -> Path:
+    return path.with_name(path.name + suffix)
+
+def _matrix_file(path:Path, generation:str|None, suffix:str) -> Path:
+    # stores saved before generations existed keep their matrices at path.emb / path.scale
+    return _file(path, f'.{generation}{suffix}' if generation else suffix)
+
+def _generation_time(generation:str|None) -> int:
+    # 'g' and 16 hex digits of time_ns, with or without separators after them
+    try:
+        return int(generation[1:17], 16)
+    except (TypeError, ValueError):
+        return 0
+
+def _replace(path:Path, write):
+    tmp = _file(path, f'.tmp{os.getpid()}_{threading.get_ident()}')
+    write(tmp)
+    os.replace(tmp, path)
+
+class EmbeddingStore:
+    def __init__(self, path:Path, meta:dict, data:np.ndarray|None=None, scale:np.ndarray|None=None):
+        self.path = Path(path)
+        self.model = meta['model']
+        self.dtype = meta['dtype']
+        self.dim = meta['dim']
+        self.keys = meta['keys']
+        self.versions = meta['versions']
+        self.generation = meta.get('generation')
+        self.index = {k: i for i, k in enumerate(self.keys)}
+        shape = (len(self.keys), self.dim)
+        if data is not None:
+            # just saved: the arrays in memory, not the files a concurrent save may already have replaced
+            self.data = data
+            self.scale = scale
+        elif len(self.keys) == 0:
+            self.data = np.zeros(shape, dtype=self.dtype)
+            self.scale = None if self.dtype == 'float16' else np.zeros(0, dtype=np.float32)
+        else:
+            self.data = np.memmap(_matrix_file(self.path, self.generation, '.emb'), dtype=self.dtype, mode='r', shape=shape)
+            self.scale = None if self.dtype == 'float16' else np.memmap(_matrix_file(self.path, self.generation, '.scale'), dtype=np.float32, mode='r', shape=(len(self.keys),))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def load(cls, path:str|Path) -> 'EmbeddingStore|None':
+        meta_path = _file(Path(path), '.json')
+        if not meta_path.exists():
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        generation = meta.get('generation')
+        expected = {'.emb': len(meta['keys']) * meta['dim'] * np.dtype(meta['dtype']).itemsize}
+        if meta['dtype'] != 'float16':
+            expected['.scale'] = len(meta['keys']) * 4
+        try:
+            # the files of the sidecar's generation are gone if a concurrent save cleaned them up
+            for suffix, size in expected.items():
+                if size and _matrix_file(Path(path), generation, suffix).stat().st_size != size:
+                    return None
+            return cls(path, meta)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def save(cls, path:str|Path, model:str, keys:list[str], versions:list[int], embeddings:np.ndarray, dtype:str='float16') -> 'EmbeddingStore':
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data, scale = quantize(embeddings, dtype)
+        meta_path = _file(path, '.json')
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                previous = json.load(f).get('generation')
+        except (FileNotFoundError, ValueError):
+            previous = None
+        generation = f'g{time.time_ns():016x}-{os.getpid():x}-{threading.get_ident() % 65536:x}'
+        _replace(_matrix_file(path, generation, '.emb'), lambda p: data.tofile(p))
+        if scale is not None:
+            _replace(_matrix_file(path, generation, '.scale'), lambda p: scale.tofile(p))
+        meta = {'model': model, 'dtype': dtype, 'dim': int(data.shape[1]), 'generation': generation, 'keys': list(keys), 'versions': list(versions)}
+        def write_meta(p):
+            with open(p, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        _replace(meta_path, write_meta)
+        cls._remove_old_generations(path, previous)
+        return cls(path, meta, data, scale)
+
+    @staticmethod
+    def _remove_old_generations(path:Path, previous:str|None):
+        """Remove the generations older than `previous`, the one the sidecar named before this save."""
+        # open memory maps of earlier loads stay valid after the unlink
+        old = [_file(path, '.emb'), _file(path, '.scale')]
+        cutoff = _generation_time(previous)
+        old += [p for p in path.parent.glob(f'{path.name}.g*') if p.suffix in ('.emb', '.scale') and _generation_time(p.name[len(path.name) + 1:]) < cutoff]
+        for p in old:
+            try:
+                p.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    def rows(self, rows:np.ndarray|slice) -> np.ndarray:
+        """Dequantize the given rows into a float32 matrix."""
+        data = np.asarray(self.data[rows], dtype=np.float32)
+        if self.scale is not None:
+            data *= self.scale[rows][:, None]
+        return data
+
+    def match(self, keys:list[str], versions:list[int]) -> np.ndarray:
+        """Row of each (key, version) in the store, -1 where it is missing or outdated."""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        for i, (k, v) in enumerate(zip(keys, versions)):
+            r = self.index.get(k)
+            if r is not None and self.versions[r] == v:
+                rows[i] = r
+        return rows
@@ -0,0 +1,102 @@
+"""Multi-centroid interest index over the time-weighted Zotero corpus.
+
+The profile vector of `recommender.corpus_profile` scores a candidate by its cosine
+with the weighted mean of the library, so a broad library with several research
+threads is averaged into one direction that may match none of them. The index
+instead clusters the normalized corpus embeddings into k centroids, each carrying
+the summed time-decay weight of its members, and a candidate scores
+
+    10 * t * log(sum_k weight_k * exp(cos(candidate, centroid_k) / t))
+
+a weighted soft maximum over the centroids: a candidate close to any one thread
+scores high, even a small one, while the temperature ``t`` keeps heavily weighted
+threads ahead. As ``t`` grows the score tends to the linear weighted sum (the
+profile score); as it shrinks, to the best single centroid.
+
+Cluster assignments are kept per item key. Papers added later are assigned to their
+nearest centroid (nudging it with ``partial_fit``) instead of reclustering the library.
+"""
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from sklearn.cluster import MiniBatchKMeans
+
+def _normalize(x:np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+class InterestIndex:
+    def __init__(self, n_clusters:int, refit_ratio:float=0.5, seed:int=0, temperature:float=0.05):
+        self.n_clusters = n_clusters
+        self.temperature = temperature
+        # recluster from scratch once this share of the corpus is new to the index
+        self.refit_ratio = refit_ratio
+        self.seed = seed
+        self.kmeans = None
+        self.assignments = {}
+        self.centroids = None
+        self.weights = None
+        self._lock = threading.Lock()
+
+    @property
+    def fitted(self) -> bool:
+        return self.kmeans is not None
+
+    def fit(self, keys:list[str], embeddings:np.ndarray, weights:np.ndarray):
+        x = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            self.kmeans = MiniBatchKMeans(n_clusters=min(self.n_clusters, len(keys)), random_state=self.seed, n_init=3, batch_size=1024)
+            labels = self.kmeans.fit_predict(x, sample_weight=weights)
+            self.assignments = dict(zip(keys, labels.tolist()))
+            self._aggregate(x, labels, weights)
+
+    def update(self, keys:list[str], embeddings:np.ndarray, weights:np.ndarray):
+        """Bring the index in line with the current corpus, assigning only unseen keys."""
+        new = [i for i, k in enumerate(keys) if k not in self.assignments]
+        if not self.fitted or len(new) > self.refit_ratio * len(keys):
+            self.fit(keys, embeddings, weights)
+            return
+        x = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            if new:
+                self.kmeans.partial_fit(x[new], sample_weight=weights[new])
+                for i, label in zip(new, self.kmeans.predict(x[new]).tolist()):
+                    self.assignments[keys[i]] = label
+            if len(self.assignments) > len(keys):
+                current = set(keys)
+                self.assignments = {k: v for k, v in self.assignments.items() if k in current}
+            labels = np.array([self.assignments[k] for k in keys])
+            # weights are rank based, so every update re-aggregates them over the clusters
+            self._aggregate(x, labels, weights)
+
+    def _aggregate(self, x:np.ndarray, labels:np.ndarray, weights:np.ndarray):
+        sums = np.zeros((self.kmeans.n_clusters, x.shape[1]), dtype=np.float32)
+        np.add.at(sums, labels, x * weights[:, None])
+        self.centroids = _normalize(sums)
+        self.weights = np.bincount(labels, weights=weights, minlength=self.kmeans.n_clusters).astype(np.float32)
+
+    def score(self, candidate_feature:np.ndarray) -> np.ndarray:
+        with self._lock:
+            centroids, weights = self.centroids, self.weights
+        sim = _normalize(np.asarray(candidate_feature, dtype=np.float32)) @ centroids.T  # [n_candidate, k]
+        # log-sum-exp shifted by the row maximum; empty clusters (weight 0) drop out
+        logits = sim / self.temperature + np.log(np.maximum(weights, 1e-12))
+        top = logits.max(axis=1, keepdims=True)
+        return (self.temperature * (top[:, 0] + np.log(np.exp(logits - top).sum(axis=1)))) * 10
+
+_INDEXES = OrderedDict()
+_INDEXES_LOCK = threading.Lock()
+INDEX_CACHE_SIZE = int(os.getenv('INTEREST_INDEX_CACHE_SIZE', '32'))
+
+def get_interest_index(key:str, n_clusters:int) -> InterestIndex:
+    """Process-level LRU of indexes, so repeated runs for one library only assign new papers."""
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(key)
+        if index is None or index.n_clusters != n_clusters:
+            index = InterestIndex(n_clusters)
+            _INDEXES[key] = index
+        _INDEXES.move_to_end(key)
+        while len(_INDEXES) > INDEX_CACHE_SIZE:
+            _INDEXES.popitem(last=False)
+        return index
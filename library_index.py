@@ -0,0 +1,78 @@
+"""Membership index of a Zotero library, to drop candidates the user already has.
+
+A paper in the library matches itself better than anything else, so it would
+otherwise be fetched, embedded and ranked at the top. ``LibraryIndex`` holds
+three sets built from the Zotero items:
+
+- arXiv IDs (without version) found in ``url``, ``DOI`` (``10.48550/arXiv.*``),
+  ``archiveID`` and the ``arXiv:`` lines of ``extra``
+- DOIs, lower-cased and without resolver prefix
+- titles, case-folded with everything but letters and digits removed; short
+  titles are left out, they match unrelated papers too easily
+
+Candidates are checked by arXiv ID straight from the feed, before anything is
+fetched, and by DOI and title once their details are known.
+"""
+import re
+import unicodedata
+
+ARXIV_ID = re.compile(r'(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})(?:v\d+)?', re.IGNORECASE)
+DOI_PREFIX = re.compile(r'^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)', re.IGNORECASE)
+MIN_TITLE_LENGTH = 20
+
+def normalize_title(title:str) -> str:
+    return re.sub(r'[\W_]+', '', unicodedata.normalize('NFKC', title).casefold())
+
+def normalize_doi(doi:str) -> str:
+    return DOI_PREFIX.sub('', doi.strip()).lower()
+
+def strip_version(arxiv_id:str) -> str:
+    return re.sub(r'v\d+$', '', arxiv_id)
+
+def _arxiv_ids(text:str) -> list[str]:
+    # only text that mentions arXiv, so journal page numbers and the like are not taken for IDs
+    return [strip_version(m) for m in ARXIV_ID.findall(text)] if 'arxiv' in text.lower() else []
+
+class LibraryIndex:
+    def __init__(self):
+        self.arxiv_ids = set()
+        self.dois = set()
+        self.titles = set()
+
+    @classmethod
+    def from_corpus(cls, corpus:list[dict]) -> 'LibraryIndex':
+        index = cls()
+        for item in corpus:
+            index.add(item['data'])
+        return index
+
+    def add(self, data:dict):
+        """Index the fields of one Zotero item's ``data``."""
+        for field in ('url', 'DOI', 'archiveID'):
+            self.arxiv_ids.update(_arxiv_ids(data.get(field) or ''))
+        for line in (data.get('extra') or '').splitlines():
+            self.arxiv_ids.update(_arxiv_ids(line))
+        if data.get('DOI'):
+            self.dois.add(normalize_doi(data['DOI']))
+        title = normalize_title(data.get('title') or '')
+        if len(title) >= MIN_TITLE_LENGTH:
+            self.titles.add(title)
+
+    def __len__(self) -> int:
+        return len(self.arxiv_ids) + len(self.dois) + len(self.titles)
+
+    def nbytes(self) -> int:
+        """Rough memory footprint, for size-bounded caches."""
+        return sum(len(v) + 100 for s in (self.arxiv_ids, self.dois, self.titles) for v in s)
+
+    def has_arxiv_id(self, arxiv_id:str) -> bool:
+        return strip_version(arxiv_id) in self.arxiv_ids
+
+    def contains(self, paper) -> bool:
+        """Whether an `ArxivPaper` (or anything with `arxiv_id`, `title` and `doi`) is in the library."""
+        if self.has_arxiv_id(paper.arxiv_id):
+            return True
+        doi = getattr(paper, 'doi', None)
+        if doi and normalize_doi(doi) in self.dois:
+            return True
+        return normalize_title(paper.title) in self.titles
@@ -1,48 +1,195 @@
 from llama_cpp import Llama
 from openai import OpenAI
 from loguru import logger
-from time import sleep
+from time import sleep, perf_counter
+import threading
+from collections import Counter, deque
+from typing import Iterator
 
 GLOBAL_LLM = None
 
 class LLM:
-    def __init__(self, api_key: str = None, base_url: str = None, model: str = None,lang: str = "English"):
-        if api_key:
-            self.llm = OpenAI(api_key=api_key, base_url=base_url)
-        else:
-            self.llm = Llama.from_pretrained(
-                repo_id="Qwen/Qwen2.5-3B-Instruct-GGUF",
-                filename="qwen2.5-3b-instruct-q4_k_m.gguf",
-                n_ctx=5_000,
-                n_threads=4,
-                verbose=False,
-            )
+    def __init__(self, api_key: str = None, base_url: str = None, model: str = None,lang: str = "English", token_budget: int = 0, time_budget: float = 0):
+        # the client (or the local model, a download of several GB) is created on the first generation
+        self.api_key = api_key
+        self.base_url = base_url
+        self._client = None
+        self._client_lock = threading.Lock()
         self.model = model
         self.lang = lang
+        # budgets for the whole run, 0 = unlimited: prompt + completion tokens and seconds spent in generate
+        self.token_budget = token_budget
+        self.time_budget = time_budget
+        # running totals over the generate/stream calls since the last `reset_usage`; the web app's LLM lives for the whole process
+        self._lock = threading.Lock()
+        self.reset_usage()
+        # llama.cpp is not thread-safe: local generations run one at a time
+        self._local_lock = threading.Lock()
 
-    def generate(self, messages: list[dict]) -> str:
-        if isinstance(self.llm, OpenAI):
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    response = self.llm.chat.completions.create(messages=messages, temperature=0, model=self.model)
-                    break
-                except Exception as e:
-                    logger.error(f"Attempt {attempt + 1} failed: {e}")
-                    if attempt == max_retries - 1:
-                        raise
-                    sleep(3)
-            return response.choices[0].message.content
-        else:
-            response = self.llm.create_chat_completion(messages=messages,temperature=0)
-            return response["choices"][0]["message"]["content"]
-
-def set_global_llm(api_key: str = None, base_url: str = None, model: str = None, lang: str = "English"):
+    @property
+    def llm(self):
+        with self._client_lock:
+            if self._client is None:
+                if self.api_key:
+                    self._client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+                else:
+                    logger.info("Loading local LLM...")
+                    self._client = Llama.from_pretrained(
+                        repo_id="Qwen/Qwen2.5-3B-Instruct-GGUF",
+                        filename="qwen2.5-3b-instruct-q4_k_m.gguf",
+                        n_ctx=5_000,
+                        n_threads=4,
+                        verbose=False,
+                    )
+            return self._client
+
+    @property
+    def loaded(self) -> bool:
+        return self._client is not None
+
+    def generate(self, messages: list[dict], task: str = None) -> str:
+        start = perf_counter()
+        retries = 0
+        record = {'task': task, 'prompt_tokens': 0, 'completion_tokens': 0, 'retries': 0, 'success': False}
+        try:
+            if isinstance(self.llm, OpenAI):
+                max_retries = 3
+                for attempt in range(max_retries):
+                    try:
+                        response = self.llm.chat.completions.create(messages=messages, temperature=0, model=self.model)
+                        break
+                    except Exception as e:
+                        logger.error(f"Attempt {attempt + 1} failed: {e}")
+                        if attempt == max_retries - 1:
+                            raise
+                        retries += 1
+                        sleep(3)
+                if response.usage is not None:
+                    record['prompt_tokens'] = response.usage.prompt_tokens
+                    record['completion_tokens'] = response.usage.completion_tokens
+                content = response.choices[0].message.content
+            else:
+                with self._local_lock:
+                    response = self.llm.create_chat_completion(messages=messages,temperature=0)
+                usage = response.get("usage") or {}
+                record['prompt_tokens'] = usage.get("prompt_tokens", 0)
+                record['completion_tokens'] = usage.get("completion_tokens", 0)
+                content = response["choices"][0]["message"]["content"]
+            record['success'] = True
+            return content
+        finally:
+            record['retries'] = retries
+            record['seconds'] = perf_counter() - start
+            self._record(record)
+
+    def stream(self, messages: list[dict], task: str = None) -> Iterator[str]:
+        """Like `generate`, but yields the completion piece by piece as the model produces it."""
+        start = perf_counter()
+        retries = 0
+        record = {'task': task, 'prompt_tokens': 0, 'completion_tokens': 0, 'retries': 0, 'success': False}
+        try:
+            if isinstance(self.llm, OpenAI):
+                max_retries = 3
+                # only opening the stream is retried: once tokens went out they cannot be taken back
+                for attempt in range(max_retries):
+                    try:
+                        response = self.llm.chat.completions.create(messages=messages, temperature=0, model=self.model, stream=True, stream_options={"include_usage": True})
+                        break
+                    except Exception as e:
+                        logger.error(f"Attempt {attempt + 1} failed: {e}")
+                        if attempt == max_retries - 1:
+                            raise
+                        retries += 1
+                        sleep(3)
+                for chunk in response:
+                    if chunk.usage is not None:
+                        record['prompt_tokens'] = chunk.usage.prompt_tokens
+                        record['completion_tokens'] = chunk.usage.completion_tokens
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            else:
+                # held until the stream is exhausted or closed
+                with self._local_lock:
+                    for chunk in self.llm.create_chat_completion(messages=messages,temperature=0,stream=True):
+                        content = chunk["choices"][0]["delta"].get("content")
+                        if content:
+                            # llama.cpp reports no usage when streaming; every chunk is one token
+                            record['completion_tokens'] += 1
+                            yield content
+            record['success'] = True
+        finally:
+            record['retries'] = retries
+            record['seconds'] = perf_counter() - start
+            self._record(record)
+
+    def reset_usage(self):
+        with self._lock:
+            self._totals = {'calls': 0, 'failures': 0, 'retries': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            self._by_task = Counter()
+            # durations of the latest calls, for the median
+            self._recent_seconds = deque(maxlen=1000)
+
+    def _record(self, record:dict):
+        with self._lock:
+            t = self._totals
+            t['calls'] += 1
+            t['failures'] += not record['success']
+            t['retries'] += record['retries']
+            t['prompt_tokens'] += record['prompt_tokens']
+            t['completion_tokens'] += record['completion_tokens']
+            t['seconds'] += record['seconds']
+            t['max_seconds'] = max(t['max_seconds'], record['seconds'])
+            self._by_task[str(record['task'])] += 1
+            self._recent_seconds.append(record['seconds'])
+
+    def used(self) -> dict:
+        with self._lock:
+            return {
+                'tokens': self._totals['prompt_tokens'] + self._totals['completion_tokens'],
+                'seconds': self._totals['seconds'],
+            }
+
+    def budget_exhausted(self) -> bool:
+        used = self.used()
+        return bool(
+            (self.token_budget and used['tokens'] >= self.token_budget)
+            or (self.time_budget and used['seconds'] >= self.time_budget)
+        )
+
+    def usage_summary(self) -> dict:
+        with self._lock:
+            t = dict(self._totals)
+            recent = sorted(self._recent_seconds)
+            by_task = dict(sorted(self._by_task.items()))
+        return {
+            'calls': t['calls'],
+            'failures': t['failures'],
+            'retries': t['retries'],
+            'prompt_tokens': t['prompt_tokens'],
+            'completion_tokens': t['completion_tokens'],
+            'seconds': round(t['seconds'], 2),
+            # over the latest 1000 calls
+            'p50_seconds': round(recent[len(recent) // 2], 2) if recent else None,
+            'max_seconds': round(t['max_seconds'], 2) if t['calls'] else None,
+            'by_task': by_task,
+        }
+
+    def log_usage(self):
+        s = self.usage_summary()
+        if s['calls'] == 0:
+            return
+        logger.info(
+            f"LLM usage: {s['calls']} calls ({s['failures']} failed, {s['retries']} retries), "
+            f"{s['prompt_tokens']} prompt + {s['completion_tokens']} completion tokens, "
+            f"{s['seconds']:.1f}s total, median {s['p50_seconds']:.1f}s, max {s['max_seconds']:.1f}s"
+        )
+
+def set_global_llm(api_key: str = None, base_url: str = None, model: str = None, lang: str = "English", token_budget: int = 0, time_budget: float = 0):
     global GLOBAL_LLM
-    GLOBAL_LLM = LLM(api_key=api_key, base_url=base_url, model=model, lang=lang)
+    GLOBAL_LLM = LLM(api_key=api_key, base_url=base_url, model=model, lang=lang, token_budget=token_budget, time_budget=time_budget)
 
 def get_llm() -> LLM:
     if GLOBAL_LLM is None:
         logger.info("No global LLM found, creating a default one. Use `set_global_llm` to set a custom one.")
         set_global_llm()
-    return GLOBAL_LLM
\ No newline at end of file
+    return GLOBAL_LLM
@@ -20,21 +20,29 @@ from dotenv import load_dotenv
 load_dotenv(override=True)
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 from pyzotero import zotero
-from recommender import rerank_paper
-from construct_email import render_email, send_email
+from recommender import rerank_paper, get_encoder, encode_texts, EMBEDDING_MODEL
+from construct_email import render_email, send_email, EnrichmentPolicy, STAR_MIN_SCORE
 from tqdm import trange,tqdm
 from loguru import logger
 from gitignore_parser import parse_gitignore
 from tempfile import mkstemp
-from paper import ArxivPaper
-from llm import set_global_llm
-import feedparser
-
-def get_zotero_corpus(id:str,key:str) -> list[dict]:
+from llm import set_global_llm, get_llm
+from pipeline import Pipeline, RunContext, FeedSource, SeenFilter, LibraryFilter, FetchDetails, ArchiveStage, ScoreStage
+from seen_set import SeenSet
+from library_index import LibraryIndex
+from candidate_archive import CandidateArchive, archive_directory
+import replay
+import atexit
+from profiling import RunProfiler, profiled
+
+@profiled('get_zotero_corpus')
+def get_zotero_corpus(id:str,key:str) -> tuple[list[dict], LibraryIndex]:
     zot = zotero.Zotero(id, 'user', key)
     collections = zot.everything(zot.collections())
     collections = {c['key']:c for c in collections}
     corpus = zot.everything(zot.items(itemType='conferencePaper || journalArticle || preprint'))
+    # papers without an abstract are not used for scoring, but the user has them all the same
+    library = LibraryIndex.from_corpus(corpus)
     corpus = [c for c in corpus if c['data']['abstractNote'] != '']
     def get_collection_path(col_key:str) -> str:
         if p := collections[col_key]['data']['parentCollection']:
@@ -44,8 +52,9 @@ def get_zotero_corpus(id:str,key:str) -> list[dict]:
     for c in corpus:
         paths = [get_collection_path(col) for col in c['data']['collections']]
         c['paths'] = paths
-    return corpus
+    return corpus, library
 
+@profiled('filter_corpus')
 def filter_corpus(corpus:list[dict], pattern:str) -> list[dict]:
     _,filename = mkstemp()
     with open(filename,'w') as file:
@@ -60,35 +69,6 @@ def filter_corpus(corpus:list[dict], pattern:str) -> list[dict]:
     return new_corpus
 
 
-def get_arxiv_paper(query:str, debug:bool=False) -> list[ArxivPaper]:
-    client = arxiv.Client(num_retries=10,delay_seconds=10)
-    feed = feedparser.parse(f"https://rss.arxiv.org/atom/{query}")
-    if 'Feed error for query' in feed.feed.title:
-        raise Exception(f"Invalid ARXIV_QUERY: {query}.")
-    if not debug:
-        papers = []
-        all_paper_ids = [i.id.removeprefix("oai:arXiv.org:") for i in feed.entries if i.arxiv_announce_type == 'new']
-        bar = tqdm(total=len(all_paper_ids),desc="Retrieving Arxiv papers")
-        for i in range(0,len(all_paper_ids),20):
-            search = arxiv.Search(id_list=all_paper_ids[i:i+20])
-            batch = [ArxivPaper(p) for p in client.results(search)]
-            bar.update(len(batch))
-            papers.extend(batch)
-        bar.close()
-
-    else:
-        logger.debug("Retrieve 5 arxiv papers regardless of the date.")
-        search = arxiv.Search(query='cat:cs.AI', sort_by=arxiv.SortCriterion.SubmittedDate)
-        papers = []
-        for i in client.results(search):
-            papers.append(ArxivPaper(i))
-            if len(papers) == 5:
-                break
-
-    return papers
-
-
-
 parser = argparse.ArgumentParser(description='Recommender system for academic papers')
 
 def add_argument(*args, **kwargs):
@@ -120,6 +100,10 @@ if __name__ == '__main__':
     add_argument('--send_empty', type=bool, help='If get no arxiv paper, send empty email',default=False)
     add_argument('--max_paper_num', type=int, help='Maximum number of papers to recommend',default=100)
     add_argument('--arxiv_query', type=str, help='Arxiv search query')
+    add_argument('--encoder_backend', type=str, help='Embedding backend: torch, onnx or onnx-int8',default='torch')
+    add_argument('--embedding_store', type=str, help='Path prefix of the on-disk store reusing Zotero paper embeddings across runs',default=None)
+    add_argument('--interest_centroids', type=int, help='Score by the best-matching of this many interest clusters of the Zotero corpus instead of its mean interest (0 = mean interest)',default=0)
+    add_argument('--embedding_dtype', type=str, help='Storage precision of the embedding store: float16 or int8',default='float16')
     add_argument('--smtp_server', type=str, help='SMTP server')
     add_argument('--smtp_port', type=int, help='SMTP port')
     add_argument('--sender', type=str, help='Sender email address')
@@ -155,6 +139,22 @@ if __name__ == '__main__':
         help="Language of TLDR",
         default="English",
     )
+    add_argument('--replay_mode', type=str, help='Record or replay outgoing HTTP traffic: record, replay or auto',default=None)
+    add_argument('--replay_dir', type=str, help='Directory of the recorded HTTP responses',default='replay')
+    add_argument('--replay_latency', type=str, help='Latency injected on replay, e.g. export.arxiv.org=0.8,*=recorded',default=None)
+    add_argument('--profile', type=bool, help='Profile every stage with cProfile and write the profiles and a summary to --profile_dir',default=False)
+    add_argument('--profile_dir', type=str, help='Directory of the per-run profiles',default='cache/profiles')
+    add_argument('--llm_token_budget', type=int, help='Stop generating TLDRs once this many LLM tokens are used (0 = unlimited)',default=0)
+    add_argument('--llm_time_budget', type=float, help='Stop generating TLDRs once this many seconds are spent in the LLM (0 = unlimited)',default=0)
+    add_argument('--enrich_min_score', type=float, help='Only papers scoring above this get a TLDR, affiliations and code link; the others are listed with their abstract',default=STAR_MIN_SCORE)
+    add_argument('--enrich_top_k', type=int, help='Enrich at most this many top-ranked papers (-1 = no limit)',default=-1)
+    add_argument('--enrich_deadline', type=float, help='Stop enriching papers this many seconds after rendering starts (0 = no deadline)',default=0)
+    add_argument('--candidate_archive', type=str, help="Root directory of the local archives of each day's candidates and their embeddings (CANDIDATE_ARCHIVE_DIR of the web app, e.g. cache/archive)",default=None)
+    add_argument('--library_filter', type=bool, help='Skip candidates already in the Zotero library (same arXiv ID, DOI or title); turn off with LIBRARY_FILTER=false or --no_library_filter',default=True)
+    # type=bool reads any non-empty value as True, so turning the filter off on the command line needs its own flag
+    parser.add_argument('--no_library_filter', dest='library_filter', action='store_false', help='Keep candidates already in the Zotero library')
+    add_argument('--seen_file', type=str, help='File recording the papers already emailed; papers emailed on an earlier day are skipped',default=None)
+    add_argument('--show_updated', type=bool, help='With --seen_file, still recommend papers emailed before if the feed lists a newer version',default=False)
     parser.add_argument('--debug', action='store_true', help='Debug mode')
     args = parser.parse_args()
     assert (
@@ -167,34 +167,86 @@ if __name__ == '__main__':
     else:
         logger.remove()
         logger.add(sys.stdout, level="INFO")
+    if args.replay_mode:
+        replay.install(args.replay_mode, args.replay_dir, args.replay_latency)
+    if args.profile:
+        profiler = RunProfiler(args.profile_dir).start()
+        def write_profile():
+            path = profiler.write()
+            logger.info(f"Stage profile written to {path}:\n{profiler.table()}")
+        # also covers the early exit when there are no new papers
+        atexit.register(write_profile)
 
     logger.info("Retrieving Zotero corpus...")
-    corpus = get_zotero_corpus(args.zotero_id, args.zotero_key)
+    corpus, library = get_zotero_corpus(args.zotero_id, args.zotero_key)
     logger.info(f"Retrieved {len(corpus)} papers from Zotero.")
     if args.zotero_ignore:
         logger.info(f"Ignoring papers in:\n {args.zotero_ignore}...")
         corpus = filter_corpus(corpus, args.zotero_ignore)
         logger.info(f"Remaining {len(corpus)} papers after filtering.")
     logger.info("Retrieving Arxiv papers...")
-    papers = get_arxiv_paper(args.arxiv_query, args.debug)
+    def rank(ctx, papers):
+        return rerank_paper(papers, ctx.corpus, backend=args.encoder_backend, corpus_store=args.embedding_store, store_dtype=args.embedding_dtype, n_centroids=args.interest_centroids, top_k=args.max_paper_num)
+    stages = [FeedSource(debug=args.debug)]
+    seen_filter = SeenFilter(SeenSet(args.seen_file), args.show_updated) if args.seen_file else None
+    # by arXiv ID before fetching, by DOI and title after; the archive gets every candidate, so with it both go after archiving
+    if seen_filter is not None and not args.candidate_archive:
+        stages.append(seen_filter)
+    if args.library_filter and not args.candidate_archive:
+        stages.append(LibraryFilter(library))
+    stages.append(FetchDetails(batch_size=20))
+    if args.candidate_archive:
+        model_id = f'{EMBEDDING_MODEL}:{args.encoder_backend}'
+        # same layout as the web app and oai_harvester.py: one archive per model under the root
+        archive = CandidateArchive(archive_directory(args.candidate_archive, model_id), model_id)
+        # embeddings go through the embedding cache, so scoring does not encode the papers again
+        stages.append(ArchiveStage(archive, lambda texts: encode_texts(get_encoder(EMBEDDING_MODEL, args.encoder_backend), texts, model_id)))
+        if seen_filter is not None:
+            stages.append(seen_filter)
+    if args.library_filter:
+        stages.append(LibraryFilter(library))
+    stages.append(ScoreStage(rank, top_k=args.max_paper_num))
+    pipeline = Pipeline(
+        stages,
+        on_timing=lambda stage, seconds: logger.debug(f"Stage {stage} took {seconds:.2f}s"),
+    )
+    ctx = RunContext(query=args.arxiv_query, corpus=corpus)
+    bar = None
+    for event in pipeline.run(ctx):
+        if event.kind == 'seen' and event.skipped:
+            logger.info(f"Skipping {event.skipped} of {event.count} papers emailed on an earlier day.")
+        elif event.kind == 'library':
+            logger.info(f"Skipping {event.skipped} papers already in the Zotero library.")
+        elif event.kind == 'fetch_start':
+            bar = tqdm(total=event.count, desc="Retrieving Arxiv papers")
+        elif event.kind == 'batch':
+            bar.update(event.size)
+        elif event.kind == 'fetched':
+            if bar is not None:
+                bar.close()
+        elif event.kind == 'score_start':
+            logger.info("Reranking papers...")
+    papers = ctx.result
     if len(papers) == 0:
         logger.info("No new papers found. Yesterday maybe a holiday and no one submit their work :). If this is not the case, please check the ARXIV_QUERY.")
         if not args.send_empty:
           exit(0)
     else:
-        logger.info("Reranking papers...")
-        papers = rerank_paper(papers, corpus)
-        if args.max_paper_num != -1:
-            papers = papers[:args.max_paper_num]
         if args.use_llm_api:
             logger.info("Using OpenAI API as global LLM.")
-            set_global_llm(api_key=args.openai_api_key, base_url=args.openai_api_base, model=args.model_name, lang=args.language)
+            set_global_llm(api_key=args.openai_api_key, base_url=args.openai_api_base, model=args.model_name, lang=args.language, token_budget=args.llm_token_budget, time_budget=args.llm_time_budget)
         else:
             logger.info("Using Local LLM as global LLM.")
-            set_global_llm(lang=args.language)
+            set_global_llm(lang=args.language, token_budget=args.llm_token_budget, time_budget=args.llm_time_budget)
+        # the budgets and the usage log cover this run only
+        get_llm().reset_usage()
 
-    html = render_email(papers)
+    html = render_email(papers, EnrichmentPolicy(args.enrich_min_score, args.enrich_top_k, args.enrich_deadline))
+    if papers and get_llm().loaded:
+        get_llm().log_usage()
     logger.info("Sending email...")
     send_email(args.sender, args.receiver, args.sender_password, args.smtp_server, args.smtp_port, html)
+    if seen_filter is not None and papers:
+        seen_filter.mark(ctx, [p.arxiv_id for p in papers])
     logger.success("Email sent successfully! If you don't receive the email, please check the configuration and the junk box.")
 
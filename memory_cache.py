@@ -0,0 +1,53 @@
+"""Size-bounded in-process LRU for parsed objects that are expensive to rebuild.
+
+Every entry carries a stamp describing the source it was built from (a file's
+mtime and size, a library version, ...). A lookup with a different stamp evicts
+the entry, so stale data is never served after the source changes.
+"""
+import threading
+from collections import OrderedDict
+
+class MemoryLRU:
+    def __init__(self, max_bytes:int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, stamp=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, size:int, stamp=None):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (stamp, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,137 @@
+"""Minimal Prometheus metrics for the web service, rendered in the text exposition format.
+
+Histograms and counters are updated in place by the code they measure. Values
+that other components already track (cache statistics, in-flight jobs, loaded
+models) are read at scrape time via callback metrics, so nothing is duplicated.
+"""
+import math
+import threading
+from typing import Callable
+
+# seconds; covers a cached lookup up to a cold full pipeline
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names:tuple, values:tuple, extra:dict|None=None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+def _number(value:float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name:str, help:str, labelnames:tuple=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels:dict) -> tuple:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name:str, help:str, labelnames:tuple=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount:float=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        return self.header() + [f'{self.name}{_labels(self.labelnames, k)} {_number(v)}' for k, v in sorted(self.samples().items())]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount:float=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name:str, help:str, labelnames:tuple=(), buckets:tuple=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}
+
+    def observe(self, value:float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[key] = (counts, total + value)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = {k: (list(c), s) for k, (c, s) in self._series.items()}
+        lines = self.header()
+        for key, (counts, total) in sorted(series.items()):
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, {"le": _number(bound)})} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {counts[-1]}')
+        return lines
+
+class CallbackMetric(_Metric):
+    """Counter or gauge whose samples come from `collect() -> {label values tuple: value}` at scrape time."""
+    def __init__(self, name:str, help:str, kind:str, collect:Callable[[], dict], labelnames:tuple=()):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        samples = self.collect()
+        return self.header() + [f'{self.name}{_labels(self.labelnames, k)} {_number(v)}' for k, v in sorted(samples.items())]
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name:str, help:str, labelnames:tuple=()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name:str, help:str, labelnames:tuple=()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name:str, help:str, labelnames:tuple=(), buckets:tuple=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name:str, help:str, kind:str, collect:Callable[[], dict], labelnames:tuple=()) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, kind, collect, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # one broken collector must not take the whole scrape down
+                lines.append(f'# {metric.name} unavailable: {_escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
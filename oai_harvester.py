@@ -0,0 +1,231 @@
+"""Bulk backfill of the candidate archive from arXiv's OAI-PMH interface.
+
+``OAIHarvester.pages`` walks ``ListRecords`` in the ``arXiv`` metadata format for
+one set (``cs``, ``math``, ``physics:cond-mat``, ...) and date window, following
+resumption tokens page by page. Each response is parsed with ``iterparse`` while
+it downloads, and every record element is cleared once read, so memory stays flat
+however large a page is.
+
+``harvest`` encodes each page's abstracts and appends the papers to a
+`CandidateArchive`, then saves a checkpoint with the resumption token of the next
+page. An interrupted harvest with the same parameters continues from there; a
+finished one removes its checkpoint.
+
+OAI-PMH selects records by datestamp, the date a record last changed, whereas the
+archive files papers under the day they were first seen. The harvest therefore
+asks for everything changed since ``start`` and keeps the papers first submitted
+(``created``) between ``start`` and ``end``, filed under that submission date.
+
+    uv run python oai_harvester.py --set cs --categories cs.AI+cs.CV --start 2025-01-01 --end 2025-01-31
+"""
+import argparse
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Callable, Iterator
+from urllib.parse import urlencode
+from loguru import logger
+from candidate_archive import CandidateArchive, archive_directory, matches_categories, parse_categories
+
+DEFAULT_BASE_URL = 'https://oaipmh.arxiv.org/oai'
+OAI = '{http://www.openarchives.org/OAI/2.0/}'
+ARXIV = '{http://arxiv.org/OAI/arXiv/}'
+
+class OAIError(Exception):
+    def __init__(self, code:str, message:str):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+
+def _text(element, path:str) -> str:
+    found = element.find(path)
+    # titles and abstracts are hard-wrapped in the metadata
+    return ' '.join(found.text.split()) if found is not None and found.text else ''
+
+def parse_record(element) -> dict|None:
+    """Archive record of one OAI ``record`` element, None for deleted records."""
+    header = element.find(f'{OAI}header')
+    if header is not None and header.get('status') == 'deleted':
+        return None
+    meta = element.find(f'{OAI}metadata/{ARXIV}arXiv')
+    if meta is None:
+        return None
+    arxiv_id = _text(meta, f'{ARXIV}id')
+    authors = []
+    for author in meta.iterfind(f'{ARXIV}authors/{ARXIV}author'):
+        name = ' '.join(p for p in (_text(author, f'{ARXIV}forenames'), _text(author, f'{ARXIV}keyname'), _text(author, f'{ARXIV}suffix')) if p)
+        if name:
+            authors.append(name)
+    return {
+        'arxiv_id': arxiv_id,
+        'title': _text(meta, f'{ARXIV}title'),
+        'summary': _text(meta, f'{ARXIV}abstract'),
+        'authors': authors,
+        'pdf_url': f'https://arxiv.org/pdf/{arxiv_id}',
+        'categories': _text(meta, f'{ARXIV}categories').split(),
+        'created': _text(meta, f'{ARXIV}created'),
+    }
+
+def parse_page(stream) -> tuple[list[dict], str|None, dict]:
+    """Records, next resumption token (None on the last page) and list size info of one response."""
+    records = []
+    token, info = None, {}
+    for _, element in ET.iterparse(stream, events=('end',)):
+        if element.tag == f'{OAI}record':
+            record = parse_record(element)
+            if record is not None:
+                records.append(record)
+            element.clear()
+        elif element.tag == f'{OAI}resumptionToken':
+            token = (element.text or '').strip() or None
+            info = {k: element.get(k) for k in ('completeListSize', 'cursor') if element.get(k) is not None}
+        elif element.tag == f'{OAI}error':
+            code = element.get('code', '')
+            if code == 'noRecordsMatch':
+                return [], None, {}
+            raise OAIError(code, (element.text or '').strip())
+    return records, token, info
+
+class OAIHarvester:
+    def __init__(self, base_url:str=DEFAULT_BASE_URL, metadata_prefix:str='arXiv', delay:float=3, max_retries:int=5, timeout:float=120):
+        self.base_url = base_url
+        self.metadata_prefix = metadata_prefix
+        # pause between requests, as arXiv asks of harvesters
+        self.delay = delay
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    def _request(self, params:dict) -> tuple[list[dict], str|None, dict]:
+        url = f'{self.base_url}?{urlencode(params)}'
+        for attempt in range(self.max_retries):
+            try:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                    return parse_page(response)
+            except urllib.error.HTTPError as e:
+                # 503 with Retry-After is how OAI-PMH servers throttle
+                if e.code != 503 or attempt == self.max_retries - 1:
+                    raise
+                wait = float(e.headers.get('Retry-After') or self.delay or 1)
+            except (urllib.error.URLError, TimeoutError, ET.ParseError) as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                wait = self.delay * 2 ** attempt or 1
+                logger.warning(f"OAI-PMH request failed ({e}), retrying in {wait:.0f}s")
+            time.sleep(wait)
+
+    def pages(self, set_spec:str|None=None, start:str|None=None, end:str|None=None, token:str|None=None) -> Iterator[tuple[list[dict], str|None, dict]]:
+        """Pages of `ListRecords` as (records, next token, list size info), from `token` if given."""
+        if token is None:
+            params = {'verb': 'ListRecords', 'metadataPrefix': self.metadata_prefix}
+            if set_spec:
+                params['set'] = set_spec
+            if start:
+                params['from'] = start
+            if end:
+                params['until'] = end
+        else:
+            params = {'verb': 'ListRecords', 'resumptionToken': token}
+        while True:
+            records, token, info = self._request(params)
+            yield records, token, info
+            if token is None:
+                return
+            params = {'verb': 'ListRecords', 'resumptionToken': token}
+            if self.delay:
+                time.sleep(self.delay)
+
+def _load_checkpoint(path:Path, params:dict) -> dict|None:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    if checkpoint.get('params') != params:
+        logger.warning(f"Ignoring checkpoint {path} of a harvest with other parameters: {checkpoint.get('params')}")
+        return None
+    return checkpoint
+
+def _save_checkpoint(path:Path, checkpoint:dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.tmp{os.getpid()}')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp, path)
+
+def harvest(archive:CandidateArchive, encode:Callable[[list[str]], object], harvester:OAIHarvester, set_spec:str|None,
+            start:str, end:str, categories:set[str]|None=None, checkpoint:str|Path|None=None) -> dict:
+    """Append the papers of `set_spec` first submitted from `start` to `end` (YYYY-MM-DD) to `archive`.
+
+    `categories` further restricts the papers, e.g. ``{'cs.AI', 'cs.CV'}`` within the
+    ``cs`` set. Returns the harvest counts.
+    """
+    checkpoint = Path(checkpoint) if checkpoint else archive.directory / 'oai_checkpoint.json'
+    params = {'base_url': harvester.base_url, 'set': set_spec, 'start': start, 'end': end, 'categories': sorted(categories) if categories else None}
+    state = _load_checkpoint(checkpoint, params) or {'params': params, 'token': None, 'pages': 0, 'records': 0, 'archived': 0}
+    if state['token']:
+        logger.info(f"Resuming harvest after page {state['pages']} ({state['records']} records)")
+    # not `until=end`: papers submitted in the window but revised later carry a later datestamp
+    pages = harvester.pages(set_spec, start, token=state['token'])
+    while True:
+        try:
+            records, token, info = next(pages)
+        except StopIteration:
+            break
+        except OAIError as e:
+            if e.code != 'badResumptionToken' or not state['token']:
+                raise
+            # tokens expire; the archive skips papers it already holds, so starting over is safe
+            logger.warning("Resumption token expired, restarting the harvest from the first page")
+            state.update(token=None, pages=0, records=0)
+            pages = harvester.pages(set_spec, start)
+            continue
+        kept = [r for r in records if start <= r['created'] <= end and (not categories or matches_categories(r['categories'], categories))]
+        kept = [r for r in kept if r['arxiv_id'] not in archive]
+        by_day = {}
+        for r in kept:
+            by_day.setdefault(r.pop('created'), []).append(r)
+        if kept:
+            ordered = [r for day in sorted(by_day) for r in by_day[day]]
+            vectors = encode([r['summary'] for r in ordered])
+            offset = 0
+            for day in sorted(by_day):
+                n = len(by_day[day])
+                state['archived'] += archive.append(day, by_day[day], vectors[offset:offset + n])
+                offset += n
+        state['pages'] += 1
+        state['records'] += len(records)
+        state['token'] = token
+        _save_checkpoint(checkpoint, state)
+        total = f"/{info['completeListSize']}" if 'completeListSize' in info else ''
+        logger.info(f"Page {state['pages']}: {state['records']}{total} records, {state['archived']} archived")
+    checkpoint.unlink(missing_ok=True)
+    return {k: state[k] for k in ('pages', 'records', 'archived')}
+
+if __name__ == '__main__':
+    from recommender import EMBEDDING_MODEL, get_encoder, encode_texts
+
+    parser = argparse.ArgumentParser(description='Backfill the candidate archive from arXiv OAI-PMH')
+    parser.add_argument('--set', type=str, default='cs', help='OAI set, e.g. cs, math or physics:cond-mat')
+    parser.add_argument('--categories', type=str, default=None, help='Only keep papers in these categories, e.g. cs.AI+cs.CV')
+    parser.add_argument('--start', type=str, required=True, help='First submission day, YYYY-MM-DD')
+    parser.add_argument('--end', type=str, default=time.strftime('%Y-%m-%d'), help='Last submission day, YYYY-MM-DD')
+    parser.add_argument('--base_url', type=str, default=DEFAULT_BASE_URL, help='OAI-PMH endpoint')
+    parser.add_argument('--delay', type=float, default=3, help='Seconds between requests')
+    parser.add_argument('--archive_dir', type=str, default='cache/archive', help='Root of the candidate archives (CANDIDATE_ARCHIVE_DIR of the web app)')
+    parser.add_argument('--encoder_backend', type=str, default='torch', help='Embedding backend: torch, onnx or onnx-int8')
+    parser.add_argument('--checkpoint', type=str, default=None, help='Checkpoint file (default: oai_checkpoint.json in the archive)')
+    args = parser.parse_args()
+
+    model_id = f'{EMBEDDING_MODEL}:{args.encoder_backend}'
+    archive = CandidateArchive(archive_directory(args.archive_dir, model_id), model_id)
+    encoder = get_encoder(EMBEDDING_MODEL, args.encoder_backend)
+    # backfilled abstracts are seen once, so they bypass the in-memory embedding cache
+    counts = harvest(
+        archive, lambda texts: encode_texts(encoder, texts, model_id, cache=None),
+        OAIHarvester(args.base_url, delay=args.delay), args.set, args.start, args.end,
+        parse_categories(args.categories), args.checkpoint,
+    )
+    logger.info(f"Harvested {counts['records']} records in {counts['pages']} pages, archived {counts['archived']} papers ({len(archive)} in the archive)")
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Iterator, Optional
 from functools import cached_property
 from tempfile import TemporaryDirectory
 import arxiv
@@ -7,6 +7,7 @@ import re
 import time
 import json
 from llm import get_llm
+from profiling import profiled
 import requests
 from requests.adapters import HTTPAdapter, Retry
 from loguru import logger
@@ -33,6 +34,18 @@ class ArxivPaper:
     def authors(self) -> list[str]:
         return self._paper.authors
     
+    @property
+    def doi(self) -> str|None:
+        return self._paper.doi
+
+    @property
+    def categories(self) -> list[str]:
+        return self._paper.categories
+
+    @property
+    def versioned_id(self) -> str:
+        return self._paper.get_short_id()
+
     @cached_property
     def arxiv_id(self) -> str:
         return re.sub(r'v\d+$', '', self._paper.get_short_id())
@@ -136,6 +149,7 @@ class ArxivPaper:
             return None
     
     @cached_property
+    @profiled('tex')
     def tex(self) -> dict[str,str]:
         with ExitStack() as stack:
             tmpdirname = stack.enter_context(TemporaryDirectory())
@@ -221,8 +235,7 @@ class ArxivPaper:
                 file_contents["all"] = None
         return file_contents
     
-    @cached_property
-    def tldr(self) -> str:
+    def tldr_messages(self, lang:str) -> list[dict]:
         introduction = ""
         conclusion = ""
         if self.tex is not None:
@@ -243,7 +256,6 @@ class ArxivPaper:
             match = re.search(r'\\section\{Conclusion\}.*?(\\section|\\end\{document\}|\\bibliography|\\appendix|$)', content, flags=re.DOTALL)
             if match:
                 conclusion = match.group(0)
-        llm = get_llm()
         prompt = """Given the title, abstract, introduction and the conclusion (if any) of a paper in latex format, generate a one-sentence TLDR summary in __LANG__:
         
         \\title{__TITLE__}
@@ -251,7 +263,7 @@ class ArxivPaper:
         __INTRODUCTION__
         __CONCLUSION__
         """
-        prompt = prompt.replace('__LANG__', llm.lang)
+        prompt = prompt.replace('__LANG__', lang)
         prompt = prompt.replace('__TITLE__', self.title)
         prompt = prompt.replace('__ABSTRACT__', self.summary)
         prompt = prompt.replace('__INTRODUCTION__', introduction)
@@ -263,18 +275,34 @@ class ArxivPaper:
         prompt_tokens = prompt_tokens[:4000]  # truncate to 4000 tokens
         prompt = enc.decode(prompt_tokens)
         
-        tldr = llm.generate(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an assistant who perfectly summarizes scientific paper, and gives the core idea of the paper to the user.",
-                },
-                {"role": "user", "content": prompt},
-            ]
-        )
-        return tldr
+        return [
+            {
+                "role": "system",
+                "content": "You are an assistant who perfectly summarizes scientific paper, and gives the core idea of the paper to the user.",
+            },
+            {"role": "user", "content": prompt},
+        ]
+
+    @cached_property
+    @profiled('tldr')
+    def tldr(self) -> str:
+        llm = get_llm()
+        return llm.generate(messages=self.tldr_messages(llm.lang), task="tldr")
+
+    def stream_tldr(self) -> Iterator[str]:
+        """The TLDR piece by piece as the LLM produces it; the complete text is kept as `tldr`."""
+        if 'tldr' in self.__dict__:
+            yield self.tldr
+            return
+        llm = get_llm()
+        pieces = []
+        for piece in llm.stream(self.tldr_messages(llm.lang), task="tldr"):
+            pieces.append(piece)
+            yield piece
+        self.__dict__['tldr'] = ''.join(pieces)
 
     @cached_property
+    @profiled('affiliations')
     def affiliations(self) -> Optional[list[str]]:
         if self.tex is not None:
             content = self.tex.get("all")
@@ -303,7 +331,8 @@ class ArxivPaper:
                         "content": "You are an assistant who perfectly extracts affiliations of authors from the author information of a paper. You should return a python list of affiliations sorted by the author order, like ['TsingHua University','Peking University']. If an affiliation is consisted of multi-level affiliations, like 'Department of Computer Science, TsingHua University', you should return the top-level affiliation 'TsingHua University' only. Do not contain duplicated affiliations. If there is no affiliation found, you should return an empty list [ ]. You should only return the final list of affiliations, and do not return any intermediate results.",
                     },
                     {"role": "user", "content": prompt},
-                ]
+                ],
+                task="affiliations",
             )
 
             try:
@@ -0,0 +1,370 @@
+"""Recommendation pipeline shared by main.py and the web app.
+
+A run pushes batches through a chain of stages:
+
+    source (arXiv IDs from the RSS feed) -> [seen] -> [library] -> fetch (paper details,
+    batch by batch) -> [library] -> score (embed and rank against the Zotero corpus)
+    -> enrich -> format
+
+with the candidate archive: source -> fetch -> archive -> [seen] -> [library] -> score ...
+
+or, for past days, ``ArchiveSource`` ranking the local candidate archive -> format.
+
+Each stage is a ``Stage`` whose ``process`` turns one input batch into output
+batches and whose ``finish`` flushes what it held back. Both are generators that
+may also yield ``Event``s, so progress and partial rankings flow to the caller as
+soon as a batch lands. The engine times every stage call (``ctx.timings`` and the
+``on_timing`` hook, plus cProfile under the stage name when a ``profiling``
+run profiler is active) and consults two kinds of cache hook: a stage's ``cache``
+replays the outputs of a batch it has seen before, and the pipeline's
+``result_cache`` short-circuits the whole run.
+
+Stages keep their per-run state in the ``RunContext``, so one pipeline can serve
+concurrent runs.
+"""
+import time
+import arxiv
+import feedparser
+from typing import Any, Callable, Iterable, Iterator
+from loguru import logger
+from paper import ArxivPaper
+from candidate_archive import archive_record, parse_categories
+from seen_set import split_version
+from profiling import stage as profile_stage
+
+class Event:
+    """Something a caller may want to report: kind plus free-form fields."""
+    def __init__(self, kind:str, **data):
+        self.kind = kind
+        self.data = data
+
+    def __getattr__(self, name):
+        try:
+            return self.data[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __repr__(self):
+        return f'Event({self.kind!r}, {self.data!r})'
+
+class RunContext:
+    """Inputs of one run (query, corpus, ...), per-stage state, timings and the result."""
+    def __init__(self, **params):
+        self.__dict__.update(params)
+        self.timings = {}
+        self.result = None
+        self._state = {}
+
+    def state(self, stage:str) -> dict:
+        return self._state.setdefault(stage, {})
+
+class Stage:
+    name = 'stage'
+    # optional hook with load(ctx, batch) -> outputs or None and save(ctx, batch, outputs)
+    cache = None
+
+    def process(self, ctx:RunContext, batch) -> Iterator:
+        yield batch
+
+    def finish(self, ctx:RunContext) -> Iterator:
+        yield from ()
+
+class Pipeline:
+    def __init__(self, stages:list[Stage], result_cache=None, on_timing:Callable[[str, float], None]|None=None):
+        self.stages = stages
+        # optional hook with load(ctx) -> result or None and save(ctx, result)
+        self.result_cache = result_cache
+        self.on_timing = on_timing
+
+    def run(self, ctx:RunContext) -> Iterator[Event]:
+        """Yield the events of all stages, ending with a `done` event carrying the result."""
+        if self.result_cache is not None:
+            cached = self.result_cache.load(ctx)
+            if cached is not None:
+                ctx.result = cached
+                yield Event('done', result=cached, cached=True)
+                return
+        stream = iter([None])
+        for stage in self.stages:
+            stream = self._run_stage(stage, ctx, stream)
+        result = []
+        for item in stream:
+            if isinstance(item, Event):
+                yield item
+            else:
+                result.extend(item)
+        ctx.result = result
+        if self.result_cache is not None:
+            self.result_cache.save(ctx, result)
+        yield Event('done', result=result, cached=False)
+
+    def _run_stage(self, stage:Stage, ctx:RunContext, upstream:Iterable) -> Iterator:
+        for item in upstream:
+            if isinstance(item, Event):
+                yield item
+                continue
+            if stage.cache is None:
+                yield from self._timed(stage, ctx, stage.process(ctx, item))
+                continue
+            outputs = stage.cache.load(ctx, item)
+            if outputs is None:
+                outputs = list(self._timed(stage, ctx, stage.process(ctx, item)))
+                stage.cache.save(ctx, item, outputs)
+            yield from outputs
+        yield from self._timed(stage, ctx, stage.finish(ctx))
+
+    def _timed(self, stage:Stage, ctx:RunContext, outputs:Iterator) -> Iterator:
+        # only the stage's own work is timed, not the downstream stages consuming its outputs
+        elapsed = 0.0
+        while True:
+            start = time.perf_counter()
+            try:
+                with profile_stage(stage.name):
+                    item = next(outputs)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+        ctx.timings[stage.name] = ctx.timings.get(stage.name, 0.0) + elapsed
+        if self.on_timing is not None:
+            self.on_timing(stage.name, elapsed)
+
+def _strip_id(entry_id:str) -> str:
+    return entry_id.removeprefix('oai:arXiv.org:')
+
+class FeedSource(Stage):
+    """arXiv IDs announced in the RSS feed of `ctx.query`.
+
+    With `fallback_recent`, a feed without new announcements (weekends, holidays)
+    yields every paper in it instead. `debug` takes 5 recent cs.AI papers regardless
+    of the feed.
+    """
+    name = 'source'
+
+    def __init__(self, fallback_recent:bool=False, debug:bool=False, cache=None):
+        self.fallback_recent = fallback_recent
+        self.debug = debug
+        self.cache = cache
+
+    def process(self, ctx:RunContext, _) -> Iterator:
+        if self.debug:
+            logger.debug("Retrieve 5 arxiv papers regardless of the date.")
+            search = arxiv.Search(query='cat:cs.AI', sort_by=arxiv.SortCriterion.SubmittedDate, max_results=5)
+            ids = [r.get_short_id() for r in arxiv.Client().results(search)]
+            yield Event('feed', count=len(ids), new_count=len(ids), total_entries=len(ids), fallback=False)
+            yield ids
+            return
+        feed = feedparser.parse(f"https://rss.arxiv.org/atom/{ctx.query}")
+        if feed.feed.get('title') and 'Feed error for query' in feed.feed.title:
+            raise Exception(f"Invalid ARXIV_QUERY: {ctx.query}.")
+        ids = [_strip_id(e.id) for e in feed.entries if getattr(e, 'arxiv_announce_type', None) == 'new']
+        new_count = len(ids)
+        fallback = new_count == 0 and self.fallback_recent
+        if fallback:
+            # versioned, so `SeenFilter` can tell replacements from papers already delivered
+            ids = [_strip_id(e.id) for e in feed.entries]
+        # announcement day of the feed, under which the candidate archive files these papers
+        updated = feed.feed.get('updated_parsed')
+        ctx.state(self.name)['day'] = time.strftime('%Y-%m-%d', updated or time.gmtime())
+        yield Event('feed', count=len(ids), new_count=new_count, total_entries=len(feed.entries), fallback=fallback)
+        yield ids
+
+class SeenFilter(Stage):
+    """Drops the candidates a `SeenSet` has recorded as delivered on an earlier day.
+
+    Like `LibraryFilter` it takes the feed's arXiv IDs (before `FetchDetails`) or
+    fetched papers (after it). `mark` records the papers of a finished run, with
+    the versions seen in this run.
+    """
+    name = 'seen'
+
+    def __init__(self, seen, show_updated:bool=False):
+        self.seen = seen
+        self.show_updated = show_updated
+
+    def process(self, ctx:RunContext, batch:list) -> Iterator:
+        ids = [item if isinstance(item, str) else item.versioned_id for item in batch]
+        versions = ctx.state(self.name).setdefault('versions', {})
+        versions.update((split_version(i)[0], i) for i in ids)
+        unseen = set(self.seen.unseen(ids, self._day(ctx), self.show_updated))
+        kept = [item for item, i in zip(batch, ids) if i in unseen]
+        yield Event('seen', count=len(batch), skipped=len(batch) - len(kept))
+        yield kept
+
+    def mark(self, ctx:RunContext, arxiv_ids:list[str]) -> int:
+        versions = ctx.state(self.name).get('versions', {})
+        return self.seen.add([versions.get(i, i) for i in arxiv_ids], self._day(ctx))
+
+    def _day(self, ctx:RunContext) -> str:
+        # the feed's day is in UTC, and so is the fallback for runs that never read the feed
+        return ctx.state('source').get('day') or time.strftime('%Y-%m-%d', time.gmtime())
+
+class LibraryFilter(Stage):
+    """Drops candidates already in the user's Zotero library (a `LibraryIndex`).
+
+    Placed before `FetchDetails` it checks the feed's arXiv IDs; placed after, it
+    checks fetched papers by arXiv ID, DOI and title. When the candidate archive
+    is shared between users, the per-user filters go after `ArchiveStage`, so
+    every candidate of the feed is archived.
+    """
+    name = 'library'
+
+    def __init__(self, index):
+        self.index = index
+
+    def process(self, ctx:RunContext, batch:list) -> Iterator:
+        kept = [item for item in batch if not (self.index.has_arxiv_id(item) if isinstance(item, str) else self.index.contains(item))]
+        if len(kept) < len(batch):
+            state = ctx.state(self.name)
+            state['skipped'] = state.get('skipped', 0) + len(batch) - len(kept)
+            yield Event('library', skipped=len(batch) - len(kept), total_skipped=state['skipped'])
+        yield kept
+
+class FetchDetails(Stage):
+    """Paper details from the arXiv API, `batch_size` IDs per request; a failed batch is skipped.
+
+    Versions are dropped from the IDs, so the latest version is fetched.
+    """
+    name = 'fetch'
+
+    def __init__(self, batch_size:int=50, num_retries:int=10, delay_seconds:float=10):
+        self.batch_size = batch_size
+        self.num_retries = num_retries
+        self.delay_seconds = delay_seconds
+
+    def process(self, ctx:RunContext, ids:list[str]) -> Iterator:
+        client = arxiv.Client(num_retries=self.num_retries, delay_seconds=self.delay_seconds)
+        ids = [split_version(i)[0] for i in ids]
+        state = ctx.state(self.name)
+        batches = (len(ids) + self.batch_size - 1) // self.batch_size
+        yield Event('fetch_start', count=len(ids), batches=batches, batch_size=self.batch_size)
+        for n, i in enumerate(range(0, len(ids), self.batch_size), 1):
+            yield Event('batch_start', batch=n, batches=batches)
+            try:
+                batch = [ArxivPaper(p) for p in client.results(arxiv.Search(id_list=ids[i:i + self.batch_size]))]
+            except Exception as e:
+                logger.warning(f"Failed to fetch batch {n}/{batches}: {e}")
+                yield Event('batch_failed', batch=n, batches=batches, error=str(e))
+                continue
+            state['fetched'] = state.get('fetched', 0) + len(batch)
+            yield Event('batch', batch=n, batches=batches, size=len(batch), fetched=state['fetched'], count=len(ids))
+            yield batch
+
+    def finish(self, ctx:RunContext) -> Iterator:
+        yield Event('fetched', count=ctx.state(self.name).get('fetched', 0))
+
+class ArchiveStage(Stage):
+    """Appends fetched papers not archived yet to a `CandidateArchive`, embedded with `encode(texts)`.
+
+    With an encoder that caches embeddings (`recommender.encode_texts`), the score
+    stage reuses them instead of encoding the papers a second time.
+    """
+    name = 'archive'
+
+    def __init__(self, archive, encode:Callable[[list[str]], Any]):
+        self.archive = archive
+        self.encode = encode
+
+    def process(self, ctx:RunContext, batch:list[ArxivPaper]) -> Iterator:
+        new = [paper for paper in batch if paper.arxiv_id not in self.archive]
+        if new:
+            day = ctx.state('source').get('day') or time.strftime('%Y-%m-%d')
+            try:
+                self.archive.append(day, [archive_record(paper) for paper in new], self.encode([paper.summary for paper in new]))
+            except Exception as e:
+                logger.warning(f"Failed to archive {len(new)} candidates: {e}")
+        yield batch
+
+class ArchiveSource(Stage):
+    """Ranks the candidates archived on the days of `ctx.date_range` ("YYYY-MM-DD,YYYY-MM-DD") instead of fetching today's feed.
+
+    `profile(ctx)` gives the interest profile vector that scores the archived rows in
+    one pass; the best `top_k` come out as `ArchivedPaper`s for the format stage.
+    """
+    name = 'archive'
+
+    def __init__(self, archive, profile:Callable[[RunContext], Any], top_k:int|None=None):
+        self.archive = archive
+        self.profile = profile
+        self.top_k = top_k
+
+    def process(self, ctx:RunContext, _) -> Iterator:
+        start, end = ctx.date_range.split(',')
+        rows = self.archive.select(start, end, parse_categories(ctx.query))
+        yield Event('archive', count=len(rows), start=start, end=end)
+        if len(rows) == 0:
+            yield Event('scored', count=0, max_score=0)
+            yield []
+            return
+        yield Event('score_start', candidates=len(rows), corpus=len(ctx.corpus))
+        ranked = self.archive.top_k(rows, self.profile(ctx), self.top_k)
+        yield Event('scored', count=len(ranked), max_score=ranked[0].score if ranked else 0)
+        yield ranked
+
+def merge_ranked(ranked:list[ArxivPaper], batch_ranked:list[ArxivPaper], top_k:int|None) -> list[ArxivPaper]:
+    """Merge two rankings, highest score first; on ties the earlier paper stays ahead."""
+    merged = sorted(ranked + batch_ranked, key=lambda paper: -paper.score)
+    return merged if top_k is None or top_k < 0 else merged[:top_k]
+
+class ScoreStage(Stage):
+    """Embeds and ranks candidates with `rank(ctx, papers) -> ranked papers`.
+
+    By default all batches are ranked together once fetching is done. With
+    `progressive`, every batch is ranked on arrival and merged into the running
+    top-k, which is published as a `partial` event; the merged ranking is final.
+    """
+    name = 'score'
+
+    def __init__(self, rank:Callable[[RunContext, list[ArxivPaper]], list[ArxivPaper]], top_k:int|None=None, progressive:bool=False):
+        self.rank = rank
+        self.top_k = top_k
+        self.progressive = progressive
+
+    def process(self, ctx:RunContext, batch:list[ArxivPaper]) -> Iterator:
+        state = ctx.state(self.name)
+        if not self.progressive:
+            state.setdefault('pending', []).extend(batch)
+            return
+        if batch:
+            state['ranked'] = merge_ranked(state.get('ranked', []), self.rank(ctx, batch), self.top_k)
+            yield Event('partial', ranked=list(state['ranked']))
+
+    def finish(self, ctx:RunContext) -> Iterator:
+        state = ctx.state(self.name)
+        pending = state.pop('pending', [])
+        if pending:
+            yield Event('score_start', candidates=len(pending), corpus=len(ctx.corpus))
+            state['ranked'] = self.rank(ctx, pending)
+        ranked = state.get('ranked', [])
+        yield Event('scored', count=len(ranked), max_score=ranked[0].score if ranked else 0)
+        yield ranked
+
+class EnrichStage(Stage):
+    """Computes `enrich(paper)` for every ranked paper into `ctx.state(name)[arxiv_id]`; failures give None."""
+    def __init__(self, name:str, enrich:Callable[[ArxivPaper], Any], report_every:int=10):
+        self.name = name
+        self.enrich = enrich
+        self.report_every = report_every
+
+    def process(self, ctx:RunContext, papers:list[ArxivPaper]) -> Iterator:
+        results = ctx.state(self.name)
+        for i, paper in enumerate(papers, 1):
+            try:
+                results[paper.arxiv_id] = self.enrich(paper)
+            except Exception as e:
+                logger.debug(f"Failed to get {self.name} for {paper.arxiv_id}: {e}")
+                results[paper.arxiv_id] = None
+            if i % self.report_every == 0:
+                yield Event('enrich', stage=self.name, done=i, total=len(papers))
+        yield papers
+
+class FormatStage(Stage):
+    """Turns ranked papers into the caller's output records with `format(ctx, paper)`."""
+    name = 'format'
+
+    def __init__(self, format:Callable[[RunContext, ArxivPaper], Any]):
+        self.format = format
+
+    def process(self, ctx:RunContext, papers:list[ArxivPaper]) -> Iterator:
+        yield [self.format(ctx, paper) for paper in papers]
@@ -0,0 +1,115 @@
+"""Background pre-warming of recommendation results after the daily arXiv announcement.
+
+Every ``interval`` seconds the prewarmer asks for the recommendation targets of
+recently active users and checks, once per arXiv query, when the query's feed was
+last updated. Targets whose cached result is older than the latest feed are
+recomputed one at a time, at most ``max_targets`` per cycle with a pause between
+them, so the first visit of the day hits the cache. Each warm-up is timed and kept
+in a short history for the stats endpoint.
+
+Staleness comes from comparing timestamps rather than from state kept in memory,
+so a restart neither misses an announcement nor warms results that are already fresh.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable
+from loguru import logger
+
+class Prewarmer:
+    def __init__(self, feed_time:Callable[[str], float|None], targets:Callable[[], list[dict]], warm:Callable[[dict], bool],
+                 interval:float=900, pause:float=5, max_targets:int=20, busy:Callable[[], bool]|None=None, history:int=100):
+        self.feed_time = feed_time
+        self.targets = targets
+        self.warm = warm
+        self.interval = interval
+        self.pause = pause
+        self.max_targets = max_targets
+        # warm-ups yield to user requests: a cycle stops early while this returns True
+        self.busy = busy
+        self.history = deque(maxlen=history)
+        self.last_check = None
+        # cache key -> feed time it last failed for; not retried until the feed changes
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def stale_targets(self) -> list[tuple[dict, float]]:
+        stale = []
+        feed_times = {}
+        targets = self.targets()
+        # forget the failures of targets no longer active
+        keys = {t['cache_key'] for t in targets}
+        self._failed = {k: v for k, v in self._failed.items() if k in keys}
+        for target in targets:
+            query = target['arxiv_query']
+            if query not in feed_times:
+                try:
+                    feed_times[query] = self.feed_time(query)
+                except Exception as e:
+                    logger.warning(f"预热：获取 {query} 的 RSS Feed 失败: {e}")
+                    feed_times[query] = None
+            updated = feed_times[query]
+            if updated is None or self._failed.get(target['cache_key']) == updated:
+                continue
+            if datetime.fromisoformat(target['cached_at']).timestamp() < updated:
+                stale.append((target, updated))
+        return stale
+
+    def run(self) -> int:
+        """One cycle; returns the number of targets warmed."""
+        with self._lock:
+            self.last_check = datetime.now().isoformat()
+            warmed = 0
+            for target, updated in self.stale_targets()[:self.max_targets]:
+                if self._stop.is_set() or (self.busy is not None and self.busy()):
+                    break
+                start = time.perf_counter()
+                try:
+                    ok = self.warm(target)
+                except Exception as e:
+                    logger.warning(f"预热推荐结果失败: {e}")
+                    ok = False
+                seconds = time.perf_counter() - start
+                if ok:
+                    warmed += 1
+                else:
+                    self._failed[target['cache_key']] = updated
+                self.history.append({
+                    'user_id': target['user_id'],
+                    'arxiv_query': target['arxiv_query'],
+                    'at': datetime.now().isoformat(),
+                    'seconds': round(seconds, 2),
+                    'success': ok,
+                })
+                logger.info(f"预热推荐结果（{target['arxiv_query']}）{'完成' if ok else '失败'}，用时 {seconds:.1f} 秒")
+                self._stop.wait(self.pause)
+            return warmed
+
+    def stats(self) -> dict:
+        history = list(self.history)
+        succeeded = [h['seconds'] for h in history if h['success']]
+        return {
+            'last_check': self.last_check,
+            'warmed': len(succeeded),
+            'failed': len(history) - len(succeeded),
+            'mean_seconds': round(sum(succeeded) / len(succeeded), 2) if succeeded else None,
+            'recent': history[-10:],
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        def loop():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.run()
+                except Exception as e:
+                    logger.warning(f"预热任务失败: {e}")
+        self._thread = threading.Thread(target=loop, daemon=True, name='prewarmer')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,142 @@
+"""Opt-in cProfile capture of the stages of one run.
+
+A ``RunProfiler`` is made active for the current thread with ``start()`` (or as a
+context manager). While it is active, every ``stage(name)`` block and every call
+of a function decorated with ``@profiled(name)`` is profiled into a cProfile
+profile per stage name; without an active profiler both cost one context
+variable lookup. Pipeline stages are profiled under their stage names.
+
+Nested stages are profiled separately: the outer stage's profiler is paused
+while an inner one runs, so ``render_email`` does not also contain the ``tldr``
+calls it makes. Wall times in the summary do include nested stages.
+
+``write()`` leaves one ``<stage>.prof`` file per stage (for ``pstats`` or
+snakeviz), ``summary.json`` and a human-readable ``summary.txt`` with the top
+functions of each stage in the run directory.
+
+Since Python 3.12 cProfile hooks into ``sys.monitoring``, which is process-wide:
+a second enabled profiler raises ``ValueError`` and a profile would pick up the
+calls of other threads. Only one run is therefore profiled at a time in a
+process; ``start(blocking=False)`` raises ``ProfilerBusy`` while another is.
+"""
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+_ACTIVE = ContextVar('profiler', default=None)
+# held by the one run being profiled in this process
+_RUN_LOCK = threading.Lock()
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+class RunProfiler:
+    def __init__(self, directory:str|Path, run_id:str|None=None, top:int=20):
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.directory = Path(directory) / self.run_id
+        # number of functions listed per stage in summary.txt
+        self.top = top
+        self.started = time.perf_counter()
+        self._profiles = {}
+        self._wall = {}
+        self._stack = []
+        self._token = None
+
+    def start(self, blocking:bool=True) -> 'RunProfiler':
+        """Activate for the current thread, waiting for (or with `blocking=False`, refusing) another profiled run."""
+        if not _RUN_LOCK.acquire(blocking=blocking):
+            raise ProfilerBusy("Another run is being profiled")
+        self._token = _ACTIVE.set(self)
+        return self
+
+    def stop(self):
+        if self._token is not None:
+            _ACTIVE.reset(self._token)
+            self._token = None
+            _RUN_LOCK.release()
+
+    @property
+    def running(self) -> bool:
+        return self._token is not None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @contextmanager
+    def stage(self, name:str):
+        if name in self._stack:
+            # re-entered (recursion): the outer call is already being profiled
+            yield
+            return
+        if self._stack:
+            self._profiles[self._stack[-1]].disable()
+        profile = self._profiles.setdefault(name, cProfile.Profile())
+        self._stack.append(name)
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            calls, seconds = self._wall.get(name, (0, 0.0))
+            self._wall[name] = (calls + 1, seconds + elapsed)
+            if self._stack:
+                self._profiles[self._stack[-1]].enable()
+
+    def summary(self) -> list[dict]:
+        total = time.perf_counter() - self.started
+        return [
+            {'stage': name, 'calls': calls, 'seconds': round(seconds, 4), 'share': round(seconds / total, 4) if total else 0}
+            for name, (calls, seconds) in sorted(self._wall.items(), key=lambda item: -item[1][1])
+        ]
+
+    def table(self) -> str:
+        rows = self.summary()
+        lines = [f"{'stage':<20} {'calls':>7} {'seconds':>10} {'share':>7}"]
+        lines += [f"{r['stage']:<20} {r['calls']:>7} {r['seconds']:>10.3f} {r['share']:>7.1%}" for r in rows]
+        return '\n'.join(lines)
+
+    def write(self) -> Path:
+        """Dump the profiles and summaries of the stages run so far; returns the run directory."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        report = [f'Run {self.run_id}', '', self.table()]
+        for name, profile in self._profiles.items():
+            profile.dump_stats(str(self.directory / f'{name}.prof'))
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(self.top)
+            report += ['', f'== {name} ==', out.getvalue().strip()]
+        with open(self.directory / 'summary.json', 'w', encoding='utf-8') as f:
+            json.dump({'run_id': self.run_id, 'stages': self.summary()}, f, indent=2)
+        with open(self.directory / 'summary.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(report) + '\n')
+        return self.directory
+
+def active() -> RunProfiler|None:
+    return _ACTIVE.get()
+
+def stage(name:str):
+    """Profile the block as stage `name` if a profiler is active in this thread."""
+    profiler = _ACTIVE.get()
+    return profiler.stage(name) if profiler is not None else nullcontext()
+
+def profiled(name:str):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,19 +1,252 @@
+import os
+import hashlib
+import platform
+import shutil
+import threading
+import time
 import numpy as np
+from pathlib import Path
 from sentence_transformers import SentenceTransformer
 from paper import ArxivPaper
+from embedding_store import EmbeddingStore
+from embedding_cache import GLOBAL_EMBEDDING_CACHE, EmbeddingCache
+from interest_index import InterestIndex, get_interest_index
 from datetime import datetime
+from loguru import logger
 
-def rerank_paper(candidate:list[ArxivPaper],corpus:list[dict],model:str='avsolatorio/GIST-small-Embedding-v0') -> list[ArxivPaper]:
-    encoder = SentenceTransformer(model)
+EMBEDDING_MODEL = 'avsolatorio/GIST-small-Embedding-v0'
+ENCODER_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+# exported ONNX models are written here once and reused by every later run
+ONNX_MODEL_DIR = Path(os.getenv('ONNX_MODEL_DIR', Path(__file__).parent / 'cache' / 'onnx'))
+# quantization target of the int8 backend: arm64, avx2, avx512 or avx512_vnni; defaults to the host's architecture
+ONNX_QUANTIZATION = os.getenv('ONNX_QUANTIZATION') or ('arm64' if platform.machine().lower() in ('arm64', 'aarch64') else 'avx2')
+
+_ENCODERS = {}
+# loading is slow and memory-hungry: concurrent first requests wait for one load
+_ENCODERS_LOCK = threading.Lock()
+
+def _export_onnx(model:str, backend:str) -> tuple[Path,str]:
+    # exports go to a temporary directory first, so other threads and processes never load a half-written model
+    export_dir = ONNX_MODEL_DIR / model.replace('/', '__')
+    tmp = export_dir.with_name(f'{export_dir.name}.tmp{os.getpid()}_{threading.get_ident()}')
+    exported = next(export_dir.glob('**/model.onnx'), None)
+    if exported is None:
+        logger.info(f"Exporting {model} to ONNX at {export_dir}...")
+        SentenceTransformer(model, backend='onnx', device='cpu').save_pretrained(str(tmp))
+        try:
+            os.replace(tmp, export_dir)
+        except OSError:
+            # another process finished its export first
+            shutil.rmtree(tmp, ignore_errors=True)
+        exported = next(export_dir.glob('**/model.onnx'))
+    file_name = exported.relative_to(export_dir).as_posix()
+    if backend == 'onnx-int8':
+        quantized = f'onnx/model_qint8_{ONNX_QUANTIZATION}.onnx'
+        if not (export_dir / quantized).exists():
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            logger.info(f"Quantizing {model} to int8 ({ONNX_QUANTIZATION})...")
+            onnx_model = SentenceTransformer(str(export_dir), backend='onnx', device='cpu', model_kwargs={'file_name': file_name})
+            try:
+                export_dynamic_quantized_onnx_model(onnx_model, ONNX_QUANTIZATION, str(tmp))
+                os.replace(next(tmp.glob(f'**/model_qint8_{ONNX_QUANTIZATION}.onnx')), export_dir / quantized)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+        file_name = quantized
+    return export_dir, file_name
+
+def get_encoder(model:str=EMBEDDING_MODEL, backend:str='torch') -> SentenceTransformer:
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {backend}. Choose from {ENCODER_BACKENDS}.")
+    with _ENCODERS_LOCK:
+        if (model, backend) in _ENCODERS:
+            return _ENCODERS[(model, backend)]
+        if backend == 'torch':
+            encoder = SentenceTransformer(model)
+        else:
+            try:
+                import onnxruntime  # noqa: F401
+            except ImportError as e:
+                raise ImportError(f"Encoder backend '{backend}' requires onnxruntime. Install it with `uv sync --extra onnx`.") from e
+            export_dir, file_name = _export_onnx(model, backend)
+            encoder = SentenceTransformer(str(export_dir), backend='onnx', device='cpu', model_kwargs={'file_name': file_name, 'provider': 'CPUExecutionProvider'})
+        _ENCODERS[(model, backend)] = encoder
+        return encoder
+
+def loaded_encoders() -> list[tuple[str,str]]:
+    return list(_ENCODERS)
+
+def encode_texts(encoder:SentenceTransformer, texts:list[str], model_id:str, cache:EmbeddingCache=GLOBAL_EMBEDDING_CACHE) -> np.ndarray:
+    if cache is None or cache.max_bytes <= 0:
+        return encoder.encode(texts)
+    keys = [cache.key(model_id, t) for t in texts]
+    vectors = [cache.get(k) for k in keys]
+    # identical texts within one call are encoded once as well
+    pending = {}
+    for i, v in enumerate(vectors):
+        if v is None:
+            pending.setdefault(keys[i], i)
+    if pending:
+        new_feature = encoder.encode([texts[i] for i in pending.values()])
+        for k, v in zip(pending, new_feature):
+            cache.put(k, v)
+        fresh = dict(zip(pending, new_feature))
+        vectors = [fresh[k] if v is None else v for k, v in zip(keys, vectors)]
+    if not vectors:
+        return encoder.encode(texts)
+    return np.stack(vectors).astype(np.float32, copy=False)
+
+def encode_corpus(encoder:SentenceTransformer, corpus:list[dict], model_id:str, store_path:str|Path=None, store_dtype:str='float16') -> np.ndarray:
+    texts = [paper['data']['abstractNote'] for paper in corpus]
+    if store_path is None:
+        return encode_texts(encoder, texts, model_id)
+    keys = [paper['key'] for paper in corpus]
+    versions = [paper['data'].get('version', 0) for paper in corpus]
+    store = EmbeddingStore.load(store_path)
+    if store is not None and (store.model != model_id or store.dtype != store_dtype):
+        store = None
+    rows = store.match(keys, versions) if store is not None else np.full(len(corpus), -1)
+    missing = np.flatnonzero(rows < 0)
+    if len(missing) == 0:
+        if np.array_equal(rows, np.arange(len(rows))):
+            return store.rows(slice(0, len(rows)))
+        return store.rows(rows)
+    logger.debug(f"Encoding {len(missing)} of {len(corpus)} corpus papers missing from the embedding store.")
+    new_feature = encode_texts(encoder, [texts[i] for i in missing], model_id)
+    feature = np.empty((len(corpus), new_feature.shape[1]), dtype=np.float32)
+    feature[missing] = new_feature
+    found = rows >= 0
+    if found.any():
+        feature[found] = store.rows(rows[found])
+    # keep rows of papers outside this corpus (e.g. unselected ones) for later runs
+    keep = []
+    if store is not None:
+        current = set(keys)
+        keep = [r for r, k in enumerate(store.keys) if k not in current]
+    EmbeddingStore.save(
+        store_path, model_id,
+        keys + [store.keys[r] for r in keep],
+        versions + [store.versions[r] for r in keep],
+        np.concatenate([feature, store.rows(np.array(keep))]) if keep else feature,
+        store_dtype,
+    )
+    return feature
+
+def sort_corpus(corpus:list[dict]) -> list[dict]:
     #sort corpus by date, from newest to oldest
-    corpus = sorted(corpus,key=lambda x: datetime.strptime(x['data']['dateAdded'], '%Y-%m-%dT%H:%M:%SZ'),reverse=True)
-    time_decay_weight = 1 / (1 + np.log10(np.arange(len(corpus)) + 1))
-    time_decay_weight = time_decay_weight / time_decay_weight.sum()
-    corpus_feature = encoder.encode([paper['data']['abstractNote'] for paper in corpus])
-    candidate_feature = encoder.encode([paper.summary for paper in candidate])
-    sim = encoder.similarity(candidate_feature,corpus_feature) # [n_candidate, n_corpus]
-    scores = (sim * time_decay_weight).sum(axis=1) * 10 # [n_candidate]
-    for s,c in zip(scores,candidate):
-        c.score = s.item()
-    candidate = sorted(candidate,key=lambda x: x.score,reverse=True)
-    return candidate
\ No newline at end of file
+    return sorted(corpus,key=lambda x: datetime.strptime(x['data']['dateAdded'], '%Y-%m-%dT%H:%M:%SZ'),reverse=True)
+
+def time_decay_weights(n:int) -> np.ndarray:
+    time_decay_weight = 1 / (1 + np.log10(np.arange(n) + 1))
+    return time_decay_weight / time_decay_weight.sum()
+
+def corpus_fingerprint(corpus:list[dict]) -> str:
+    """Identifies the papers, versions and newest-first order a profile vector was built from."""
+    h = hashlib.sha1()
+    for paper in sort_corpus(corpus):
+        h.update(f"{paper['key']}:{paper['data'].get('version', 0)}\n".encode())
+    return h.hexdigest()
+
+def _normalize(x:np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+def profile_vector(corpus_feature:np.ndarray, weights:np.ndarray) -> np.ndarray:
+    # sum_j w_j cos(c, x_j) == normalize(c) @ sum_j w_j normalize(x_j), so one vector scores exactly
+    return (_normalize(np.asarray(corpus_feature, dtype=np.float32)).T @ weights.astype(np.float32)).astype(np.float32)
+
+def corpus_profile(corpus:list[dict],model:str=EMBEDDING_MODEL,backend:str='torch',corpus_store:str|Path=None,store_dtype:str='float16') -> np.ndarray|None:
+    """Time-weighted profile vector of the corpus, or None if the model's similarity is not cosine."""
+    encoder = get_encoder(model, backend)
+    if encoder.similarity_fn_name != 'cosine' or len(corpus) == 0:
+        return None
+    corpus = sort_corpus(corpus)
+    corpus_feature = encode_corpus(encoder, corpus, f'{model}:{backend}', corpus_store, store_dtype)
+    return profile_vector(corpus_feature, time_decay_weights(len(corpus)))
+
+class TopK:
+    """Running top-k of (index, score) pairs fed chunk by chunk, holding at most k + chunk entries."""
+    def __init__(self, k:int):
+        self.k = k
+        self.index = np.empty(0, dtype=np.int64)
+        self.scores = np.empty(0, dtype=np.float32)
+
+    def push(self, index:np.ndarray, scores:np.ndarray):
+        self.index = np.concatenate([self.index, index])
+        self.scores = np.concatenate([self.scores, np.asarray(scores, dtype=np.float32)])
+        if len(self.scores) > self.k:
+            keep = np.argpartition(-self.scores, self.k - 1)[:self.k]
+            self.index, self.scores = self.index[keep], self.scores[keep]
+
+    def result(self) -> tuple[np.ndarray, np.ndarray]:
+        # highest score first, ties keep the original candidate order
+        order = np.lexsort((self.index, -self.scores))
+        return self.index[order], self.scores[order]
+
+def rerank_paper(candidate:list[ArxivPaper],corpus:list[dict],model:str=EMBEDDING_MODEL,backend:str='torch',corpus_store:str|Path=None,store_dtype:str='float16',n_centroids:int=0,index_key:str=None,top_k:int=None,chunk_size:int=256,profile:np.ndarray=None,known_scores:dict[str,float]=None,timings:dict[str,float]=None) -> list[ArxivPaper]:
+    """Score candidates against the corpus and return the best `top_k` (all if None or -1), highest first.
+
+    Candidates are encoded and scored `chunk_size` at a time, so peak memory depends on
+    the chunk size rather than on the size of the candidate pool. Only the returned
+    papers get a `score`. A `profile` from `corpus_profile` of the same corpus skips
+    encoding the corpus altogether.
+
+    `known_scores` maps arXiv IDs to scores computed earlier against the same profile.
+    Those candidates are not encoded again, and the scores of the others are added to it.
+    Seconds spent encoding (corpus and candidates) and scoring are added to `timings`.
+    """
+    if len(candidate) == 0:
+        return []
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+    encoder = get_encoder(model, backend)
+    model_id = f'{model}:{backend}'
+    use_centroids = 0 < n_centroids < len(corpus)
+    if profile is None and not use_centroids:
+        profile = corpus_profile(corpus, model, backend, corpus_store, store_dtype)
+    if profile is not None and not use_centroids:
+        def score(candidate_feature):
+            return _normalize(np.asarray(candidate_feature, dtype=np.float32)) @ profile * 10
+    else:
+        corpus = sort_corpus(corpus)
+        time_decay_weight = time_decay_weights(len(corpus))
+        corpus_feature = encode_corpus(encoder, corpus, model_id, corpus_store, store_dtype)
+    timings['encode'] = timings.get('encode', 0.0) + time.perf_counter() - start
+    start = time.perf_counter()
+    if use_centroids:
+        # soft maximum over k weighted centroids: separate research threads are not averaged into one profile
+        index = get_interest_index(index_key, n_centroids) if index_key else InterestIndex(n_centroids)
+        index.update([paper['key'] for paper in corpus], corpus_feature, time_decay_weight)
+        score = index.score
+    elif profile is None:
+        # non-cosine similarity: no profile vector, compare with every corpus paper
+        def score(candidate_feature):
+            sim = encoder.similarity(candidate_feature,corpus_feature) # [chunk_size, n_corpus]
+            return np.asarray((sim * time_decay_weight).sum(axis=1) * 10) # [chunk_size]
+    k = len(candidate) if top_k is None or top_k < 0 else min(top_k, len(candidate))
+    top = TopK(k)
+    unseen = np.arange(len(candidate))
+    if known_scores:
+        is_known = np.array([paper.arxiv_id in known_scores for paper in candidate])
+        top.push(unseen[is_known], np.array([known_scores[candidate[i].arxiv_id] for i in unseen[is_known]], dtype=np.float32))
+        unseen = unseen[~is_known]
+    timings['score'] = timings.get('score', 0.0) + time.perf_counter() - start
+    for offset in range(0, len(unseen), chunk_size):
+        rows = unseen[offset:offset + chunk_size]
+        chunk = [candidate[i] for i in rows]
+        start = time.perf_counter()
+        candidate_feature = encode_texts(encoder, [paper.summary for paper in chunk], model_id)
+        encoded = time.perf_counter()
+        chunk_score = score(candidate_feature)
+        timings['encode'] += encoded - start
+        timings['score'] += time.perf_counter() - encoded
+        top.push(rows, chunk_score)
+        if known_scores is not None:
+            known_scores.update(zip([paper.arxiv_id for paper in chunk], np.asarray(chunk_score, dtype=float).tolist()))
+    ranked = []
+    for i, s in zip(*top.result()):
+        candidate[i].score = float(s)
+        ranked.append(candidate[i])
+    stats = GLOBAL_EMBEDDING_CACHE.stats()
+    logger.debug(f"Embedding cache: {stats['entries']} entries, {stats['bytes'] / 2**20:.1f} MB, hit rate {stats['hit_rate']:.1%}")
+    return ranked
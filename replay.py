@@ -0,0 +1,255 @@
+"""Record and replay of outgoing HTTP traffic, for offline and deterministic runs.
+
+``install`` patches the three HTTP stacks the app goes through: requests (arXiv
+API, Zotero, paperswithcode), httpx (OpenAI) and urllib (arXiv RSS feeds via
+feedparser, arXiv source tarballs). In ``record`` mode requests go out as usual
+and every response is saved under ``directory/<host>/``; in ``replay`` mode the
+saved responses are served instead and anything not recorded fails like a
+network error; ``auto`` replays what it has and records the rest.
+
+Fixtures are keyed by method, URL and a hash of the request body, so OpenAI calls
+with different prompts are told apart. Repeated requests replay their recordings
+in order and then keep serving the last one. Request headers (API keys) are never
+written, and ``key``/``api_key`` query parameters are dropped from the stored URL.
+
+``latency`` models production timings on replay: ``host=seconds`` pairs separated
+by commas, with ``*`` for every other host and ``recorded`` in place of seconds to
+wait as long as the original response took, e.g.
+``export.arxiv.org=0.8,api.openai.com=recorded,*=0.05``.
+"""
+import base64
+import hashlib
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+import urllib.response
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from loguru import logger
+
+MODES = ('record', 'replay', 'auto')
+SECRET_PARAMS = {'key', 'api_key', 'apikey'}
+# requests and httpx hand out decoded bodies, so these no longer describe them
+DECODED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+class ReplayMiss(Exception):
+    pass
+
+def normalize_url(url:str) -> str:
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in SECRET_PARAMS)
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+def parse_latency(spec:str|None) -> dict[str, float|str]:
+    latency = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        host, _, value = item.partition('=')
+        value = value.strip()
+        latency[host.strip().lower()] = 'recorded' if value == 'recorded' else float(value)
+    return latency
+
+class Recorder:
+    def __init__(self, mode:str, directory:str|Path, latency:dict[str, float|str]|None=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown replay mode: {mode}. Choose from {MODES}.")
+        self.mode = mode
+        self.directory = Path(directory)
+        self.latency = latency or {}
+        self._lock = threading.Lock()
+        self._served = {}
+        # keys recorded by this process; a new recording replaces the fixture on disk
+        self._recorded = set()
+        self.counts = {'hits': 0, 'misses': 0, 'recorded': 0}
+
+    def key(self, method:str, url:str, body:bytes|str|None) -> tuple[str, Path]:
+        if isinstance(body, str):
+            body = body.encode()
+        url = normalize_url(url)
+        digest = hashlib.sha1(f'{method.upper()} {url}\n'.encode() + (body or b'')).hexdigest()
+        return url, self.directory / (urlsplit(url).hostname or 'local') / f'{digest[:20]}.json'
+
+    def lookup(self, path:Path) -> dict|None:
+        """The next recording of a request, or None if there is none to replay."""
+        if self.mode == 'record':
+            return None
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    recordings = json.load(f)['responses']
+            except FileNotFoundError:
+                self.counts['misses'] += 1
+                return None
+            n = self._served.get(path, 0)
+            self._served[path] = n + 1
+            self.counts['hits'] += 1
+        recording = recordings[min(n, len(recordings) - 1)]
+        self._wait(urlsplit(recording['url']).hostname or '', recording['elapsed'])
+        return recording
+
+    def _wait(self, host:str, elapsed:float):
+        delay = self.latency.get(host.lower(), self.latency.get('*', 0))
+        delay = elapsed if delay == 'recorded' else delay
+        if delay:
+            time.sleep(delay)
+
+    def save(self, path:Path, method:str, url:str, status:int, reason:str, headers:list[tuple[str, str]], body:bytes, elapsed:float, error:bool=False):
+        recording = {
+            'url': url,
+            'status': status,
+            'reason': reason,
+            'headers': [[k, v] for k, v in headers if k.lower() != 'set-cookie'],
+            'body': base64.b64encode(body).decode(),
+            'elapsed': round(elapsed, 4),
+            'error': error,
+            'recorded_at': datetime.now().isoformat(),
+        }
+        with self._lock:
+            if path in self._recorded and path.exists():
+                with open(path, 'r', encoding='utf-8') as f:
+                    fixture = json.load(f)
+            else:
+                fixture = {'method': method.upper(), 'url': url, 'responses': []}
+            fixture['responses'].append(recording)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f'.tmp{os.getpid()}')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(fixture, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, path)
+            self._recorded.add(path)
+            self.counts['recorded'] += 1
+
+    def miss(self, method:str, url:str) -> ReplayMiss|None:
+        """The error to raise for an unrecorded request, None if it may go out."""
+        if self.mode != 'replay':
+            return None
+        logger.warning(f"Replay: no recording for {method.upper()} {url}")
+        return ReplayMiss(f"No recording for {method.upper()} {url} in {self.directory}")
+
+    def stats(self) -> dict:
+        return {'mode': self.mode, 'directory': str(self.directory), **self.counts}
+
+def _patch_requests(recorder:Recorder):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+    original = HTTPAdapter.send
+
+    def send(adapter, request, **kwargs):
+        url, path = recorder.key(request.method, request.url, request.body)
+        recording = recorder.lookup(path)
+        if recording is None:
+            if (error := recorder.miss(request.method, url)) is not None:
+                raise requests.exceptions.ConnectionError(str(error), request=request)
+            start = time.perf_counter()
+            response = original(adapter, request, **kwargs)
+            body = response.content
+            headers = [(k, v) for k, v in response.headers.items() if k.lower() not in DECODED_HEADERS]
+            recorder.save(path, request.method, url, response.status_code, response.reason or '', headers, body, time.perf_counter() - start)
+            return response
+        response = requests.Response()
+        response.status_code = recording['status']
+        response.reason = recording['reason']
+        response.headers = CaseInsensitiveDict(recording['headers'])
+        response._content = base64.b64decode(recording['body'])
+        response._content_consumed = True
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = adapter
+        return response
+
+    HTTPAdapter.send = send
+
+def _patch_httpx(recorder:Recorder):
+    import httpx
+    original = httpx.HTTPTransport.handle_request
+
+    def handle_request(transport, request):
+        url, path = recorder.key(request.method, str(request.url), request.read())
+        recording = recorder.lookup(path)
+        if recording is None:
+            if (error := recorder.miss(request.method, url)) is not None:
+                raise httpx.ConnectError(str(error), request=request)
+            start = time.perf_counter()
+            response = original(transport, request)
+            try:
+                body = response.read()
+            finally:
+                response.close()
+            headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in DECODED_HEADERS]
+            recorder.save(path, request.method, url, response.status_code, response.reason_phrase, headers, body, time.perf_counter() - start)
+            return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+        return httpx.Response(recording['status'], headers=recording['headers'], content=base64.b64decode(recording['body']), request=request)
+
+    httpx.HTTPTransport.handle_request = handle_request
+
+def _urllib_response(recording:dict):
+    headers = http.client.HTTPMessage()
+    for k, v in recording['headers']:
+        headers[k] = v
+    body = io.BytesIO(base64.b64decode(recording['body']))
+    if recording['error']:
+        return urllib.error.HTTPError(recording['url'], recording['status'], recording['reason'], headers, body)
+    return urllib.response.addinfourl(body, headers, recording['url'], recording['status'])
+
+def _patch_urllib(recorder:Recorder):
+    original = urllib.request.OpenerDirector.open
+
+    def open(opener, fullurl, data=None, *args, **kwargs):
+        request = fullurl if isinstance(fullurl, urllib.request.Request) else urllib.request.Request(fullurl, data)
+        body = data if data is not None else request.data
+        if request.type not in ('http', 'https'):
+            return original(opener, fullurl, data, *args, **kwargs)
+        method = request.get_method()
+        url, path = recorder.key(method, request.full_url, body)
+        recording = recorder.lookup(path)
+        if recording is None:
+            if (error := recorder.miss(method, url)) is not None:
+                raise urllib.error.URLError(str(error))
+            start = time.perf_counter()
+            try:
+                response = original(opener, fullurl, data, *args, **kwargs)
+            except urllib.error.HTTPError as e:
+                # keep 404s for source tarballs and the like: they are part of the run
+                recording = {'url': e.geturl() or request.full_url, 'status': e.code, 'reason': str(e.reason), 'headers': list(e.headers.items()), 'body': e.read(), 'error': True}
+            else:
+                with response:
+                    recording = {'url': response.geturl(), 'status': response.status, 'reason': response.reason, 'headers': list(response.headers.items()), 'body': response.read(), 'error': False}
+            recorder.save(path, method, url, recording['status'], recording['reason'], recording['headers'], recording['body'], time.perf_counter() - start, recording['error'])
+            recording['body'] = base64.b64encode(recording['body']).decode()
+        response = _urllib_response(recording)
+        if isinstance(response, urllib.error.HTTPError):
+            raise response
+        return response
+
+    urllib.request.OpenerDirector.open = open
+
+_RECORDER = None
+
+def install(mode:str, directory:str|Path='replay', latency:str|None=None) -> Recorder:
+    """Patch the HTTP clients once per process; later calls return the active recorder."""
+    global _RECORDER
+    if _RECORDER is not None:
+        return _RECORDER
+    recorder = Recorder(mode, directory, parse_latency(latency))
+    _patch_urllib(recorder)
+    for patch in (_patch_requests, _patch_httpx):
+        try:
+            patch(recorder)
+        except ImportError:
+            pass
+    _RECORDER = recorder
+    logger.info(f"HTTP {mode} mode, fixtures in {recorder.directory}")
+    return recorder
+
+def get_recorder() -> Recorder|None:
+    return _RECORDER
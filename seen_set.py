@@ -0,0 +1,100 @@
+"""Persistent per-user set of the arXiv papers already delivered.
+
+Cross-listed and replaced papers come back in later RSS feeds, and the holiday
+fallback serves recent entries again. A ``SeenSet`` remembers, for every arXiv ID
+without its version, the highest version delivered and the announcement day it
+was first delivered on, so later runs drop those papers before fetching and
+embedding them.
+
+Papers delivered on the current announcement day stay in: running again on the
+same day (another tab, another reference set, a forced refresh) returns the same
+candidates. With ``show_updated``, a newer version than the one delivered passes
+as well.
+
+The file holds one ``<id> <version> <day>`` line per delivery and is only
+appended to; it is rewritten without superseded lines once those make up most
+of it. A few thousand papers a year fit in a dict and a few hundred kilobytes,
+so no probabilistic structure is needed.
+"""
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+def split_version(arxiv_id:str) -> tuple[str, int]:
+    """``2501.01234v2`` -> (``2501.01234``, 2); 0 when the ID has no version."""
+    match = re.match(r'^(.*?)v(\d+)$', arxiv_id)
+    return (match.group(1), int(match.group(2))) if match else (arxiv_id, 0)
+
+class SeenSet:
+    def __init__(self, path:str|Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._seen = {}
+        self._lines = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 3:
+                        # torn last line of an interrupted append
+                        continue
+                    self._lines += 1
+                    self._merge(parts[0], int(parts[1]), parts[2])
+        except FileNotFoundError:
+            pass
+
+    def _merge(self, base:str, version:int, day:str):
+        old = self._seen.get(base)
+        self._seen[base] = (max(version, old[0]), min(day, old[1])) if old else (version, day)
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def __contains__(self, arxiv_id:str) -> bool:
+        return split_version(arxiv_id)[0] in self._seen
+
+    def unseen(self, arxiv_ids:list[str], day:str, show_updated:bool=False) -> list[str]:
+        """The IDs not delivered before `day` (YYYY-MM-DD), plus newer versions if `show_updated`."""
+        kept = []
+        with self._lock:
+            for arxiv_id in arxiv_ids:
+                base, version = split_version(arxiv_id)
+                seen = self._seen.get(base)
+                if seen is None or seen[1] >= day or (show_updated and version > seen[0]):
+                    kept.append(arxiv_id)
+        return kept
+
+    def add(self, arxiv_ids:list[str], day:str|None=None) -> int:
+        """Record the IDs as delivered on `day` (default today); returns how many changed the set."""
+        day = day or time.strftime('%Y-%m-%d')
+        with self._lock:
+            lines = []
+            for arxiv_id in arxiv_ids:
+                base, version = split_version(arxiv_id)
+                old = self._seen.get(base)
+                if old is not None and old[0] >= version and old[1] <= day:
+                    continue
+                self._merge(base, version, day)
+                lines.append(f'{base} {version} {day}\n')
+            if not lines:
+                return 0
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._lines += len(lines)
+            if self._lines > 2 * len(self._seen) + 1000:
+                self._compact()
+            else:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.writelines(lines)
+            return len(lines)
+
+    def _compact(self):
+        tmp = self.path.with_name(f'{self.path.name}.tmp{os.getpid()}')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines(f'{base} {version} {day}\n' for base, (version, day) in self._seen.items())
+        os.replace(tmp, self.path)
+        self._lines = len(self._seen)
@@ -0,0 +1,111 @@
+"""Request coalescing for duplicate concurrent work.
+
+``SingleFlight.do`` runs one call per key at a time: callers arriving while a call
+with the same key is in flight wait for it and share its result (or exception).
+
+``StreamFlight.stream`` does the same for streaming producers such as the SSE
+recommendation pipeline. The producer runs once in a background thread and
+publishes its events to a job; every subscriber replays the events published so
+far and then follows the live stream until the job finishes.
+"""
+import threading
+from typing import Any, Callable, Hashable, Iterator
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key:Hashable, fn:Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+class StreamJob:
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self._cond = threading.Condition()
+
+    def publish(self, event):
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def subscribe(self) -> Iterator:
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.events) and not self.finished:
+                    self._cond.wait()
+                events = self.events[i:]
+                finished = self.finished
+            yield from events
+            i += len(events)
+            if finished and i >= len(self.events):
+                return
+
+class StreamFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def stream(self, key:Hashable, produce:Callable[[Callable[[Any], None]], None]) -> Iterator:
+        """Subscribe to the job for `key`, starting `produce(publish)` in a thread if none is running."""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._jobs[key] = StreamJob()
+                threading.Thread(target=self._run, args=(key, job, produce), daemon=True).start()
+        return job.subscribe()
+
+    def join(self, key:Hashable) -> Iterator|None:
+        """Subscribe to the job for `key` if one is running, without starting one."""
+        with self._lock:
+            job = self._jobs.get(key)
+        return job.subscribe() if job is not None else None
+
+    def _run(self, key:Hashable, job:StreamJob, produce:Callable):
+        try:
+            produce(job.publish)
+        finally:
+            # new requests start a fresh job from here on; current subscribers still drain this one
+            with self._lock:
+                del self._jobs[key]
+            job.finish()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._jobs)
@@ -667,7 +667,7 @@ function resetRecommendationSettings() {
 }
 
 // 加载推荐论文（使用 SSE 流式更新）
-function loadRecommendations(forceRefresh = false) {
+async function loadRecommendations(forceRefresh = false) {
     const loadingEl = document.getElementById('recommendations-loading');
     const papersEl = document.getElementById('recommendations-papers');
     const emptyEl = document.getElementById('recommendations-empty');
@@ -689,25 +689,47 @@ function loadRecommendations(forceRefresh = false) {
     // 构建请求 URL
     const params = new URLSearchParams({
         arxiv_query: recommendationSettings.arxivQuery,
-        force_refresh: forceRefresh ? 'true' : 'false'
+        force_refresh: forceRefresh ? 'true' : 'false',
+        progressive: 'true'
     });
     
     if (recommendationSettings.dateRange) {
         params.append('date_range', recommendationSettings.dateRange);
     }
     
-    // 添加选中的文章 key 列表
+    // 选中的文章先保存为服务器端参考集，URL 中只传参考集名称（避免选中文章过多时 URL 超长）
     if (recommendationSettings.selectedPaperKeys && recommendationSettings.selectedPaperKeys.length > 0) {
-        params.append('selected_paper_keys', recommendationSettings.selectedPaperKeys.join(','));
+        try {
+            const response = await fetch('/api/reference-sets', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ paper_keys: recommendationSettings.selectedPaperKeys })
+            });
+            const data = await response.json();
+            if (!data.success) {
+                throw new Error(data.error);
+            }
+            params.append('reference_set', data.name);
+        } catch (error) {
+            console.error('保存参考集失败:', error);
+            params.append('selected_paper_keys', recommendationSettings.selectedPaperKeys.join(','));
+        }
     }
     
     // 使用 EventSource 接收 SSE 流
     const eventSource = new EventSource(`/api/recommendations/stream?${params.toString()}`);
+    const partialPapers = {};  // 渐进模式下已收到的论文，按 arxiv_id 索引
     
     eventSource.onmessage = function(event) {
         try {
             const data = JSON.parse(event.data);
             
+            // 渐进结果：合并新进入前 N 的论文，按最新排名重新渲染
+            if (data.partial) {
+                data.added.forEach(paper => { partialPapers[paper.arxiv_id] = paper; });
+                renderRecommendations(data.ranking.map(id => partialPapers[id]).filter(Boolean));
+            }
+            
             // 更新进度
             if (data.progress !== undefined) {
                 progressBar.style.width = data.progress + '%';
@@ -796,11 +818,50 @@ function renderRecommendations(papers) {
                 <a href="${paper.pdf_url}" target="_blank" class="btn btn-primary">查看 PDF</a>
                 ${paper.code_url ? `<a href="${paper.code_url}" target="_blank" class="btn btn-secondary">代码</a>` : ''}
                 <a href="https://arxiv.org/abs/${paper.arxiv_id}" target="_blank" class="btn btn-secondary">ArXiv</a>
+                <button class="btn btn-secondary" onclick="loadTldr(this, '${paper.arxiv_id}')">TLDR</button>
             </div>
+            <div class="paper-tldr" style="display: none;"></div>
         </div>
     `).join('');
 }
 
+// 展开卡片时按需生成 TLDR，逐 token 显示
+function loadTldr(button, arxivId) {
+    const tldrEl = button.closest('.paper-card').querySelector('.paper-tldr');
+    if (tldrEl.dataset.loaded) {
+        tldrEl.style.display = tldrEl.style.display === 'none' ? 'block' : 'none';
+        return;
+    }
+    tldrEl.style.display = 'block';
+    tldrEl.textContent = '正在生成 TLDR...';
+    button.disabled = true;
+    let text = '';
+    const eventSource = new EventSource(`/api/papers/${encodeURIComponent(arxivId)}/tldr`);
+    eventSource.onmessage = function(event) {
+        const data = JSON.parse(event.data);
+        if (data.message) {
+            if (!text) tldrEl.textContent = data.message;
+        } else if (data.token !== undefined) {
+            text += data.token;
+            tldrEl.textContent = text;
+        } else if (data.done) {
+            tldrEl.textContent = data.tldr;
+            tldrEl.dataset.loaded = 'true';
+            button.disabled = false;
+            eventSource.close();
+        } else if (data.success === false) {
+            tldrEl.textContent = `TLDR 生成失败: ${data.error || '未知错误'}`;
+            button.disabled = false;
+            eventSource.close();
+        }
+    };
+    eventSource.onerror = function() {
+        eventSource.close();
+        button.disabled = false;
+        if (!tldrEl.dataset.loaded) tldrEl.textContent = '连接中断，请重试';
+    };
+}
+
 // 更新进度统计信息
 let statsCache = {}; // 缓存统计信息，避免重复显示
 